@@ -0,0 +1,237 @@
+'''
+asyncio client of obs-websocket pipelining requests on one connection
+
+`AsyncClient` sends each request as soon as it is called and resolves its
+future when the response with the same request ID arrives, so that requests
+gathered by `asyncio.gather` take one round trip in total. Responses are
+converted like `obsws_python.ReqClient.send` and failures raise
+`OBSSDKRequestError`. Requests that may change OBS discard the cache of
+`helpers.SelectorUI` like the synchronous client does.
+
+Synchronous tests use `BackgroundClient`, which runs an `AsyncClient` on an
+event loop in a background thread::
+
+    client = asyncws.BackgroundClient.like(self.obs.get_obsws())
+    a, b = client.gather(
+            ('CallVendorRequest', {'vendorName': 'obs-loudness-dock', 'requestType': 'get_loudness',
+                                   'requestData': {'name': 'A'}}),
+            ('CallVendorRequest', {'vendorName': 'obs-loudness-dock', 'requestType': 'get_loudness',
+                                   'requestData': {'name': 'B'}}),
+    )
+'''
+
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import threading
+
+import websockets
+from obsws_python.error import OBSSDKRequestError
+from obsws_python.util import as_dataclass
+import helpers
+
+_OP_HELLO = 0
+_OP_IDENTIFY = 1
+_OP_IDENTIFIED = 2
+_OP_REQUEST = 6
+_OP_REQUEST_RESPONSE = 7
+
+
+def _authentication(password, auth):
+    secret = base64.b64encode(hashlib.sha256((password + auth['salt']).encode()).digest())
+    return base64.b64encode(hashlib.sha256(secret + auth['challenge'].encode()).digest()).decode()
+
+
+class _RecordingClient:
+    'Stands for `obsws_python.ReqClient` to capture the request `obsui` sends, or to return `response`'
+
+    def __init__(self, response=None):
+        self.request = None
+        self.response = response
+
+    def send(self, param, data=None, raw=False):
+        if self.response is None:
+            self.request = (param, data)
+            raise _Captured()
+        ok, code, comment, response_data = self.response
+        if not ok:
+            raise OBSSDKRequestError(param, code, comment)
+        if raw:
+            return response_data
+        return as_dataclass(param, response_data) if response_data is not None else None
+
+
+class _Captured(Exception):
+    pass
+
+
+class AsyncClient:
+    '''
+    Pipelining client of obs-websocket v5
+
+    :param host:      Host name
+    :param port:      Port number
+    :param password:  Password, or None when authentication is disabled
+    :param ids:       Iterator of request IDs, such as `helpers.RequestIds`
+    '''
+
+    def __init__(self, host='localhost', port=4455, password=None, ids=None):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.ws = None
+        self._ids = ids if ids is not None else map(str, itertools.count())
+        self._pending = {}
+        self._receiver = None
+
+    @classmethod
+    def like(cls, cl):
+        'Create a client to the same obs-websocket as `obsws_python.ReqClient` `cl`'
+        base = cl.base_client
+        return cls(host=base.host, port=base.port, password=base.password)
+
+    async def connect(self):
+        'Connect and identify'
+        self.ws = await websockets.connect(f'ws://{self.host}:{self.port}', max_size=None)
+        hello = json.loads(await self.ws.recv())
+        if hello['op'] != _OP_HELLO:
+            raise ConnectionError(f'Expected Hello but got op {hello["op"]}')
+        identify = {'rpcVersion': 1, 'eventSubscriptions': 0}
+        auth = hello['d'].get('authentication')
+        if auth:
+            identify['authentication'] = _authentication(self.password or '', auth)
+        await self.ws.send(json.dumps({'op': _OP_IDENTIFY, 'd': identify}))
+        identified = json.loads(await self.ws.recv())
+        if identified['op'] != _OP_IDENTIFIED:
+            raise ConnectionError(f'Expected Identified but got op {identified["op"]}')
+        self._receiver = asyncio.ensure_future(self._receive())
+        return self
+
+    async def _receive(self):
+        try:
+            async for message in self.ws:
+                msg = json.loads(message)
+                if msg['op'] != _OP_REQUEST_RESPONSE:
+                    continue
+                future = self._pending.pop(msg['d']['requestId'], None)
+                if future is not None and not future.done():
+                    future.set_result(msg['d'])
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('obs-websocket connection closed'))
+            self._pending.clear()
+
+    async def close(self):
+        'Disconnect'
+        if self.ws is not None:
+            await self.ws.close()
+            await self._receiver
+            self.ws = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _call(self, request_type, data=None, read=False):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        d = {'requestType': request_type, 'requestId': request_id}
+        if data is not None:
+            d['requestData'] = data
+        await self.ws.send(json.dumps({'op': _OP_REQUEST, 'd': d}))
+        res = await future
+        if not read and not helpers.is_read_only_request(request_type, data):
+            helpers.invalidate_ui_cache()
+        status = res['requestStatus']
+        return status['result'], status['code'], status.get('comment'), res.get('responseData')
+
+    async def send(self, request_type, data=None, raw=False):
+        'Send a request and return the response like `obsws_python.ReqClient.send`'
+        response = await self._call(request_type, data)
+        return _RecordingClient(response).send(request_type, data, raw=raw)
+
+    async def vendor(self, vendor, request_type, data=None):
+        'Send `CallVendorRequest` and return its `responseData` dict'
+        res = await self.send('CallVendorRequest', {
+            'vendorName': vendor,
+            'requestType': request_type,
+            'requestData': data or {},
+        })
+        return res.response_data
+
+    async def ui(self, method, *args, **kwargs):
+        '''
+        Call `method` of `obsui.OBSUI` such as `widget_list` through this connection
+
+        The method is called once to capture the request it sends and once
+        more to parse the response.
+        '''
+        from onsdriver import obsui # pylint: disable=import-outside-toplevel
+        recorder = _RecordingClient()
+        try:
+            getattr(obsui.OBSUI(recorder), method)(*args, **kwargs)
+        except _Captured:
+            pass
+        if recorder.request is None:
+            raise RuntimeError(f'obsui.OBSUI.{method} sent no request')
+        response = await self._call(*recorder.request, read=method in ('widget_list', 'menu_list'))
+        return getattr(obsui.OBSUI(_RecordingClient(response)), method)(*args, **kwargs)
+
+
+class BackgroundClient:
+    '''
+    `AsyncClient` running on an event loop of a background thread
+
+    :param host:      Host name
+    :param port:      Port number
+    :param password:  Password, or None when authentication is disabled
+    :param ids:       Iterator of request IDs, such as `helpers.RequestIds`
+    '''
+
+    def __init__(self, host='localhost', port=4455, password=None, ids=None):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.client = AsyncClient(host, port, password, ids)
+        self.run(self.client.connect())
+
+    @classmethod
+    def like(cls, cl):
+        'Create a client to the same obs-websocket as `obsws_python.ReqClient` `cl`'
+        base = cl.base_client
+        return cls(host=base.host, port=base.port, password=base.password)
+
+    def run(self, coro, timeout=None):
+        'Run `coro` on the loop and return its result'
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def gather(self, *requests, timeout=None):
+        '''
+        Send all requests at once and return their responses in order
+
+        :param requests:  Tuples of a request type and its data
+        '''
+        async def _gather(client):
+            return await asyncio.gather(*(client.send(*r) for r in requests))
+        return self.call(_gather, timeout)
+
+    def call(self, fn, timeout=None):
+        'Return the result of coroutine function `fn` called with the `AsyncClient`'
+        return self.run(fn(self.client), timeout)
+
+    def disconnect(self):
+        'Close the connection and stop the loop'
+        try:
+            self.run(self.client.close(), timeout=5)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
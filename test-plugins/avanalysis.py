@@ -0,0 +1,253 @@
+'''
+Offline analysis of audio/video sync in a recording of the sync pattern
+
+The recording is decoded by ffmpeg through pipes, one video frame or one
+chunk of audio at a time, so that long recordings are analysed in bounded
+memory. A video marker is a frame where the index in the QR code steps and
+an audio marker is the onset of the tone burst found by its envelope. Each
+audio marker is paired with the nearest video marker to give the offset of
+the audio.
+'''
+
+import bisect
+import json
+import re
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+DEFAULT_INDEX_PATTERN = r'(?:^|,)i=([0-9]+)'
+
+
+def _which(name):
+    path = shutil.which(name)
+    if not path:
+        raise FileNotFoundError(f'{name} is required to analyse recordings')
+    return path
+
+
+def probe(filename):
+    '''
+    Return the first video and audio streams of `filename`
+
+    :return:  Tuple of dicts from ffprobe for the video and the audio stream
+    '''
+    cmd = [
+            _which('ffprobe'), '-v', 'error', '-of', 'json',
+            '-show_entries', 'stream=codec_type,width,height,avg_frame_rate,sample_rate,start_time',
+            filename,
+    ]
+    res = subprocess.run(cmd, check=True, capture_output=True)
+    streams = json.loads(res.stdout)['streams']
+    video = next(s for s in streams if s['codec_type'] == 'video')
+    audio = next(s for s in streams if s['codec_type'] == 'audio')
+    return video, audio
+
+
+def _frame_rate(stream):
+    num, den = stream['avg_frame_rate'].split('/')
+    return int(num) / int(den)
+
+
+def _start_time(stream):
+    return float(stream.get('start_time') or 0.0)
+
+
+class BurstDetector:
+    '''
+    Find onsets of tone bursts in audio fed chunk by chunk
+
+    The signal is demodulated at `frequency` and averaged over `window`
+    seconds, which gives the amplitude of the tone. An onset is detected when
+    the amplitude rises above `threshold` and is located on the linear ramp
+    of the moving average once the amplitude of the burst is known.
+
+    :param rate:       Sample rate
+    :param frequency:  Frequency of the burst in Hz
+    :param threshold:  Amplitude to detect, relative to full scale
+    :param window:     Length of the moving average in seconds
+    '''
+
+    def __init__(self, rate, frequency, threshold=0.05, window=0.005):
+        self.rate = rate
+        self.frequency = frequency
+        self.threshold = threshold
+        self.win = max(1, int(rate * window))
+        self.onsets = []
+        self._n = 0
+        self._tail = np.zeros(0, dtype=complex)
+        self._active = False
+        self._pending = None # [index, amplitude at index, max amplitude]
+
+    def feed(self, samples):
+        'Process the next chunk of samples'
+        n = np.arange(self._n, self._n + len(samples))
+        demod = samples * np.exp(-2j * np.pi * self.frequency / self.rate * n)
+        buf = np.concatenate((self._tail, demod))
+        first = self._n - len(self._tail) # sample index of buf[0]
+        self._n += len(samples)
+        self._tail = buf[-(self.win - 1):] if self.win > 1 else buf[:0]
+        if len(buf) < self.win:
+            return
+
+        c = np.concatenate(([0.0], np.cumsum(buf)))
+        env = np.abs(c[self.win:] - c[:-self.win]) * 2.0 / self.win
+        end = first + self.win - 1 # sample index of the last sample of the window of env[0]
+
+        above = env >= self.threshold
+        start = 0
+        while start < len(env):
+            if self._pending:
+                index, level, peak = self._pending
+                hi = min(len(env), index + self.win - end + 1)
+                if hi > start:
+                    peak = max(peak, float(env[start:hi].max()))
+                if end + hi - 1 < index + self.win:
+                    self._pending = [index, level, peak]
+                    return
+                self.onsets.append((index + 1 - self.win * level / peak) / self.rate)
+                self._pending = None
+                start = max(start, hi)
+                continue
+            if self._active:
+                falls = np.flatnonzero(~above[start:])
+                if not len(falls):
+                    return
+                self._active = False
+                start += int(falls[0])
+                continue
+            rises = np.flatnonzero(above[start:])
+            if not len(rises):
+                return
+            i = start + int(rises[0])
+            self._active = True
+            self._pending = [end + i, float(env[i]), float(env[i])]
+            start = i
+
+
+def detect_audio(filename, frequency, threshold=0.05, window=0.005, rate=48000, chunk_seconds=1.0):
+    '''
+    Return times of audio bursts in seconds from the start of the audio stream
+    '''
+    cmd = [
+            _which('ffmpeg'), '-v', 'error', '-i', filename, '-vn',
+            '-ac', '1', '-ar', str(rate), '-f', 'f32le', '-',
+    ]
+    detector = BurstDetector(rate, frequency, threshold, window)
+    chunk_bytes = int(rate * chunk_seconds) * 4
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            detector.feed(np.frombuffer(data[:len(data) // 4 * 4], dtype='<f4').astype(float))
+    if proc.returncode != 0:
+        raise RuntimeError(f'ffmpeg exited with {proc.returncode}')
+    return detector.onsets
+
+
+def detect_video(filename, width, height, fps, index_pattern=DEFAULT_INDEX_PATTERN):
+    '''
+    Return (time, index) of frames where the index in the QR code steps
+
+    Times are in seconds from the start of the video stream. The index seen
+    first is not a marker since the recording may start within its period.
+    '''
+    cmd = [
+            _which('ffmpeg'), '-v', 'error', '-i', filename, '-an',
+            '-f', 'rawvideo', '-pix_fmt', 'gray', '-',
+    ]
+    pattern = re.compile(index_pattern)
+    detector = cv2.QRCodeDetector()
+    frame_bytes = width * height
+    markers = []
+    last = None
+    n = 0
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width)
+            text, _, _ = detector.detectAndDecode(frame)
+            m = pattern.search(text) if text else None
+            if m:
+                index = int(m.group(1))
+                if last is not None and index != last:
+                    markers.append((n / fps, index))
+                last = index
+            n += 1
+    if proc.returncode != 0:
+        raise RuntimeError(f'ffmpeg exited with {proc.returncode}')
+    return markers
+
+
+class Offsets:
+    '''
+    Offsets of audio markers relative to the paired video markers
+
+    `items` is a list of (video time, index, offset) with times in seconds.
+    A positive offset means the audio is lagged.
+    '''
+
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def latencies_ms(self):
+        'Array of the offsets in milliseconds'
+        return np.array([o for _, _, o in self.items]) * 1e3
+
+    def median_ms(self):
+        'Median of the offsets in milliseconds'
+        return float(np.median(self.latencies_ms()))
+
+
+def pair(video_markers, audio_onsets, max_offset):
+    '''
+    Pair each audio onset with the nearest video marker
+
+    :param max_offset:  Onsets farther than this from any marker in seconds are ignored
+    '''
+    times = [t for t, _ in video_markers]
+    items = []
+    for ta in audio_onsets:
+        i = bisect.bisect_left(times, ta)
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(times)]
+        if not candidates:
+            continue
+        j = min(candidates, key=lambda j: abs(times[j] - ta))
+        if abs(times[j] - ta) <= max_offset:
+            items.append((times[j], video_markers[j][1], ta - times[j]))
+    return Offsets(items)
+
+
+def analyze(filename, frequency=3000, threshold=0.05, window=0.005, index_pattern=DEFAULT_INDEX_PATTERN):
+    '''
+    Measure the audio offset of each marker in a recording of the sync pattern
+
+    Audio onsets are paired within half of the median marker period.
+
+    :param filename:         Recorded file
+    :param frequency:        Frequency of the tone burst in Hz
+    :param threshold:        Amplitude of the burst to detect, relative to full scale
+    :param window:           Length of the envelope window in seconds
+    :param index_pattern:    Regular expression to extract the marker index from the QR code
+    :return:                 `Offsets`
+    '''
+    video, audio = probe(filename)
+    fps = _frame_rate(video)
+    video_start = _start_time(video)
+    audio_start = _start_time(audio)
+    video_markers = [(t + video_start, index) for t, index in detect_video(
+            filename, int(video['width']), int(video['height']), fps, index_pattern)]
+    if len(video_markers) < 2:
+        return Offsets([])
+    period = float(np.median(np.diff([t for t, _ in video_markers])))
+    audio_onsets = [t + audio_start for t in detect_audio(
+            filename, frequency, threshold, window, int(audio['sample_rate']))]
+    return pair(video_markers, audio_onsets, period / 2)
@@ -0,0 +1,172 @@
+'''
+Structured results of benchmarks
+
+Benchmarks are tests that are skipped unless environment variable
+`BENCHMARK=1` is set. Each benchmark collects points into a `Report`, which
+is written to `logs/benchmark-<name>-<pid>.json` with a table printed to
+stdout. Reports of one benchmark written by the same process, such as by
+variants split over several runs of a class, are merged into one file.
+'''
+
+import json
+import os
+import platform
+import time
+import unittest
+
+import numpy as np
+
+
+def enabled():
+    'Whether benchmarks are requested'
+    return os.environ.get('BENCHMARK', '') not in ('', '0')
+
+
+def benchmark_test(f):
+    'A decorator to skip a benchmark unless `BENCHMARK=1` is set'
+    if not enabled():
+        return unittest.skip('requires BENCHMARK=1')(f)
+    return f
+
+
+# Files written by this process, later reports to them are merged instead of replacing
+_written = set()
+
+
+def merge_points(points, new, key):
+    'Return `points` with `new` added, replacing a point with the same values of `key`'
+    new_ids = {tuple(p.get(k) for k in key) for p in new} if key else set()
+    kept = [p for p in points if tuple(p.get(k) for k in key) not in new_ids]
+    return kept + list(new)
+
+
+def merge_into(filename, report):
+    '''
+    Write `report`, a dict returned by `Report.to_dict`, merging a report already in `filename`
+    '''
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as fr:
+            old = json.load(fr)
+        report = dict(report,
+                      context=dict(old.get('context', {}), **report['context']),
+                      points=merge_points(old['points'], report['points'], report['key']))
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fw:
+        json.dump(report, fw, indent=1)
+    os.replace(tmp, filename)
+
+
+def summarize(values):
+    'Return median, 95th percentile and maximum of `values` as a dict'
+    if not len(values):
+        return {'n': 0, 'median': None, 'p95': None, 'max': None}
+    a = np.asarray(values, dtype=float)
+    return {
+            'n': int(a.size),
+            'median': float(np.median(a)),
+            'p95': float(np.percentile(a, 95)),
+            'max': float(a.max()),
+    }
+
+
+class Report:
+    '''
+    Points of one benchmark
+
+    :param name:    Name of the benchmark, used for the file name
+    :param key:     Names of the values identifying a point, such as the size
+    :param params:  Parameters common to all points
+    '''
+
+    def __init__(self, name, key=(), **params):
+        self.name = name
+        self.key = tuple(key)
+        self.params = params
+        self.context = {}
+        self.points = []
+
+    def record_versions(self, cl):
+        'Record versions of OBS and obs-websocket from `cl`, a client returned by `self.obs.get_obsws()`'
+        if 'obs_version' in self.context:
+            return
+        res = cl.send('GetVersion')
+        self.context['obs_version'] = res.obs_version
+        self.context['obs_websocket_version'] = res.obs_web_socket_version
+
+    def add(self, **point):
+        'Add a point, a dict of the size and the measured values'
+        self.points.append(point)
+
+    def fit(self, x, y):
+        '''
+        Least-squares line of `y` over `x` among the points having both
+
+        Nested values are given by a path separated by dots, such as
+        `get_loudness_ms.median`.
+
+        :return:  Tuple of (slope, intercept) or None if less than two points
+        '''
+        xs, ys = [], []
+        for p in self.points:
+            vx, vy = _lookup(p, x), _lookup(p, y)
+            if vx is not None and vy is not None:
+                xs.append(vx)
+                ys.append(vy)
+        if len(set(xs)) < 2:
+            return None
+        slope, intercept = np.polyfit(xs, ys, 1)
+        return float(slope), float(intercept)
+
+    def to_dict(self):
+        'Return the report as a JSON-serializable dict'
+        return {
+                'benchmark': self.name,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'platform': platform.platform(),
+                'os': platform.system(),
+                'context': self.context,
+                'key': list(self.key),
+                'params': self.params,
+                'points': self.points,
+        }
+
+    def write(self, log_dir='logs', columns=None):
+        '''
+        Write the report and print a table of `columns`
+
+        :param columns:  Paths of the values to print, all top-level keys by default
+        '''
+        if not self.points:
+            return None
+        os.makedirs(log_dir, exist_ok=True)
+        filename = os.path.join(log_dir, f'benchmark-{self.name}-{os.getpid()}.json')
+        if filename in _written:
+            merge_into(filename, self.to_dict())
+        else:
+            # A file left by an earlier run with the same process ID is replaced.
+            with open(filename, 'w', encoding='utf-8') as fw:
+                json.dump(self.to_dict(), fw, indent=1)
+            _written.add(filename)
+
+        if columns is None:
+            columns = [k for k, v in self.points[0].items() if not isinstance(v, dict)]
+        print(f'Benchmark {self.name}')
+        print(' '.join(f'{c:>14s}' for c in columns))
+        for p in self.points:
+            print(' '.join(_format(_lookup(p, c)) for c in columns))
+        return filename
+
+
+def _lookup(point, path):
+    v = point
+    for k in path.split('.'):
+        if not isinstance(v, dict) or k not in v:
+            return None
+        v = v[k]
+    return v
+
+
+def _format(v):
+    if isinstance(v, float):
+        return f'{v:14.3f}'
+    return f'{str(v):>14s}'
@@ -0,0 +1,201 @@
+'''
+Probe what the installed plugins provide and skip tests requiring the rest
+
+Decorate a test class by `requires` to skip the whole class, or a test
+method to skip the test, when an input kind, a vendor of obs-websocket or a
+dock is not available. Requirements are checked in `setUpClass`, before any
+test of the class starts OBS.
+
+The probe starts OBS once and its result is cached in this process and in
+the file given by environment variable `CAPABILITIES_FILE`, so that worker
+processes of one slot probe only once. Set `CAPABILITY_PROBE=0` to assume
+that everything is available.
+'''
+
+import json
+import os
+import unittest
+
+# Names of vendors and docks to probe, collected from the decorators
+_wanted = {'vendors': set(), 'docks': set()}
+
+_cache = None
+
+
+def _load_cache():
+    global _cache # pylint: disable=global-statement
+    if _cache is None:
+        filename = os.environ.get('CAPABILITIES_FILE')
+        if filename and os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as fr:
+                _cache = json.load(fr)
+    return _cache
+
+
+def _save_cache(caps):
+    global _cache # pylint: disable=global-statement
+    _cache = caps
+    filename = os.environ.get('CAPABILITIES_FILE')
+    if filename:
+        tmp = filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fw:
+            json.dump(caps, fw, indent=1)
+        os.replace(tmp, filename)
+
+
+# Status code of obs-websocket for a resource not found
+_RESOURCE_NOT_FOUND = 600
+
+
+def _has_vendor(cl, vendor):
+    from obsws_python.error import OBSSDKRequestError # pylint: disable=import-outside-toplevel
+    try:
+        cl.send('CallVendorRequest', {
+            'vendorName': vendor,
+            'requestType': 'capability-probe',
+            'requestData': {},
+        })
+    except OBSSDKRequestError as e:
+        # Vendors are looked up first, any other error proves the vendor exists.
+        # An unknown request type of a known vendor has the same code, tell them by the comment.
+        return not (e.code == _RESOURCE_NOT_FOUND and 'no vendor was found' in str(e).lower())
+    return True
+
+
+def _has_dock(ui, dock):
+    try:
+        ui.menu_list([
+                {"text": "&Docks"},
+                {"text": dock},
+        ])
+    except Exception: # pylint: disable=broad-exception-caught
+        return False
+    return True
+
+
+def probe():
+    '''
+    Start OBS and return the capabilities
+
+    :return:  Dict with `input_kinds`, a list of unversioned input kinds, and
+              `vendors` and `docks`, dicts from a name to its availability
+    '''
+    # pylint: disable=import-outside-toplevel
+    from onsdriver import obstest, obsui
+
+    class _Probe(obstest.OBSTest):
+        def runTest(self): # pylint: disable=invalid-name
+            pass
+
+    print('Info: Probing capabilities of OBS')
+    t = _Probe()
+    t.setUp(run=True, config_name='saved-config')
+    try:
+        cl = t.obs.get_obsws()
+        ui = obsui.OBSUI(cl)
+        return {
+                'input_kinds': cl.send('GetInputKindList', {'unversioned': True}).input_kinds,
+                'vendors': {v: _has_vendor(cl, v) for v in sorted(_wanted['vendors'])},
+                'docks': {d: _has_dock(ui, d) for d in sorted(_wanted['docks'])},
+        }
+    finally:
+        try:
+            t.tearDown()
+        except Exception as e: # pylint: disable=broad-exception-caught
+            print(f'Info: Ignoring an error at the end of the probe: {e}')
+
+
+def get_capabilities():
+    'Return the cached capabilities, probing OBS if a wanted name is not known yet'
+    caps = _load_cache()
+    if caps is not None:
+        if _wanted['vendors'] <= set(caps['vendors']) and _wanted['docks'] <= set(caps['docks']):
+            return caps
+    caps = probe()
+    _save_cache(caps)
+    return caps
+
+
+def missing(requirements):
+    '''
+    Return descriptions of the requirements not available
+
+    :param requirements:  Dict with optional keys `input_kinds`, `vendors` and `docks`
+    '''
+    if os.environ.get('CAPABILITY_PROBE') == '0':
+        return []
+    caps = get_capabilities()
+    ret = [f'input kind {k}' for k in requirements.get('input_kinds', ())
+           if k not in caps['input_kinds']]
+    ret += [f'vendor {v}' for v in requirements.get('vendors', ()) if not caps['vendors'].get(v)]
+    ret += [f'dock {d}' for d in requirements.get('docks', ()) if not caps['docks'].get(d)]
+    return ret
+
+
+def _install_class_check(cls):
+    if '_capability_check' in cls.__dict__:
+        return
+    cls._capability_check = True
+    own = cls.__dict__.get('setUpClass')
+    own_setup = cls.__dict__.get('setUp')
+
+    def setUpClass(klass): # pylint: disable=invalid-name
+        requirements = getattr(klass, 'capability_requirements', None)
+        if requirements:
+            absent = missing(requirements)
+            if absent:
+                raise unittest.SkipTest(f'requires {", ".join(absent)}')
+        # Kept on the class being set up, test functions are shared with subclasses.
+        skips = {}
+        loader = unittest.defaultTestLoader
+        for name in loader.getTestCaseNames(klass):
+            requirements = getattr(getattr(klass, name), 'capability_requirements', None)
+            if requirements:
+                absent = missing(requirements)
+                if absent:
+                    skips[name] = f'requires {", ".join(absent)}'
+        klass._capability_skips = skips
+        if own is not None:
+            own.__func__(klass)
+        else:
+            super(cls, klass).setUpClass()
+
+    def setUp(self, *args, **kwargs): # pylint: disable=invalid-name
+        reason = getattr(self, '_capability_skips', {}).get(self._testMethodName)
+        if reason:
+            raise unittest.SkipTest(reason)
+        if own_setup is not None:
+            own_setup(self, *args, **kwargs)
+        else:
+            super(cls, self).setUp(*args, **kwargs)
+
+    cls.setUpClass = classmethod(setUpClass)
+    cls.setUp = setUp
+
+
+def requires(input_kinds=(), vendors=(), docks=()):
+    '''
+    A decorator for a test class or a test method to skip it unless all are available
+
+    A test method can be decorated only if its class, or a base class, is
+    decorated too.
+
+    :param input_kinds:  Unversioned input kinds, such as `obs_vnc_source`
+    :param vendors:      Vendor names registered to obs-websocket
+    :param docks:        Texts of the docks in the Docks menu
+    '''
+    _wanted['vendors'].update(vendors)
+    _wanted['docks'].update(docks)
+    requirements = {'input_kinds': tuple(input_kinds), 'vendors': tuple(vendors), 'docks': tuple(docks)}
+
+    def _decorator(obj):
+        if isinstance(obj, type):
+            inherited = getattr(obj, 'capability_requirements', {}) or {}
+            obj.capability_requirements = {k: tuple(inherited.get(k, ())) + v
+                                           for k, v in requirements.items()}
+            _install_class_check(obj)
+        else:
+            obj.capability_requirements = requirements
+        return obj
+
+    return _decorator
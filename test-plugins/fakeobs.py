@@ -0,0 +1,733 @@
+'''
+Local stand-in for OBS speaking obs-websocket v5 to test the harness
+
+`FakeOBS` serves the subset of obs-websocket requests used by the tests,
+including request batches, and backs the vendors and the UI with models:
+- `LoudnessDockModel` answers `get_loudness`, `pause` and `reset` of
+  obs-loudness-dock and builds the widgets of `LoudnessDock`.
+- `SyncDockModel` builds the widgets of `SyncTestDock` and shows a
+  measurement scripted by `measure`.
+
+UI requests `widget-list`, `widget-invoke`, `menu-list` and `menu-trigger`
+are served in the form `obsui.OBSUI` of onsdriver sends them, see
+`ui_vendor`, so that tests use `obsui.OBSUI` on the client as they do with
+OBS. A step of a path matches a child whose properties equal all values of
+the step. Without onsdriver, UI requests are not served.
+
+Usage::
+
+    with fakeobs.FakeOBS() as obs:
+        cl = obs.get_obsws()
+        cl.send('CreateInput', {...})
+        ui = obsui.OBSUI(cl)
+        ui.request('menu-trigger', {'path': [{'text': '&Docks'}, {'text': 'Loudness'}]})
+'''
+
+import abc
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+import time
+
+import websockets
+
+try:
+    from onsdriver import obsui
+except ImportError:
+    obsui = None
+
+ASYNC_AUDIO_SOURCE = 'net.nagater.obs.' + 'asynchronous-audio-source'
+
+DEFAULT_INPUT_KINDS = (
+        ASYNC_AUDIO_SOURCE,
+        'ffmpeg_source',
+        'image_source',
+        'net.nagater.obs-audio-video-sync-dock.monitor',
+        'obs_vnc_source',
+)
+
+# Codes of RequestStatus
+_SUCCESS = 100
+_UNKNOWN_REQUEST_TYPE = 204
+_MISSING_REQUEST_FIELD = 300
+_REQUEST_FIELD_EMPTY = 403
+_RESOURCE_NOT_FOUND = 600
+_RESOURCE_ALREADY_EXISTS = 601
+
+# Values of executionType of RequestBatch
+_EXECUTION_SERIAL_REALTIME = 0
+_EXECUTION_SERIAL_FRAME = 1
+_EXECUTION_PARALLEL = 2
+
+# Frame rate reported by `GetStats` and used for `sleepFrames`
+FPS = 60.0
+
+
+class RequestError(Exception):
+    '''
+    Failure of a request returned to the client
+
+    :param code:     Code of RequestStatus
+    :param comment:  Message returned with the code
+    '''
+
+    def __init__(self, code, comment):
+        super().__init__(comment)
+        self.code = code
+        self.comment = comment
+
+
+def _widget(class_name, object_name='', text=None, children=(), invoke=None, **props):
+    w = {'className': class_name, 'objectName': object_name, 'children': list(children)}
+    if text is not None:
+        w['text'] = text
+    w.update(props)
+    if invoke:
+        w['_invoke'] = invoke
+    return w
+
+
+def _public(widget):
+    'Copy of `widget` without the handlers'
+    ret = {}
+    stack = [(widget, ret)]
+    while stack:
+        w, d = stack.pop()
+        d.update((k, v) for k, v in w.items() if k not in ('_invoke', 'children'))
+        d['children'] = [{} for _ in w['children']]
+        stack.extend(zip(w['children'], d['children']))
+    return ret
+
+
+def _matches(widget, step):
+    return all(widget.get(k) == v for k, v in step.items())
+
+
+def _resolve(roots, path):
+    candidates = roots
+    widget = None
+    for step in path:
+        widget = next((w for w in candidates if _matches(w, step)), None)
+        if widget is None:
+            raise RequestError(_RESOURCE_NOT_FOUND, f'No widget matches {step}')
+        candidates = widget.get('children', ())
+    if widget is None:
+        raise RequestError(_MISSING_REQUEST_FIELD, 'Empty path')
+    return widget
+
+
+class _Captured(Exception):
+    pass
+
+
+class _CapturingClient:
+    'Stands for `obsws_python.ReqClient` to capture the request `obsui.OBSUI` sends'
+
+    def __init__(self):
+        self.request = None
+
+    def send(self, param, data=None, raw=False): # pylint: disable=unused-argument
+        self.request = (param, data)
+        raise _Captured()
+
+
+def ui_vendor():
+    '''
+    Return the vendor that `obsui.OBSUI` sends UI requests to, None without onsdriver
+
+    The request sent by `obsui.OBSUI.request` is captured once. It has to be
+    a `CallVendorRequest` carrying the request type and the data as they are.
+    '''
+    if obsui is None:
+        return None
+    data = {'path': [{'className': 'OBSDock'}]}
+    client = _CapturingClient()
+    try:
+        obsui.OBSUI(client).request('widget-list', data)
+    except _Captured:
+        pass
+    param, request = client.request or (None, None)
+    if (param != 'CallVendorRequest' or request.get('requestType') != 'widget-list' or
+            request.get('requestData') != data):
+        raise NotImplementedError(f'obsui.OBSUI sends {param} {request!r}, which FakeOBS does not serve')
+    return request['vendorName']
+
+
+class DockModel(abc.ABC):
+    '''
+    Base of the state behind a dock
+
+    :param menu_text:   Text of the dock in the Docks menu
+    :param class_name:  Class name of the widget of the dock
+    '''
+
+    def __init__(self, menu_text, class_name):
+        self.menu_text = menu_text
+        self.class_name = class_name
+        self.visible = False
+        self.obs = None
+
+    @abc.abstractmethod
+    def widget(self):
+        'Return the widget tree of the dock, handlers are stored in `_invoke`'
+
+    def vendor_request(self, request_type, data):
+        'Handle a `CallVendorRequest` of the vendor of the dock'
+        raise RequestError(_RESOURCE_NOT_FOUND, 'No request was found by that name.')
+
+
+class LoudnessDockModel(DockModel):
+    '''
+    Tabs of obs-loudness-dock
+
+    By default, each value is the gain of the `gain` filter of the first
+    asynchronous audio source minus 0.691, the loudness of a sine wave at
+    that level, and the peak is the gain itself. Set `script` to a callable
+    taking the model and a tab name and returning a dict of the values to
+    change them.
+    '''
+
+    vendors = ('obs-loudness-dock', 'loudness-dock')
+
+    FIELDS = ('momentary', 'short', 'integrated', 'peak')
+
+    LABELS = (('Momentary', 'M'), ('Short-term', 'S'), ('Integrated', 'I'))
+
+    def __init__(self):
+        super().__init__('Loudness', 'LoudnessDock')
+        self.tabs = ['A']
+        self.current = 0
+        self.paused = {'A': False}
+        self.frozen = {}
+        self.colors = 3
+        self.abbrev = False
+        self.dialog = None
+        self.script = None
+
+    def _next_tab_name(self, names):
+        for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+            if c not in names:
+                return c
+        raise RequestError(_RESOURCE_ALREADY_EXISTS, 'Too many tabs')
+
+    def level(self):
+        'Gain in dB of the first tone, None without a tone'
+        for settings in self.obs.inputs.values():
+            if settings['kind'] == ASYNC_AUDIO_SOURCE:
+                gain = settings['filters'].get('gain')
+                return gain['settings'].get('db', 0.0) if gain else 0.0
+        return None
+
+    def values(self, name):
+        'Current values of the tab `name`'
+        if self.paused.get(name) and name in self.frozen:
+            return dict(self.frozen[name])
+        if self.script:
+            return dict(self.script(self, name))
+        level = self.level()
+        if level is None:
+            return {f: -float('inf') for f in self.FIELDS}
+        values = {f: level - 0.691 for f in self.FIELDS}
+        values['peak'] = level
+        return values
+
+    def _tab(self, data):
+        name = data.get('name') or self.tabs[self.current]
+        if name not in self.tabs:
+            raise RequestError(_RESOURCE_NOT_FOUND, f'No tab {name}')
+        return name
+
+    def _set_paused(self, name, paused):
+        if paused and not self.paused.get(name):
+            self.frozen[name] = self.values(name)
+        self.paused[name] = paused
+
+    def vendor_request(self, request_type, data):
+        if request_type == 'get_loudness':
+            name = self._tab(data)
+            return dict(self.values(name), name=name, paused=self.paused[name])
+        if request_type == 'pause':
+            self._set_paused(self._tab(data), data.get('pause', True))
+            return {}
+        if request_type == 'reset':
+            self.frozen.pop(self._tab(data), None)
+            return {}
+        return super().vendor_request(request_type, data)
+
+    def _click_pause(self):
+        name = self.tabs[self.current]
+        self._set_paused(name, not self.paused[name])
+
+    def _open_config(self):
+        self.dialog = {'tabs': list(self.tabs), 'colors': self.colors, 'abbrev': self.abbrev, 'row': 0}
+
+    def _close_config(self, apply):
+        dialog, self.dialog = self.dialog, None
+        if not apply:
+            return
+        self.tabs = dialog['tabs']
+        self.paused = {t: self.paused.get(t, False) for t in self.tabs}
+        self.current = min(self.current, len(self.tabs) - 1)
+        self.colors = dialog['colors']
+        self.abbrev = dialog['abbrev']
+
+    def _dialog_widget(self):
+        d = self.dialog
+
+        def _select_row(row, _col=None):
+            d['row'] = row
+
+        def _add_tab():
+            d['tabs'].append(self._next_tab_name(d['tabs']))
+
+        def _del_tab():
+            if len(d['tabs']) > 1 and d['row'] < len(d['tabs']):
+                del d['tabs'][d['row']]
+
+        def _add_color():
+            d['colors'] += 1
+
+        def _del_color():
+            if d['colors'] > 1:
+                d['colors'] -= 1
+
+        def _toggle_abbrev():
+            d['abbrev'] = not d['abbrev']
+
+        return _widget('ConfigDialog', invoke={'setTabTableCell': _select_row,
+                                               'setColorTableCell': _select_row}, children=[
+                _widget('QTableWidget', 'tabTable', rowCount=len(d['tabs'])),
+                _widget('QPushButton', 'tabTableAdd', '+', invoke={'click': _add_tab}),
+                _widget('QPushButton', 'tabTableDel', '-', invoke={'click': _del_tab}),
+                _widget('QTableWidget', 'colorTable', rowCount=d['colors']),
+                _widget('QPushButton', 'colorTableAdd', '+', invoke={'click': _add_color}),
+                _widget('QPushButton', 'colorTableDel', '-', invoke={'click': _del_color}),
+                _widget('QCheckBox', '', 'Abbreviate labels', checked=d['abbrev'],
+                        invoke={'click': _toggle_abbrev}),
+                _widget('QDialogButtonBox', children=[
+                    _widget('QPushButton', '', 'OK', invoke={'click': lambda: self._close_config(True)}),
+                    _widget('QPushButton', '', 'Cancel', invoke={'click': lambda: self._close_config(False)}),
+                ]),
+        ])
+
+    def widget(self):
+        name = self.tabs[self.current]
+        values = self.values(name)
+
+        def _set_current(index):
+            if not 0 <= index < len(self.tabs):
+                raise RequestError(_RESOURCE_NOT_FOUND, f'No tab at {index}')
+            self.current = index
+
+        children = [
+                _widget('QTabBar', count=len(self.tabs), currentIndex=self.current,
+                        invoke={'setCurrentIndex': _set_current}),
+        ]
+        for (label, abbrev), field in zip(self.LABELS, self.FIELDS):
+            children.append(_widget('QLabel', '', abbrev if self.abbrev else label))
+            children.append(_widget('QLabel', f'r128_{field}', f'{values[field]:.1f}'))
+        children.append(_widget('QLabel', 'r128_peak', f'{values["peak"]:.1f}'))
+        children.append(_widget('QPushButton', 'pauseButton',
+                                'Resume' if self.paused[name] else 'Pause',
+                                invoke={'click': self._click_pause}))
+        children.append(_widget('QPushButton', 'configButton', '', accessibleName='Settings',
+                                invoke={'click': self._open_config}))
+        if self.dialog is not None:
+            children.append(self._dialog_widget())
+        return _widget(self.class_name, children=children)
+
+
+class SyncDockModel(DockModel):
+    '''
+    Audio Video Sync Dock
+
+    After Start is clicked, the labels show the measurement given to
+    `measure` once `delay` seconds have passed.
+    '''
+
+    def __init__(self):
+        super().__init__('Audio Video Sync', 'SyncTestDock')
+        self.started = None
+        self.measurement = None
+        self.delay = 0.0
+
+    def measure(self, latency_ms=0.0, index=1, frequency=1000, video_missed=0, audio_missed=0, delay=0.0):
+        'Script the measurement shown after Start is clicked'
+        self.measurement = {
+                'latencyDisplay': f'{abs(latency_ms):.1f} ms',
+                'latencyPolarity': 'Audio lagged' if latency_ms >= 0 else 'Audio early',
+                'indexDisplay': f'{index}',
+                'frequencyDisplay': f'{frequency} Hz',
+                'videoIndexDisplay': f'{index} ({video_missed}% missed)',
+                'audioIndexDisplay': f'{index} ({audio_missed}% missed)',
+        }
+        self.delay = delay
+
+    def _start(self):
+        self.started = time.monotonic()
+
+    def _stop(self):
+        self.started = None
+
+    def widget(self):
+        texts = dict.fromkeys(('latencyDisplay', 'latencyPolarity', 'indexDisplay', 'frequencyDisplay',
+                               'videoIndexDisplay', 'audioIndexDisplay'), '-')
+        if self.started is not None and self.measurement and time.monotonic() - self.started >= self.delay:
+            texts.update(self.measurement)
+        children = [_widget('QLabel', k, v) for k, v in texts.items()]
+        children.append(_widget('QPushButton', '', 'Start', invoke={'click': self._start}))
+        children.append(_widget('QPushButton', '', 'Stop', invoke={'click': self._stop}))
+        return _widget(self.class_name, children=children)
+
+
+class FakeOBS:
+    '''
+    obs-websocket server on a background thread
+
+    :param docks:        Dock models, a loudness dock and a sync dock by default
+    :param input_kinds:  Input kinds returned by `GetInputKindList`
+    :param password:     Password required to identify, None to disable authentication
+    :param latency:      Seconds to delay each response, to make round trips visible
+    '''
+
+    def __init__(self, docks=None, input_kinds=DEFAULT_INPUT_KINDS, password=None, latency=0.0):
+        self.docks = list(docks) if docks is not None else [LoudnessDockModel(), SyncDockModel()]
+        self.input_kinds = list(input_kinds)
+        self.password = password
+        self.latency = latency
+        self.scenes = {'Scene': []}
+        self.transforms = {}
+        self.inputs = {}
+        self.requests = []
+        self.host = 'localhost'
+        self.port = None
+        self.lock = threading.Lock()
+        self.ui_vendor = ui_vendor()
+        self._vendors = {}
+        for dock in self.docks:
+            dock.obs = self
+            for vendor in getattr(dock, 'vendors', ()):
+                self._vendors[vendor] = dock
+        self._client = None
+        self._loop = None
+        self._thread = None
+        self._server = None
+
+    def dock(self, class_name):
+        'Return the model of the dock by its class name'
+        return next(d for d in self.docks if d.class_name == class_name)
+
+    # Requests
+
+    def _create_input(self, data):
+        name = data['inputName']
+        if name in self.inputs:
+            raise RequestError(_RESOURCE_ALREADY_EXISTS, f'Input {name} already exists')
+        if data['inputKind'] not in self.input_kinds:
+            raise RequestError(_RESOURCE_NOT_FOUND, 'Your specified input kind is not supported by OBS.')
+        scene = data.get('sceneName')
+        if scene not in self.scenes:
+            raise RequestError(_RESOURCE_NOT_FOUND, f'No scene {scene}')
+        self.inputs[name] = {'kind': data['inputKind'], 'settings': dict(data.get('inputSettings', {})),
+                             'filters': {}}
+        self.scenes[scene].append(name)
+        return {'inputUuid': name, 'sceneItemId': len(self.scenes[scene])}
+
+    def _input(self, name):
+        if name not in self.inputs:
+            raise RequestError(_RESOURCE_NOT_FOUND, f'No source was found by the name of `{name}`.')
+        return self.inputs[name]
+
+    def _remove_input(self, data):
+        self._input(data['inputName'])
+        del self.inputs[data['inputName']]
+        for items in self.scenes.values():
+            if data['inputName'] in items:
+                items.remove(data['inputName'])
+        self.transforms = {k: v for k, v in self.transforms.items() if k[1] != data['inputName']}
+        return None
+
+    def _create_source_filter(self, data):
+        filters = self._input(data['sourceName'])['filters']
+        if data['filterName'] in filters:
+            raise RequestError(_RESOURCE_ALREADY_EXISTS, 'A filter already exists by that name.')
+        filters[data['filterName']] = {'kind': data['filterKind'],
+                                       'settings': dict(data.get('filterSettings', {}))}
+        return None
+
+    def _source_filter(self, data):
+        filters = self._input(data['sourceName'])['filters']
+        if data['filterName'] not in filters:
+            raise RequestError(_RESOURCE_NOT_FOUND, 'No filter was found in the source by that name.')
+        return filters, data['filterName']
+
+    def _set_source_filter_settings(self, data):
+        filters, name = self._source_filter(data)
+        if data.get('overlay', True):
+            filters[name]['settings'].update(data['filterSettings'])
+        else:
+            filters[name]['settings'] = dict(data['filterSettings'])
+        return None
+
+    def _remove_source_filter(self, data):
+        filters, name = self._source_filter(data)
+        del filters[name]
+        return None
+
+    def _get_source_filter_list(self, data):
+        filters = self._input(data['sourceName'])['filters']
+        return {'filters': [{'filterName': name, 'filterKind': f['kind'], 'filterIndex': i,
+                             'filterEnabled': True, 'filterSettings': f['settings']}
+                            for i, (name, f) in enumerate(filters.items())]}
+
+    def _scene_item(self, data):
+        scene = data['sceneName']
+        if scene not in self.scenes:
+            raise RequestError(_RESOURCE_NOT_FOUND, f'No source was found by the name of `{scene}`.')
+        item_id = data['sceneItemId']
+        if not 1 <= item_id <= len(self.scenes[scene]):
+            raise RequestError(_RESOURCE_NOT_FOUND, 'No scene items were found in the specified scene.')
+        return self.transforms.setdefault((scene, self.scenes[scene][item_id - 1]), {})
+
+    def _get_scene_item_id(self, data):
+        scene = data['sceneName']
+        if data['sourceName'] not in self.scenes.get(scene, ()):
+            raise RequestError(_RESOURCE_NOT_FOUND, 'No scene items were found in the specified scene by that name.')
+        return {'sceneItemId': self.scenes[scene].index(data['sourceName']) + 1}
+
+    def _get_scene_item_transform(self, data):
+        return {'sceneItemTransform': dict(self._scene_item(data))}
+
+    def _set_scene_item_transform(self, data):
+        self._scene_item(data).update(data['sceneItemTransform'])
+        return None
+
+    def _get_input_list(self, _data):
+        return {'inputs': [{'inputName': name, 'inputUuid': name, 'inputKind': i['kind'],
+                            'unversionedInputKind': i['kind']} for name, i in self.inputs.items()]}
+
+    def _get_input_kind_list(self, _data):
+        return {'inputKinds': list(self.input_kinds)}
+
+    def _get_version(self, _data):
+        return {'obsVersion': '0.0.0-fake', 'obsWebSocketVersion': '5.0.0-fake', 'rpcVersion': 1,
+                'availableRequests': sorted(self._handlers()), 'supportedImageFormats': [],
+                'platform': 'fake', 'platformDescription': 'fakeobs'}
+
+    def _get_stats(self, _data):
+        return {'cpuUsage': 0.0, 'memoryUsage': 0.0, 'availableDiskSpace': 0.0, 'activeFps': FPS,
+                'averageFrameRenderTime': 0.0, 'renderSkippedFrames': 0, 'renderTotalFrames': 0,
+                'outputSkippedFrames': 0, 'outputTotalFrames': 0,
+                'webSocketSessionIncomingMessages': len(self.requests),
+                'webSocketSessionOutgoingMessages': len(self.requests)}
+
+    def _ui_request(self, request_type, data):
+        roots = [_widget('OBSDock', d.class_name, children=[d.widget()]) for d in self.docks if d.visible]
+        if request_type == 'widget-list':
+            return _public(_resolve(roots, data['path']))
+        if request_type == 'widget-invoke':
+            widget = _resolve(roots, data['path'])
+            handler = widget.get('_invoke', {}).get(data['method'])
+            if handler is None:
+                raise RequestError(_RESOURCE_NOT_FOUND, f'{widget["className"]} has no method {data["method"]}')
+            args = [data[k] for k in ('arg1', 'arg2') if k in data]
+            handler(*args)
+            return {}
+        menu = [{'text': '&Docks', 'children': [
+                {'text': d.menu_text, 'checked': d.visible, '_dock': d} for d in self.docks]}]
+        item = _resolve(menu, data['path'])
+        if request_type == 'menu-list':
+            return {k: v for k, v in item.items() if k not in ('children', '_dock')}
+        if request_type == 'menu-trigger':
+            if '_dock' in item:
+                item['_dock'].visible = not item['_dock'].visible
+            return {}
+        raise RequestError(_RESOURCE_NOT_FOUND, 'No request was found by that name.')
+
+    def _call_vendor_request(self, data):
+        vendor = data.get('vendorName')
+        request_type = data.get('requestType')
+        request_data = data.get('requestData') or {}
+        if not request_type:
+            raise RequestError(_REQUEST_FIELD_EMPTY, 'Your request field `requestType` is empty.')
+        if self.ui_vendor is not None and vendor == self.ui_vendor:
+            response = self._ui_request(request_type, request_data)
+        elif vendor in self._vendors:
+            response = self._vendors[vendor].vendor_request(request_type, request_data)
+        else:
+            raise RequestError(_RESOURCE_NOT_FOUND, 'No vendor was found by that name.')
+        return {'vendorName': vendor, 'requestType': request_type, 'responseData': response}
+
+    def _handlers(self):
+        return {
+                'CallVendorRequest': self._call_vendor_request,
+                'CreateInput': self._create_input,
+                'CreateSourceFilter': self._create_source_filter,
+                'GetInputKindList': self._get_input_kind_list,
+                'GetInputList': self._get_input_list,
+                'GetSceneItemId': self._get_scene_item_id,
+                'GetSceneItemTransform': self._get_scene_item_transform,
+                'GetSourceFilterList': self._get_source_filter_list,
+                'GetStats': self._get_stats,
+                'GetVersion': self._get_version,
+                'RemoveInput': self._remove_input,
+                'RemoveSourceFilter': self._remove_source_filter,
+                'SetSceneItemTransform': self._set_scene_item_transform,
+                'SetSourceFilterSettings': self._set_source_filter_settings,
+        }
+
+    def handle(self, request_type, data):
+        '''
+        Process one request as obs-websocket does
+
+        :return:  Pair of the RequestStatus dict and the response data or None
+        '''
+        with self.lock:
+            self.requests.append((request_type, data))
+            handler = self._handlers().get(request_type)
+            try:
+                if handler is None:
+                    raise RequestError(_UNKNOWN_REQUEST_TYPE, 'Your request type is not valid.')
+                response = handler(data or {})
+            except RequestError as e:
+                return {'result': False, 'code': e.code, 'comment': e.comment}, None
+            except KeyError as e:
+                return {'result': False, 'code': _MISSING_REQUEST_FIELD,
+                        'comment': f'Your request is missing the `{e.args[0]}` field.'}, None
+        return {'result': True, 'code': _SUCCESS}, response
+
+    # Protocol
+
+    def _response(self, request_type, request_id, data):
+        status, response = self.handle(request_type, data)
+        d = {'requestType': request_type, 'requestId': request_id, 'requestStatus': status}
+        if response is not None:
+            d['responseData'] = response
+        return d
+
+    async def _serve_request(self, ws, d):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await ws.send(json.dumps({'op': 7, 'd': self._response(d['requestType'], d['requestId'],
+                                                                d.get('requestData'))}))
+
+    @staticmethod
+    def _sleep_seconds(execution_type, data):
+        if execution_type == _EXECUTION_SERIAL_REALTIME:
+            return data['sleepMillis'] / 1000
+        if execution_type == _EXECUTION_SERIAL_FRAME:
+            return data['sleepFrames'] / FPS
+        raise RequestError(_UNKNOWN_REQUEST_TYPE, 'Sleep is not available in this execution type.')
+
+    async def _serve_batch(self, ws, d):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        execution_type = d.get('executionType', _EXECUTION_SERIAL_REALTIME)
+        serial = execution_type != _EXECUTION_PARALLEL
+        variables = {}
+        results = []
+        for r in d['requests']:
+            data = dict(r.get('requestData') or {})
+            if serial:
+                for field, variable in (r.get('inputVariables') or {}).items():
+                    if variable in variables:
+                        data[field] = variables[variable]
+            if r['requestType'] == 'Sleep':
+                res = {'requestType': 'Sleep', 'requestId': r.get('requestId'),
+                       'requestStatus': {'result': True, 'code': _SUCCESS}}
+                try:
+                    await asyncio.sleep(self._sleep_seconds(execution_type, data))
+                except RequestError as e:
+                    res['requestStatus'] = {'result': False, 'code': e.code, 'comment': e.comment}
+                except KeyError as e:
+                    res['requestStatus'] = {'result': False, 'code': _MISSING_REQUEST_FIELD,
+                                            'comment': f'Your request is missing the `{e.args[0]}` field.'}
+            else:
+                res = self._response(r['requestType'], r.get('requestId'), data)
+            if serial:
+                response = res.get('responseData') or {}
+                for variable, field in (r.get('outputVariables') or {}).items():
+                    if field in response:
+                        variables[variable] = response[field]
+            results.append(res)
+            if d.get('haltOnFailure') and not res['requestStatus']['result']:
+                break
+        await ws.send(json.dumps({'op': 9, 'd': {'requestId': d['requestId'], 'results': results}}))
+
+    def _authentication(self):
+        salt = base64.b64encode(b'fakeobs-salt').decode()
+        challenge = base64.b64encode(str(time.monotonic_ns()).encode()).decode()
+        secret = base64.b64encode(hashlib.sha256((self.password + salt).encode()).digest())
+        expected = base64.b64encode(hashlib.sha256(secret + challenge.encode()).digest()).decode()
+        return {'salt': salt, 'challenge': challenge}, expected
+
+    async def _session(self, ws):
+        hello = {'obsWebSocketVersion': '5.0.0-fake', 'rpcVersion': 1}
+        expected = None
+        if self.password is not None:
+            hello['authentication'], expected = self._authentication()
+        await ws.send(json.dumps({'op': 0, 'd': hello}))
+        identify = json.loads(await ws.recv())
+        if identify['op'] != 1 or (expected and identify['d'].get('authentication') != expected):
+            await ws.close(4009, 'Authentication failed.')
+            return
+        await ws.send(json.dumps({'op': 2, 'd': {'negotiatedRpcVersion': 1}}))
+        tasks = set()
+        try:
+            async for message in ws:
+                msg = json.loads(message)
+                if msg['op'] == 6:
+                    task = asyncio.ensure_future(self._serve_request(ws, msg['d']))
+                elif msg['op'] == 8:
+                    task = asyncio.ensure_future(self._serve_batch(ws, msg['d']))
+                else:
+                    continue
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.ConnectionClosed:
+            pass
+
+    # Control
+
+    def start(self):
+        'Start serving on an ephemeral port'
+        started = threading.Event()
+
+        async def _main():
+            self._server = await websockets.serve(self._session, self.host, 0)
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            await self._server.wait_closed()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=lambda: self._loop.run_until_complete(_main()), daemon=True)
+        self._thread.start()
+        started.wait(10)
+        return self
+
+    def stop(self):
+        'Stop serving and disconnect the clients'
+        if self._client is not None:
+            self._client.disconnect()
+            self._client = None
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._thread.join()
+            self._loop.close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_obsws(self):
+        'Return a `obsws_python.ReqClient` connected to this server, like `self.obs.get_obsws()`'
+        import obsws_python # pylint: disable=import-outside-toplevel
+        if self._client is None:
+            self._client = obsws_python.ReqClient(host=self.host, port=self.port,
+                                                  password=self.password or '')
+        return self._client
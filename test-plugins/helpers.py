@@ -2,20 +2,31 @@
 Helper functions
 '''
 
+import atexit
+import concurrent.futures
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 import os
-
-def flatten_widgets(widget):
-    'Iterate self and all widgets'
-    yield widget
-    for w in widget['children']:
-        yield from flatten_widgets(w)
+import time
+import weakref
 
 SEVERITY_COVERAGE = 10
 SEVERITY_FULL = 20
+SEVERITY_SOAK = 30
 _SEVERITIES_TO_NAME = {
         SEVERITY_COVERAGE: 'COVERAGE',
         SEVERITY_FULL: 'FULL',
+        SEVERITY_SOAK: 'SOAK',
 }
 
 def _get_severity():
@@ -38,3 +49,1329 @@ def severity(level):
     if level > _get_severity():
         return unittest.skip(f'requires severity {_SEVERITIES_TO_NAME[level]}')
     return lambda f: f
+
+
+class WaitTimeout(AssertionError):
+    'Raised when a condition is not met before its deadline'
+
+
+class Deadline:
+    '''
+    An absolute point in time shared by several waits
+
+    :param timeout:  Seconds from now
+    '''
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires = time.monotonic() + timeout
+
+    def remaining(self):
+        'Seconds left, never negative'
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        'Whether the deadline has passed'
+        return time.monotonic() >= self.expires
+
+
+def _as_deadline(timeout):
+    if isinstance(timeout, Deadline):
+        return timeout
+    return Deadline(timeout)
+
+
+def wait_for(getter, predicate=bool, timeout=10.0, *, description=None,
+             interval=0.02, max_interval=0.5, backoff=1.5, ignore=()):
+    '''
+    Poll `getter` until `predicate` accepts its value and return the value
+
+    The interval between polls starts at `interval` and grows by `backoff`
+    until it reaches `max_interval`, so fast conditions return quickly while
+    slow ones do not flood OBS with requests.
+
+    :param getter:       Callable returning the current value
+    :param predicate:    Callable taking the value, returning true when done
+    :param timeout:      Seconds or a `Deadline`
+    :param description:  Text to describe the condition on timeout
+    :param ignore:       Exception types raised by `getter` to retry on
+    :raises WaitTimeout: The condition was not met in time
+    '''
+    deadline = _as_deadline(timeout)
+    start = time.monotonic()
+    attempts = 0
+    value = None
+    error = None
+    while True:
+        attempts += 1
+        try:
+            value = getter()
+            error = None
+            if predicate(value):
+                return value
+        except ignore as e: # pylint: disable=catching-non-exception
+            error = e
+
+        remaining = deadline.remaining()
+        if remaining <= 0.0:
+            break
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_interval)
+
+    msg = f'Timed out after {time.monotonic() - start:.2f} s and {attempts} attempts'
+    if description:
+        msg += f' waiting for {description}'
+    if error is not None:
+        msg += f', last error: {error!r}'
+    else:
+        msg += f', last value: {value!r}'
+    raise WaitTimeout(msg) from error
+
+
+def wait_until(predicate, timeout=10.0, **kwargs):
+    '''
+    Poll `predicate` until it returns a true value and return the value
+
+    Takes the same keyword arguments as `wait_for`.
+    '''
+    return wait_for(predicate, bool, timeout, **kwargs)
+
+
+def hold(predicate, duration, *, description=None, interval=0.1):
+    '''
+    Check `predicate` stays true for `duration` seconds
+
+    Fails as soon as the condition is broken instead of after the full duration.
+
+    :raises AssertionError: The condition became false
+    '''
+    deadline = Deadline(duration)
+    while True:
+        value = predicate()
+        if not value:
+            msg = f'Condition broken after {duration - deadline.remaining():.2f} s'
+            if description:
+                msg += f': {description}'
+            raise AssertionError(msg)
+        remaining = deadline.remaining()
+        if remaining <= 0.0:
+            return
+        time.sleep(min(interval, remaining))
+
+
+def fresh_obs(f):
+    '''
+    A decorator for a test that cannot share OBS with other tests of the class,
+    such as a test modifying the profile before starting OBS
+    '''
+    f.fresh_obs = True
+    return f
+
+
+class SharedOBSMixin:
+    '''
+    Mixin for `obstest.OBSTest` to run one OBS for all tests of a class
+
+    Put it before `obstest.OBSTest` and set `shared_obs = True` to opt in.
+    The first test starts OBS through `run_obs`, later tests call
+    `attach_shared_obs` at the top of `setUp` and skip preparing the config.
+    Only the handles listed in `shared_obs_attributes` are taken from the
+    first test. Between tests, `reset_obs_state` restores the state over
+    obs-websocket and a failure to restore fails the test.
+    Each test checks that OBS is still responding in its `tearDown`. The
+    shutdown checks of `obstest.OBSTest.tearDown`, which need OBS to exit,
+    run once per class and name all tests that shared the OBS.
+
+    Tests decorated by `fresh_obs` still get their own OBS.
+    Set environment variable `SHARED_OBS=0` to disable sharing.
+    '''
+
+    shared_obs = False
+
+    # Menu texts under "&Docks" to hide between tests
+    shared_obs_docks = ()
+
+    # Attributes set by `obstest.OBSTest.setUp` that later tests take from the first one
+    shared_obs_attributes = ('obs',)
+
+    _shared_owner = None
+    _shared_baseline = None
+    _shared_tests = ()
+
+    @property
+    def session(self):
+        'The `Session` of this test, created at the first use and closed at the end of the test'
+        if getattr(self, '_session', None) is None:
+            self._session = Session(self)
+
+            def _close():
+                self._session.close()
+                self._session = None
+
+            self.addCleanup(_close)
+        return self._session
+
+    def _shares_obs(self):
+        if not self.shared_obs or os.environ.get('SHARED_OBS') == '0':
+            return False
+        method = getattr(self, self._testMethodName)
+        return not getattr(method, 'fresh_obs', False)
+
+    @classmethod
+    def _get_shared_owner(cls):
+        return cls.__dict__.get('_shared_owner')
+
+    @classmethod
+    def _release_shared_obs(cls):
+        owner = cls._get_shared_owner()
+        if owner is None:
+            return
+        tests = cls._shared_tests
+        cls._shared_owner = None
+        cls._shared_baseline = None
+        cls._shared_tests = ()
+        try:
+            super(SharedOBSMixin, owner).tearDown()
+        except AssertionError as e:
+            raise AssertionError(f'Shutdown checks of OBS shared by {", ".join(tests)} failed: {e}') from e
+
+    def setUp(self, *args, **kwargs): # pylint: disable=invalid-name
+        if not self._shares_obs():
+            # Stop the shared OBS so that the config and ports are free.
+            type(self)._release_shared_obs()
+        super().setUp(*args, **kwargs)
+
+    def attach_shared_obs(self):
+        '''
+        Use the OBS already running for this class
+
+        :return:  True if attached, False if the caller has to set up OBS
+        '''
+        owner = type(self)._get_shared_owner()
+        if not self._shares_obs() or owner is None:
+            return False
+
+        for k in self.shared_obs_attributes:
+            setattr(self, k, getattr(owner, k))
+        name = getattr(owner, 'name', None)
+        if isinstance(name, str):
+            self.name = name.replace(owner._testMethodName, self._testMethodName)
+        self._attached = True
+        type(self)._shared_tests += (self._testMethodName,)
+        return True
+
+    def run_obs(self):
+        'Start OBS unless attached to the shared one, then record the state to reset to'
+        if getattr(self, '_attached', False):
+            return
+        self.obs.run()
+        if self._shares_obs():
+            cls = type(self)
+            cls._shared_owner = self
+            cls._shared_baseline = self._get_obs_state()
+            cls._shared_tests = (self._testMethodName,)
+
+    def _get_obs_state(self):
+        cl = self.obs.get_obsws()
+        inputs = [i['inputName'] for i in cl.send('GetInputList').inputs]
+        filters = {}
+        for name in inputs:
+            res = cl.send('GetSourceFilterList', {'sourceName': name})
+            filters[name] = {f['filterName'] for f in res.filters}
+        return {'inputs': set(inputs), 'filters': filters}
+
+    def reset_obs_state(self):
+        '''
+        Restore the state recorded by `run_obs`
+
+        Removes inputs and filters created by the test and hides the docks
+        listed in `shared_obs_docks`. Override to reset plugin state too.
+        '''
+        baseline = type(self)._shared_baseline
+        cl = self.obs.get_obsws()
+        state = self._get_obs_state()
+        for name in state['inputs'] - baseline['inputs']:
+            cl.send('RemoveInput', {'inputName': name})
+        for name, filters in baseline['filters'].items():
+            for filter_name in state['filters'].get(name, set()) - filters:
+                cl.send('RemoveSourceFilter', {'sourceName': name, 'filterName': filter_name})
+
+        for dock in self.shared_obs_docks:
+            selector = f'"&Docks" > "{dock}"'
+            if self.session.menu_list(selector)['checked']:
+                self.session.menu_trigger(f'{selector}[checked=true]')
+
+    def check_shared_obs(self):
+        'Fail the current test if the shared OBS crashed or stopped responding'
+        try:
+            self.obs.get_obsws().send('GetVersion')
+        except Exception as e: # pylint: disable=broad-exception-caught
+            if not _is_connection_lost(e):
+                raise
+            raise AssertionError(f'OBS stopped responding during {self._testMethodName}') from e
+
+    def tearDown(self): # pylint: disable=invalid-name
+        cls = type(self)
+        if not self._shares_obs() or cls._get_shared_owner() is None:
+            super().tearDown()
+            return
+        try:
+            self.check_shared_obs()
+            self.reset_obs_state()
+        except:
+            cls._release_shared_obs()
+            raise
+
+    @classmethod
+    def tearDownClass(cls): # pylint: disable=invalid-name
+        cls._release_shared_obs()
+        super().tearDownClass()
+
+
+EXECUTION_SERIAL_REALTIME = 0
+EXECUTION_SERIAL_FRAME = 1
+EXECUTION_PARALLEL = 2
+
+
+class BatchResult:
+    '''
+    Result of one request in a `RequestBatch`
+
+    `data` holds the response in the same form as `cl.send` returns.
+    '''
+
+    __slots__ = ('request_type', 'ok', 'code', 'comment', 'data')
+
+    def __init__(self, request_type):
+        self.request_type = request_type
+        self.ok = None
+        self.code = None
+        self.comment = None
+        self.data = None
+
+    def __repr__(self):
+        return f'BatchResult({self.request_type}, ok={self.ok}, code={self.code})'
+
+
+class RequestBatch:
+    '''
+    Collect obs-websocket requests and send them in one round trip
+
+    Results of each `add` are filled by `send`.
+    In the serial modes, a request can take a field of an earlier response
+    through `output_variables` and `input_variables`.
+
+    :param cl:               Client returned by `self.obs.get_obsws()`
+    :param execution_type:   `EXECUTION_SERIAL_REALTIME`, `EXECUTION_SERIAL_FRAME` or `EXECUTION_PARALLEL`
+    :param halt_on_failure:  Skip the rest of the requests after a failure
+    '''
+
+    def __init__(self, cl, execution_type=EXECUTION_SERIAL_REALTIME, halt_on_failure=True, ids=None):
+        self.cl = cl
+        self.ids = ids
+        self.execution_type = execution_type
+        self.halt_on_failure = halt_on_failure
+        self.requests = []
+        self.results = []
+
+    def add(self, request_type, request_data=None, *, output_variables=None, input_variables=None):
+        '''
+        Add a request
+
+        :param output_variables:  Dict from variable name to response field
+        :param input_variables:   Dict from request field to variable name
+        :return:                  `BatchResult` to be filled by `send`
+        '''
+        req = {'requestType': request_type, 'requestId': str(len(self.requests))}
+        if request_data:
+            req['requestData'] = request_data
+        if output_variables:
+            req['outputVariables'] = output_variables
+        if input_variables:
+            req['inputVariables'] = input_variables
+        self.requests.append(req)
+        result = BatchResult(request_type)
+        self.results.append(result)
+        return result
+
+    def sleep(self, millis=None, frames=None):
+        'Add a `Sleep` request, `frames` needs `EXECUTION_SERIAL_FRAME`'
+        if frames is not None:
+            return self.add('Sleep', {'sleepFrames': frames})
+        return self.add('Sleep', {'sleepMillis': millis})
+
+    def _request_batch(self, batch_id):
+        'Send the batch on the socket of the client, which `ReqClient` has no method for'
+        # pylint: disable=import-outside-toplevel
+        from obsws_python.error import OBSSDKError, OBSSDKTimeoutError
+        from websocket import WebSocketTimeoutException
+
+        ws = self.cl.base_client.ws
+        try:
+            ws.send(json.dumps({
+                'op': 8,
+                'd': {
+                    'requestId': batch_id,
+                    'haltOnFailure': self.halt_on_failure,
+                    'executionType': self.execution_type,
+                    'requests': self.requests,
+                },
+            }))
+            res = json.loads(ws.recv())
+        except WebSocketTimeoutException as e:
+            raise OBSSDKTimeoutError('Timeout while trying to send the request batch') from e
+        if res.get('op') != 9 or res['d'].get('requestId') != batch_id:
+            raise OBSSDKError(f'Unexpected response to the request batch {batch_id}: {res!r}')
+        return res['d']
+
+    def send(self, check=True):
+        '''
+        Send all requests as one `RequestBatch`
+
+        :param check:  Raise for the first failed or skipped request
+        :return:       List of `BatchResult`
+        '''
+        # pylint: disable=import-outside-toplevel
+        from obsws_python.error import OBSSDKRequestError
+        from obsws_python.util import as_dataclass
+
+        batch_id = next(self.ids) if self.ids else f'batch-{id(self)}-{time.monotonic_ns()}'
+        try:
+            res = self._request_batch(batch_id)
+        finally:
+            invalidate_ui_cache()
+
+        for r in res['results']:
+            result = self.results[int(r['requestId'])]
+            status = r['requestStatus']
+            result.ok = status['result']
+            result.code = status['code']
+            result.comment = status.get('comment')
+            if 'responseData' in r:
+                result.data = as_dataclass(r['requestType'], r['responseData'])
+
+        if check:
+            for result in self.results:
+                if result.ok is None:
+                    raise OBSSDKRequestError(result.request_type, None, 'not executed')
+                if not result.ok:
+                    raise OBSSDKRequestError(result.request_type, result.code, result.comment)
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+
+_MISSING = object()
+
+
+class WidgetNode:
+    '''
+    A widget in `WidgetTree`
+
+    The properties returned by `widget_list` other than those held in the
+    slots are kept in `extra`. A node can be read like the returned dict, such
+    as `node['text']`.
+    '''
+
+    __slots__ = ('class_name', 'object_name', 'accessible_name', 'text', 'extra',
+                 'parent', 'children', 'index', 'end')
+
+    _KEYS = {
+            'className': 'class_name',
+            'objectName': 'object_name',
+            'accessibleName': 'accessible_name',
+            'text': 'text',
+    }
+
+    def __init__(self, widget, parent, index):
+        self.class_name = widget.get('className')
+        self.object_name = widget.get('objectName') or None
+        self.accessible_name = widget.get('accessibleName') or None
+        self.text = widget.get('text')
+        extra = {k: v for k, v in widget.items() if k not in self._KEYS and k != 'children'}
+        self.extra = extra or None
+        self.parent = parent
+        self.children = []
+        self.index = index
+        self.end = index + 1
+
+    def get(self, key, default=None):
+        'Property `key` by the name used in `widget_list`'
+        attr = self._KEYS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            return default if value is None else value
+        if key == 'children':
+            return self.children
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __repr__(self):
+        return f'<WidgetNode {self.class_name} {self.object_name!r} {self.text!r}>'
+
+
+class WidgetTree:
+    '''
+    Widgets returned by `widget_list`, indexed for repeated queries
+
+    Nodes are stored in pre-order so that the descendants of a node are the
+    slice from `node.index` to `node.end`. The tree is built without recursion
+    and nodes are indexed by className, objectName, accessibleName and text.
+
+    :param widget:  Dict returned by `obsui.OBSUI.widget_list`
+    '''
+
+    _INDEXES = ('class_name', 'object_name', 'accessible_name', 'text')
+
+    def __init__(self, widget):
+        self.nodes = []
+        self.indexes = {attr: {} for attr in self._INDEXES}
+        stack = [(widget, None)]
+        while stack:
+            w, parent = stack.pop()
+            node = WidgetNode(w, parent, len(self.nodes))
+            self.nodes.append(node)
+            if parent is not None:
+                parent.children.append(node)
+            for attr, index in self.indexes.items():
+                value = getattr(node, attr)
+                if value is not None:
+                    index.setdefault(value, []).append(node)
+            children = w.get('children') or ()
+            stack.extend((c, node) for c in reversed(children))
+        for node in reversed(self.nodes):
+            if node.parent is not None and node.end > node.parent.end:
+                node.parent.end = node.end
+
+    @property
+    def root(self):
+        'The node of the widget given to the constructor'
+        return self.nodes[0]
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def descendants(self, node):
+        'List `node` and all widgets under it'
+        return self.nodes[node.index:node.end]
+
+    def find(self, class_name=None, object_name=None, accessible_name=None, text=None, under=None):
+        '''
+        List widgets matching all given properties in pre-order
+
+        :param under:  A node to limit the search to the node and its descendants
+        '''
+        query = {
+                'class_name': class_name,
+                'object_name': object_name,
+                'accessible_name': accessible_name,
+                'text': text,
+        }
+        query = {k: v for k, v in query.items() if v is not None}
+        if query:
+            candidates = min((self.indexes[k].get(v, ()) for k, v in query.items()), key=len)
+        else:
+            candidates = self.nodes
+        if under is not None:
+            candidates = [n for n in candidates if under.index <= n.index < under.end]
+        return [n for n in candidates if all(getattr(n, k) == v for k, v in query.items())]
+
+    def first(self, **query):
+        'The first widget matching `find` or None'
+        found = self.find(**query)
+        return found[0] if found else None
+
+    def texts(self, **query):
+        'List texts of widgets matching `find`'
+        return [n.text for n in self.find(**query)]
+
+
+class DockSnapshot:
+    '''
+    Widgets of a dock read by one request
+
+    Widgets are held in a `WidgetTree` so that any number of assertions read
+    the values of the same instant without a round trip.
+
+    :param ui:          `obsui.OBSUI` instance
+    :param class_name:  Class name of the dock such as 'SyncTestDock' or 'LoudnessDock'
+    :param widget:      Response of `widget_list` for `path(class_name)` already read, `ui` is not used
+    '''
+
+    def __init__(self, ui, class_name, widget=None):
+        if widget is None:
+            widget = ui.widget_list(path=self.path(class_name))
+        self.tree = WidgetTree(widget)
+
+    @staticmethod
+    def path(class_name):
+        'Path of the dock to read by `widget_list`'
+        return [
+            {"className": "OBSDock"},
+            {"className": class_name},
+        ]
+
+    @property
+    def root(self):
+        'The node of the dock'
+        return self.tree.root
+
+    def __getitem__(self, object_name):
+        node = self.tree.first(object_name=object_name)
+        if node is None:
+            raise KeyError(object_name)
+        return node
+
+    def __contains__(self, object_name):
+        return object_name in self.tree.indexes['object_name']
+
+    def text(self, object_name):
+        'Text of the widget with `object_name`'
+        return self[object_name].text
+
+    def find(self, class_name=None, text=None):
+        'List widgets matching all given properties'
+        return self.tree.find(class_name=class_name, text=text)
+
+
+_SELECTOR_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<sep>>) |
+        (?P<attr>\[\s*(?P<key>\w+)\s*=\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<bare>[^\]\s]*))\s*\]) |
+        \#(?P<id>[\w.-]+) |
+        "(?P<text_dq>[^"]*)" |
+        '(?P<text_sq>[^']*)' |
+        (?P<any>\*) |
+        (?P<cls>\w+)
+    )''', re.VERBOSE)
+
+
+def _selector_value(m):
+    if m.group('dq') is not None:
+        return m.group('dq')
+    if m.group('sq') is not None:
+        return m.group('sq')
+    bare = m.group('bare')
+    if bare in ('true', 'false'):
+        return bare == 'true'
+    if re.fullmatch(r'-?[0-9]+', bare):
+        return int(bare)
+    return bare
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_selector(selector):
+    steps = [{}]
+    pos = 0
+    selector = selector.strip()
+    while pos < len(selector):
+        m = _SELECTOR_TOKEN.match(selector, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f'Invalid selector at {pos}: {selector!r}')
+        pos = m.end()
+        step = steps[-1]
+        if m.group('sep'):
+            if not step:
+                raise ValueError(f'Empty step in selector {selector!r}')
+            steps.append({})
+        elif m.group('attr'):
+            step[m.group('key')] = _selector_value(m)
+        elif m.group('id'):
+            step['objectName'] = m.group('id')
+        elif m.group('text_dq') is not None or m.group('text_sq') is not None:
+            step['text'] = m.group('text_dq') if m.group('text_dq') is not None else m.group('text_sq')
+        elif m.group('cls'):
+            step['className'] = m.group('cls')
+        elif m.group('any'):
+            step['*'] = True
+    if not steps[-1] and len(steps) > 1:
+        raise ValueError(f'Empty step in selector {selector!r}')
+    return tuple(tuple(sorted((k, v) for k, v in step.items() if k != '*')) for step in steps)
+
+
+def compile_selector(selector):
+    '''
+    Compile a selector to a path of `obsui`
+
+    A selector lists steps separated by `>`, each step matching a child of the
+    widget or the menu matched by the previous step. A step is made of
+    - a class name such as `QPushButton`, or `*` to match any widget,
+    - `#name` to match objectName,
+    - a quoted string to match text, such as `"&Docks"`,
+    - any number of `[key=value]` to match other properties. A value is a
+      quoted string, `true`, `false`, an integer, or a bare string.
+
+    For example, `OBSDock > LoudnessDock > ConfigDialog > QPushButton#tabTableAdd`.
+
+    :return:  List of dicts to pass as `path`
+    '''
+    return [dict(step) for step in _compile_selector(selector)]
+
+
+_ui_generation = 0
+
+# Pairs of vendorName and requestType of `CallVendorRequest` that do not change OBS
+READ_ONLY_VENDOR_REQUESTS = set()
+
+
+def is_read_only_request(request_type, data=None):
+    'Whether an obs-websocket request is known not to change OBS'
+    if request_type.startswith('Get'):
+        return True
+    if request_type == 'CallVendorRequest' and data:
+        return (data.get('vendorName'), data.get('requestType')) in READ_ONLY_VENDOR_REQUESTS
+    return False
+
+
+def invalidate_ui_cache():
+    'Discard widgets cached by `SelectorUI` of all connections'
+    global _ui_generation # pylint: disable=global-statement
+    _ui_generation += 1
+
+
+class _UICache:
+    'Subtrees resolved for one connection, valid while the generation does not change'
+
+    __slots__ = ('generation', 'trees', 'hits', 'misses', '__weakref__')
+
+    def __init__(self):
+        self.generation = _ui_generation
+        self.trees = {}
+        self.hits = 0
+        self.misses = 0
+
+    def check(self):
+        if self.generation != _ui_generation:
+            self.trees.clear()
+            self.generation = _ui_generation
+
+
+_ui_caches = weakref.WeakKeyDictionary()
+
+class SelectorUI:
+    '''
+    Access widgets and menus of OBS by selectors, see `compile_selector`
+
+    Widgets read by `select` are cached for the connection and served locally,
+    also for selectors under a cached one, until the cache is discarded by
+    `invoke`, `menu_trigger`, `Session.send` of a request other than `Get*`
+    and `READ_ONLY_VENDOR_REQUESTS`, `RequestBatch.send`, a request of
+    `asyncws` or `ConfigTemplates.apply`. Requests sent directly on a client
+    do not discard the cache, call `invalidate_ui_cache` after them.
+    Pass `fresh=True` when polling for a change made by OBS itself.
+
+    :param cl:  Client returned by `self.obs.get_obsws()`
+    :param ui:  Object with the methods of `obsui.OBSUI` on `cl`, `obsui.OBSUI(cl)` by default
+    '''
+
+    def __init__(self, cl, ui=None):
+        if ui is None:
+            from onsdriver import obsui # pylint: disable=import-outside-toplevel
+            ui = obsui.OBSUI(cl)
+        self.ui = ui
+        self.cache = _ui_caches.get(cl)
+        if self.cache is None:
+            self.cache = _ui_caches[cl] = _UICache()
+
+    @staticmethod
+    def _matches(node, step):
+        return all(node.get(k) == v for k, v in step)
+
+    def _resolve_locally(self, steps):
+        for n in range(len(steps) - 1, 0, -1):
+            tree = self.cache.trees.get(steps[:n])
+            if tree is None:
+                continue
+            node = tree.root
+            for step in steps[n:]:
+                node = next((c for c in node.children if self._matches(c, step)), None)
+                if node is None:
+                    return None
+            return node
+        return None
+
+    def select(self, selector, fresh=False, within=None):
+        '''
+        Return the `WidgetNode` matched by `selector`
+
+        :param fresh:   Read from OBS even if cached
+        :param within:  Selector of an ancestor prepended to `selector`. The
+                        ancestor is read as a whole so that later selections
+                        under it are served from the cache.
+        '''
+        if within is not None:
+            self.select(within, fresh=fresh)
+            selector = f'{within} > {selector}'
+            fresh = False
+        steps = _compile_selector(selector)
+        cache = self.cache
+        cache.check()
+        if not fresh:
+            tree = cache.trees.get(steps)
+            node = tree.root if tree else self._resolve_locally(steps)
+            if node is not None:
+                cache.hits += 1
+                return node
+        cache.misses += 1
+        generation = _ui_generation
+        widget = self.ui.widget_list(path=[dict(step) for step in steps])
+        tree = WidgetTree(widget)
+        if generation == _ui_generation:
+            cache.trees[steps] = tree
+        return tree.root
+
+    def invoke(self, selector, method, *args):
+        '''
+        Call `method` of the widget matched by `selector`
+
+        :param args:  Up to 2 arguments passed as `arg1` and `arg2`
+        '''
+        data = {'path': compile_selector(selector), 'method': method}
+        for i, arg in enumerate(args):
+            data[f'arg{i + 1}'] = arg
+        try:
+            return self.ui.request('widget-invoke', data)
+        finally:
+            invalidate_ui_cache()
+
+    def menu_trigger(self, selector):
+        'Trigger the menu item matched by `selector`'
+        try:
+            return self.ui.request('menu-trigger', {'path': compile_selector(selector)})
+        finally:
+            invalidate_ui_cache()
+
+    def menu_list(self, selector):
+        'Return the menu item matched by `selector`'
+        return self.ui.menu_list(compile_selector(selector))
+
+
+class RequestIds:
+    '''
+    Request IDs unique within a session, shared by its connections
+
+    :param prefix:  Prefix of each ID
+    '''
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._count = itertools.count()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return f'{self.prefix}{next(self._count)}'
+
+
+def _is_connection_lost(e):
+    from websocket import WebSocketConnectionClosedException # pylint: disable=import-outside-toplevel
+    return isinstance(e, (WebSocketConnectionClosedException, BrokenPipeError, ConnectionResetError))
+
+
+_session_summaries = {}
+
+
+def _write_session_summaries(log_dir='logs'):
+    if not _session_summaries:
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, f'session-{os.getpid()}.json'), 'w', encoding='utf-8') as fw:
+        json.dump(_session_summaries, fw, indent=1)
+
+
+atexit.register(_write_session_summaries)
+
+
+class Session:
+    '''
+    Connection and UI handles kept for one test
+
+    The session opens its own obs-websocket connection to the OBS of `test`
+    and keeps the `obsui.OBSUI`, `SelectorUI` and `asyncws.BackgroundClient`
+    built on it, so that helpers do not rebuild them for each call. Request
+    IDs of batches and pipelined requests are taken from `ids`.
+
+    When a request fails because the connection was lost, such as after OBS
+    restarted, the session reconnects and sends the request again.
+
+    The time spent by the session itself is summed in `overhead` over
+    `calls` and written to `logs/session-<pid>.json` at exit together with
+    `setup_cost`, the time to build the handles that each call used to pay.
+
+    :param test:  The `obstest.OBSTest`
+    '''
+
+    def __init__(self, test, reconnect_timeout=30.0):
+        self.test = test
+        self.reconnect_timeout = reconnect_timeout
+        self.ids = RequestIds(f'{os.getpid()}-{id(self):x}-')
+        self.calls = 0
+        self.overhead = 0.0
+        self.setup_cost = None
+        self.reconnects = 0
+        self._cl = None
+        self._ui = None
+        self._selector = None
+        self._async = None
+
+    def _connect(self):
+        # pylint: disable=import-outside-toplevel
+        import obsws_python
+        from onsdriver import obsui
+        start = time.perf_counter()
+        base = self.test.obs.get_obsws().base_client
+        self._cl = obsws_python.ReqClient(host=base.host, port=base.port, password=base.password)
+        self._ui = obsui.OBSUI(self._cl)
+        self._selector = None
+        if self.setup_cost is None:
+            start_setup = time.perf_counter()
+            obsui.OBSUI(self.test.obs.get_obsws())
+            self.setup_cost = time.perf_counter() - start_setup
+        return time.perf_counter() - start
+
+    def _disconnect(self):
+        if self._async is not None:
+            try:
+                self._async.disconnect()
+            except Exception: # pylint: disable=broad-exception-caught
+                pass
+            self._async = None
+        if self._cl is not None:
+            try:
+                self._cl.disconnect()
+            except Exception: # pylint: disable=broad-exception-caught
+                pass
+            self._cl = None
+        self._ui = None
+        self._selector = None
+
+    def reconnect(self):
+        'Drop the handles and connect again, waiting for obs-websocket to accept'
+        self._disconnect()
+        self.reconnects += 1
+        wait_for(self._connect, lambda _: True, self.reconnect_timeout,
+                 description='obs-websocket to reconnect', ignore=(OSError, ConnectionError))
+        invalidate_ui_cache()
+
+    def _handle(self, attr):
+        start = time.perf_counter()
+        if self._cl is None:
+            start += self._connect()
+        if attr == '_selector' and self._selector is None:
+            self._selector = SelectorUI(self._cl)
+        self.calls += 1
+        self.overhead += time.perf_counter() - start
+        return getattr(self, attr)
+
+    @property
+    def cl(self):
+        'obs-websocket client of the session'
+        return self._handle('_cl')
+
+    @property
+    def ui(self):
+        '`obsui.OBSUI` on the connection of the session'
+        return self._handle('_ui')
+
+    @property
+    def selector(self):
+        '`SelectorUI` on the connection of the session'
+        return self._handle('_selector')
+
+    @property
+    def asyncws(self):
+        '`asyncws.BackgroundClient` to the same obs-websocket, taking IDs from `ids`'
+        import asyncws # pylint: disable=import-outside-toplevel
+        cl = self.cl
+        if self._async is None:
+            base = cl.base_client
+            self._async = asyncws.BackgroundClient(base.host, base.port, base.password, ids=self.ids)
+        return self._async
+
+    def call(self, fn):
+        'Return `fn(self)`, reconnecting and calling again once if the connection was lost'
+        try:
+            return fn(self)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            if not _is_connection_lost(e):
+                raise
+        self.reconnect()
+        return fn(self)
+
+    def send(self, request_type, data=None):
+        'Send an obs-websocket request, discarding widgets cached by `SelectorUI` unless it is read-only'
+        try:
+            return self.call(lambda s: s.cl.send(request_type, data))
+        finally:
+            if not is_read_only_request(request_type, data):
+                invalidate_ui_cache()
+
+    def vendor(self, vendor, request_type, data=None):
+        'Send `CallVendorRequest` and return its `response_data`'
+        return self.send('CallVendorRequest', {
+            'vendorName': vendor,
+            'requestType': request_type,
+            'requestData': data or {},
+        }).response_data
+
+    def widget_list(self, path):
+        'Call `widget_list` of `obsui.OBSUI`'
+        return self.call(lambda s: s.ui.widget_list(path=path))
+
+    def menu_trigger(self, selector):
+        'Trigger the menu item matched by `selector`'
+        return self.call(lambda s: s.selector.menu_trigger(selector))
+
+    def menu_list(self, selector):
+        'Return the menu item matched by `selector`'
+        return self.call(lambda s: s.selector.menu_list(selector))
+
+    def invoke(self, selector, method, *args):
+        'Call `method` of the widget matched by `selector`'
+        return self.call(lambda s: s.selector.invoke(selector, method, *args))
+
+    def select(self, selector, fresh=False, within=None):
+        'Return the `WidgetNode` matched by `selector`, see `SelectorUI.select`'
+        return self.call(lambda s: s.selector.select(selector, fresh=fresh, within=within))
+
+    def batch(self, **kwargs):
+        'Return a `RequestBatch` on the connection of the session'
+        return RequestBatch(self.cl, ids=self.ids, **kwargs)
+
+    def summary(self):
+        'Dict of the counts and the times per call in microseconds'
+        return {
+                'calls': self.calls,
+                'overhead_us_per_call': self.overhead / self.calls * 1e6 if self.calls else None,
+                'setup_us_replaced': self.setup_cost * 1e6 if self.setup_cost is not None else None,
+                'reconnects': self.reconnects,
+        }
+
+    def close(self):
+        'Disconnect and record the summary'
+        if self.calls:
+            _session_summaries[self.test.id()] = self.summary()
+        self._disconnect()
+
+
+class EventWatcher:
+    '''
+    Receive obs-websocket events on a separate connection
+
+    Register an expectation by `expect` before sending the request that
+    causes the event, then pass the returned future to `wait`.
+
+    :param cl:    Client returned by `self.obs.get_obsws()`, to take the connection parameters
+    :param subs:  Event subscription bits, low-volume events by default
+    '''
+
+    def __init__(self, cl, subs=None):
+        import obsws_python # pylint: disable=import-outside-toplevel
+        base = cl.base_client
+        if subs is None:
+            subs = obsws_python.Subs.LOW_VOLUME
+        self._lock = threading.Lock()
+        self._expectations = []
+        self.history = []
+        self.client = obsws_python.EventClient(host=base.host, port=base.port,
+                                               password=base.password, subs=subs)
+        self.client.callback.trigger = self._on_event
+
+    def _on_event(self, event_type, data):
+        with self._lock:
+            self.history.append((time.monotonic(), event_type, data))
+            remaining = []
+            for exp_type, predicate, future in self._expectations:
+                if exp_type != event_type:
+                    remaining.append((exp_type, predicate, future))
+                    continue
+                try:
+                    if predicate is not None and not predicate(data):
+                        remaining.append((exp_type, predicate, future))
+                        continue
+                    future.set_result(data)
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    future.set_exception(e)
+            self._expectations = remaining
+
+    def expect(self, event_type, predicate=None):
+        '''
+        Return a future resolved with the data of the next matching event
+
+        :param event_type:  Event type such as 'RecordStateChanged'
+        :param predicate:   Callable taking the event data, or None to accept any
+        '''
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._expectations.append((event_type, predicate, future))
+        return future
+
+    def wait(self, future, timeout=10.0):
+        '''
+        Wait for a future returned by `expect` and return the event data
+
+        :raises WaitTimeout: The event did not arrive in time
+        '''
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                seen = [t for _, t, _ in self.history[-10:]]
+            raise WaitTimeout(f'No expected event in {timeout} s, recent events: {seen}') from None
+
+    def disconnect(self):
+        'Close the connection'
+        self.client.disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+
+def cache_dir():
+    '''
+    Directory to keep downloaded and rendered media
+
+    Set by environment variable `TEST_CACHE_DIR`. The default is outside the
+    working directories of `parallel.py` slots so that the slots and later
+    runs share one copy.
+    '''
+    directory = os.environ.get('TEST_CACHE_DIR') or os.path.join(
+            tempfile.gettempdir(), 'plugins-test-cache')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def remove_aux_audio_device(sc_data):
+    'Scene collection transform to remove AuxAudioDevice1'
+    sc_data.pop('AuxAudioDevice1', None)
+
+
+def _clone_file(src, dst):
+    'Clone `src` to `dst` by reflink or copy'
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if sys.platform.startswith('linux'):
+        import fcntl # pylint: disable=import-outside-toplevel
+        ficlone = 0x40049409
+        with open(src, 'rb') as fr, open(dst, 'wb') as fw:
+            try:
+                fcntl.ioctl(fw.fileno(), ficlone, fr.fileno())
+                return
+            except OSError:
+                pass
+        os.unlink(dst)
+    shutil.copyfile(src, dst)
+
+
+def _onsdriver_version():
+    # pylint: disable=import-outside-toplevel
+    import importlib.metadata
+    try:
+        return importlib.metadata.version('onsdriver')
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _obs_version():
+    obs = shutil.which('obs')
+    if not obs:
+        return None
+    try:
+        res = subprocess.run([obs, '--version'], capture_output=True, check=False, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return res.stdout.decode(errors='replace').strip()
+
+
+def _source_of(f):
+    try:
+        return inspect.getsource(f)
+    except (OSError, TypeError):
+        return f'{f.__module__}.{f.__qualname__}'
+
+
+class ConfigTemplates:
+    '''
+    Build each config variant once and clone it for later tests
+
+    A variant is identified by the inputs under control of the tests: its
+    name, the variant it was applied on, its overlays, the source of the
+    scene collection transform, the config files that exist and the versions
+    of onsdriver and OBS that generated them.
+    The content of the generated files is not hashed since it includes
+    timestamps and random values.
+    The first time, the overlays are applied through the config API of
+    onsdriver and the resulting scene collection and profile are stored.
+    Later, the stored files are cloned into place by reflink or copy so that
+    OBS never writes to a template.
+    The global config holds settings of the slot such as the obs-websocket
+    port, so it is never stored. Only the keys of `global_cfg` are set to it,
+    each time.
+
+    :param directory:  Directory to keep the templates. By default, under
+                       `XDG_CONFIG_HOME`, which `parallel.py` sets for each
+                       slot, or else under `cache_dir()`.
+    '''
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._applied = weakref.WeakKeyDictionary()
+
+    @property
+    def directory(self):
+        'Directory to keep the templates'
+        if self._directory is not None:
+            return self._directory
+        return os.environ.get('CONFIG_TEMPLATE_DIR') or os.path.join(
+                os.environ.get('XDG_CONFIG_HOME') or cache_dir(), 'plugins-test-config-templates')
+
+    @staticmethod
+    def _files(config):
+        'Return a dict from a role to the path of each config file that exists'
+        sc_file = config.get_scenecollection_file()
+        files = {'scene_collection': sc_file}
+        basic = os.path.dirname(os.path.dirname(sc_file))
+        profiles = os.path.join(basic, 'profiles')
+        if os.path.isdir(profiles):
+            inis = [os.path.join(profiles, d, 'basic.ini') for d in os.listdir(profiles)]
+            inis = [f for f in inis if os.path.exists(f)]
+            if len(inis) == 1:
+                files['profile'] = inis[0]
+        return files
+
+    @staticmethod
+    def _set_global_cfg(config, global_cfg):
+        for section, values in global_cfg.items():
+            cfg = config.get_global_cfg(section)
+            for k, v in values.items():
+                cfg[k] = v
+        config.save_global_cfg()
+
+    def apply(self, config, name, scene_collection=None, profile=None, global_cfg=None):
+        '''
+        Bring the config to the variant
+
+        The variant is applied on top of the variant applied last to the same
+        `config`, if any, and the template is keyed on that one as well.
+
+        :param config:            `self.obs.config`
+        :param name:              Name of the variant
+        :param scene_collection:  Callable modifying the scene collection dict in place
+        :param profile:           Dict from a section to a dict of values to set to the profile
+        :param global_cfg:        Dict from a section to a dict of values to set to the global config
+        '''
+        invalidate_ui_cache()
+        files = self._files(config)
+        h = hashlib.sha256()
+        h.update(json.dumps([name, self._applied.get(config), _onsdriver_version(), _obs_version(),
+                             sorted(files), profile], sort_keys=True).encode())
+        if scene_collection:
+            h.update(_source_of(scene_collection).encode())
+        key = f'{name}-{h.hexdigest()[:16]}'
+        template = os.path.join(self.directory, key)
+        self._applied[config] = key
+
+        if global_cfg:
+            self._set_global_cfg(config, global_cfg)
+
+        if os.path.isdir(template):
+            for role, path in files.items():
+                _clone_file(os.path.join(template, role), path)
+            return
+
+        if scene_collection:
+            with open(files['scene_collection'], 'r', encoding='utf-8') as fr:
+                sc_data = json.load(fr)
+            scene_collection(sc_data)
+            with open(files['scene_collection'], 'w', encoding='utf-8') as fw:
+                json.dump(sc_data, fw)
+        if profile:
+            p = config.get_profile()
+            for section, values in profile.items():
+                for k, v in values.items():
+                    p[section][k] = v
+            p.save()
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        for role, path in files.items():
+            shutil.copyfile(path, os.path.join(tmp, role))
+            os.chmod(os.path.join(tmp, role), 0o444)
+        try:
+            os.rename(tmp, template)
+        except OSError:
+            # Another test of the slot stored the same variant.
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+config_templates = ConfigTemplates()
+
+
+def matrix(variants):
+    '''
+    A decorator to expand a test into one test per config variant
+
+    The class has to be decorated by `expand_matrix`. For each variant, a
+    test named `<test>_<variant>` applies the variant by `config_templates`
+    and calls the decorated method with the variant name. The expanded tests
+    get their own OBS like `fresh_obs`. Each one shuts OBS down at the end and
+    asserts that `memory_leak` is 0. Variants with the same overlays share one
+    template, also across tests.
+
+    :param variants:  Dict from a variant name to keyword arguments of `ConfigTemplates.apply`
+    '''
+    def _decorator(f):
+        f.matrix_variants = variants
+        return f
+    return _decorator
+
+
+def expand_matrix(cls):
+    'A class decorator to replace tests decorated by `matrix` with the expanded tests'
+    for name, method in list(vars(cls).items()):
+        variants = getattr(method, 'matrix_variants', None)
+        if not name.startswith('test') or variants is None:
+            continue
+        delattr(cls, name)
+        for variant, overlays in variants.items():
+            def _test(self, method=method, variant=variant, overlays=overlays):
+                # Keyed on the overlays and the base template applied by setUp, not on the test,
+                # so that variants of other tests with the same config share it
+                config_templates.apply(self.obs.config, 'matrix', **overlays)
+                method(self, variant)
+                self.obs.shutdown()
+                self.assertEqual(self.memory_leak(), 0)
+            # Without `updated`, `matrix_variants` would be copied from `__dict__` of the method.
+            test = functools.wraps(method, updated=())(_test)
+            test.__wrapped__ = method
+            test.__name__ = f'{name}_{variant}'
+            test.__qualname__ = f'{cls.__qualname__}.{test.__name__}'
+            test.fresh_obs = True
+            setattr(cls, test.__name__, test)
+    return cls
+
+if os.environ.get('PROFILE'):
+    import profiler # pylint: disable=wrong-import-position
+    profiler.install()
+
+if os.environ.get('STATS'):
+    import stats # pylint: disable=wrong-import-position
+    stats.install()
@@ -0,0 +1,298 @@
+'''
+Persistent history of benchmark results with regression gating
+
+Usage:
+  python test-plugins/history.py record [--plugins-file plugins.txt | --revisions revisions.json]
+  python test-plugins/history.py compare [--window 10] [--fail]
+  python test-plugins/history.py revisions --plugins-file plugins.txt > revisions.json
+
+`record` appends the results of this run found in `logs/` to a JSON-lines
+store, `benchmark-history.jsonl` by default, one line per test and run:
+- `logs/benchmark-*.json` written by `benchmark.Report`, one test per point
+- `logs/profile-summary-*.json` written by `profiler`, the time of each test
+- `logs/stats-*.json` written by `stats`, prefixed by `stats.`
+
+Each line is keyed by the OS, the OBS version, the revisions of the plugins
+listed in the plugins file and the test ID. The revision of a plugin is the
+installed package version, or the hash of the installed plugin binary for a
+plugin given by its repository URL.
+`compare` checks the last run against a rolling baseline of the previous
+runs on the same OS and reports metrics that became significantly worse.
+Only metrics in `GATED_METRICS` fail the run with `--fail`, the others are
+too noisy or count-like and are reported for information.
+'''
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_STORE = 'benchmark-history.jsonl'
+
+# Metrics whose larger value is better, other metrics are worse when larger
+HIGHER_IS_BETTER = ('keeps_up', 'active_fps', 'n')
+
+# Timing metrics of benchmarks and tests that `--fail` gates on
+GATED_METRICS = (
+        'get_loudness_ms.median',
+        'get_loudness_ms.p95',
+        'roundtrip_ms',
+        'render_ms',
+        'first_measurement_s',
+        'stats.render_time_added_ms',
+)
+
+
+def _plugin_dirs():
+    home = os.path.expanduser('~')
+    dirs = [
+            os.path.join(os.environ.get('XDG_CONFIG_HOME') or os.path.join(home, '.config'),
+                         'obs-studio', 'plugins'),
+            os.path.join(home, 'Library', 'Application Support', 'obs-studio', 'plugins'),
+    ]
+    for var in ('ProgramData', 'APPDATA'):
+        if os.environ.get(var):
+            dirs.append(os.path.join(os.environ[var], 'obs-studio', 'plugins'))
+    if os.environ.get('ProgramFiles'):
+        dirs.append(os.path.join(os.environ['ProgramFiles'], 'obs-studio', 'obs-plugins'))
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def _installed_binary(name):
+    'Return the path of the installed module of plugin `name`, or None'
+    for plugin_dir in _plugin_dirs():
+        for root, _, files in os.walk(plugin_dir):
+            for f in files:
+                stem, ext = os.path.splitext(f)
+                if (stem == name and ext in ('.so', '.dll')) or (
+                        f == name and os.path.basename(root) == 'MacOS'):
+                    return os.path.join(root, f)
+    return None
+
+
+def _plugin_revision(entry):
+    if '://' in entry:
+        # The tip of the repository may differ from the release that was installed.
+        path = _installed_binary(entry.rstrip('/').rsplit('/', 1)[-1])
+        if path is None:
+            return None
+        with open(path, 'rb') as fr:
+            return 'sha256:' + hashlib.sha256(fr.read()).hexdigest()[:16]
+    cmd = ['dpkg-query', '-W', '-f', '${Version}', entry]
+    try:
+        res = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return res.stdout.split()[0] if res.stdout.strip() else None
+
+
+def plugin_revisions(plugins_file):
+    'Return a dict from each entry of `plugins_file` to the hash of its installed binary or package version'
+    with open(plugins_file, 'r', encoding='utf-8') as fr:
+        entries = [line.strip() for line in fr if line.strip() and not line.startswith('#')]
+    return {e: _plugin_revision(e) for e in entries}
+
+
+def _plugins_key(plugins):
+    text = json.dumps(plugins, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+def _flatten(d, prefix=''):
+    ret = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            ret.update(_flatten(v, f'{prefix}{k}.'))
+        elif isinstance(v, bool):
+            ret[prefix + k] = float(v)
+        elif isinstance(v, (int, float)):
+            ret[prefix + k] = float(v)
+    return ret
+
+
+def _load_json(pattern):
+    for filename in sorted(glob.glob(pattern)):
+        with open(filename, 'r', encoding='utf-8') as fr:
+            yield json.load(fr)
+
+
+def collect(log_dir):
+    '''
+    Read results of this run from `log_dir`
+
+    :return:  Tuple of the OBS version or None and a list of (test ID, metrics)
+    '''
+    obs_version = None
+    results = []
+    by_test = {}
+    for report in _load_json(os.path.join(log_dir, 'benchmark-*.json')):
+        obs_version = obs_version or report.get('context', {}).get('obs_version')
+        key = report.get('key', [])
+        for point in report['points']:
+            point_id = ','.join(f'{k}={point.get(k)}' for k in key)
+            metrics = _flatten({k: v for k, v in point.items() if k not in key})
+            results.append((f'benchmark:{report["benchmark"]}[{point_id}]', metrics))
+    for summary in _load_json(os.path.join(log_dir, 'profile-summary-*.json')):
+        for test_id, entry in summary.items():
+            if 'total' not in entry:
+                continue
+            metrics = by_test.setdefault(test_id, {})
+            metrics['total_s'] = entry['total']
+            for category, seconds in entry['categories'].items():
+                metrics[f'{category}_s'] = seconds
+    for summary in _load_json(os.path.join(log_dir, 'stats-*.json')):
+        for test_id, entry in summary.items():
+            by_test.setdefault(test_id, {}).update(_flatten(entry, 'stats.'))
+    results.extend(by_test.items())
+    return obs_version, results
+
+
+def record(store, log_dir, plugins, run_id=None):
+    '''
+    Append results of this run to `store` and return the run ID
+
+    :param plugins:  Dict returned by `plugin_revisions`
+    '''
+    obs_version, results = collect(log_dir)
+    run_id = run_id or os.environ.get('GITHUB_RUN_ID') or time.strftime('%Y%m%dT%H%M%S')
+    common = {
+            'run': run_id,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'os': platform.system(),
+            'obs_version': obs_version,
+            'plugins_key': _plugins_key(plugins),
+            'plugins': plugins,
+    }
+    with open(store, 'a', encoding='utf-8') as fw:
+        for test_id, metrics in results:
+            fw.write(json.dumps(dict(common, test=test_id, metrics=metrics)) + '\n')
+    print(f'Recorded {len(results)} results of run {run_id} to {store}')
+    return run_id
+
+
+def load(store):
+    'Return all lines of `store`'
+    if not os.path.exists(store):
+        return []
+    with open(store, 'r', encoding='utf-8') as fr:
+        return [json.loads(line) for line in fr if line.strip()]
+
+
+class Regression:
+    'A metric of a test that became worse than the baseline'
+
+    __slots__ = ('test', 'metric', 'value', 'baseline', 'score', 'changes', 'gated')
+
+    def __init__(self, test, metric, value, baseline, score, changes):
+        self.test = test
+        self.metric = metric
+        self.value = value
+        self.baseline = baseline
+        self.score = score
+        self.changes = changes
+        self.gated = metric in GATED_METRICS
+
+    def __str__(self):
+        change = f' after {", ".join(self.changes)} changed' if self.changes else ''
+        return (f'{self.test} {self.metric}: {self.value:.4g} against baseline {self.baseline:.4g} '
+                f'(score {self.score:.1f}){change}')
+
+
+def compare(records, run_id=None, window=10, min_runs=3, threshold=3.0, min_change=0.1):
+    '''
+    Compare a run against the previous runs
+
+    A metric regresses when it is worse than the median of the last `window`
+    runs of the same test on the same OS by more than `threshold` times the
+    scaled median absolute deviation and by more than `min_change` relative.
+
+    :param run_id:  Run to check, the last one by default
+    :return:        List of `Regression`
+    '''
+    if not records:
+        return []
+    run_id = run_id or records[-1]['run']
+    current = [r for r in records if r['run'] == run_id]
+    history = {}
+    for r in records:
+        if r['run'] != run_id:
+            history.setdefault((r['os'], r['test']), []).append(r)
+
+    regressions = []
+    for r in current:
+        previous = history.get((r['os'], r['test']), [])[-window:]
+        if len(previous) < min_runs:
+            continue
+        changes = []
+        if previous[-1]['plugins_key'] != r['plugins_key']:
+            changes.append('plugins')
+        if previous[-1]['obs_version'] != r['obs_version']:
+            changes.append('OBS')
+        for metric, value in r['metrics'].items():
+            samples = np.array([p['metrics'][metric] for p in previous if metric in p['metrics']])
+            if len(samples) < min_runs:
+                continue
+            sign = -1.0 if metric.split('.')[-1] in HIGHER_IS_BETTER else 1.0
+            median = float(np.median(samples))
+            mad = 1.4826 * float(np.median(np.abs(samples - median)))
+            delta = sign * (value - median)
+            scale = max(mad, abs(median) * 0.01, 1e-9)
+            if delta / scale > threshold and delta > min_change * abs(median):
+                regressions.append(Regression(r['test'], metric, value, median, delta / scale, changes))
+    return regressions
+
+
+def main():
+    'Entry point'
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--store', default=DEFAULT_STORE)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('record', help='Append results of this run')
+    p.add_argument('--logs', default='logs')
+    p.add_argument('--plugins-file', default=None)
+    p.add_argument('--revisions', default=None, help='Output of the revisions command')
+    p.add_argument('--run-id', default=None)
+    p = sub.add_parser('revisions', help='Print revisions of the plugins as JSON')
+    p.add_argument('--plugins-file', required=True)
+    p = sub.add_parser('compare', help='Compare the last run against the previous runs')
+    p.add_argument('--run-id', default=None)
+    p.add_argument('--window', type=int, default=10)
+    p.add_argument('--min-runs', type=int, default=3)
+    p.add_argument('--threshold', type=float, default=3.0)
+    p.add_argument('--min-change', type=float, default=0.1)
+    p.add_argument('--fail', action='store_true', help='Exit with 1 if any metric in GATED_METRICS regresses')
+    args = parser.parse_args()
+
+    if args.command == 'revisions':
+        json.dump(plugin_revisions(args.plugins_file), sys.stdout, indent=1)
+        return 0
+
+    if args.command == 'record':
+        plugins = {}
+        if args.revisions and os.path.exists(args.revisions):
+            with open(args.revisions, 'r', encoding='utf-8') as fr:
+                plugins = json.load(fr)
+        elif args.plugins_file:
+            plugins = plugin_revisions(args.plugins_file)
+        record(args.store, args.logs, plugins, args.run_id)
+        return 0
+
+    regressions = compare(load(args.store), args.run_id, args.window, args.min_runs,
+                          args.threshold, args.min_change)
+    for r in regressions:
+        print(f'Regression: {r}' if r.gated else f'Info: Not gated: {r}')
+    gated = [r for r in regressions if r.gated]
+    if not gated:
+        print('No regression')
+    return 1 if gated and args.fail else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,502 @@
+'''
+Run the tests over a pool of isolated OBS instances
+
+Usage: python test-plugins/parallel.py -j 4 [test-name ...]
+       python test-plugins/parallel.py -j 1 --shard 0/3 [test-name ...]
+       python test-plugins/parallel.py --update-durations test-durations.json results.json ...
+
+Each worker slot owns a config directory, an obs-websocket port and a
+virtual X display so that several OBS can run on one Linux machine.
+Workers fail a test whose OBS config or obs-websocket client is not the one
+of its slot. Downloaded media is cached outside the slots, see
+`helpers.cache_dir`.
+Tests of a class sharing one OBS (see `helpers.SharedOBSMixin`) are kept
+in the same unit, other tests, including `helpers.fresh_obs` tests and the
+variants expanded by `helpers.matrix`, are distributed one by one.
+Logs of the workers are merged into `logs/`, combining the points of
+benchmark reports of the same name, and the results are written to
+`logs/parallel-results.json`.
+
+Durations of the tests are kept in `test-durations.json` as a moving average
+over runs. Units are started longest first, and `--shard INDEX/COUNT` runs one
+of COUNT shards balanced by longest-processing-time-first packing so that
+several CI jobs can split the suite. Every shard has to see the same
+durations file to get the same packing.
+'''
+
+import argparse
+import configparser
+import heapq
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+import benchmark
+import helpers
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds assumed for a test without history if no test has history
+DEFAULT_DURATION = 30.0
+
+
+def _iter_tests(suite):
+    for t in suite:
+        if isinstance(t, unittest.TestSuite):
+            yield from _iter_tests(t)
+        else:
+            yield t
+
+
+def discover(names=None):
+    '''
+    Load tests and group them into units that have to run in one process
+
+    :param names:  Test names as accepted by unittest, or None to discover all
+    :return:       List of lists of test IDs
+    '''
+    loader = unittest.TestLoader()
+    if names:
+        suite = loader.loadTestsFromNames(names)
+    else:
+        suite = loader.discover(TEST_DIR, top_level_dir=TEST_DIR)
+
+    units = []
+    shared = {}
+    for t in _iter_tests(suite):
+        if isinstance(t, unittest.loader._FailedTest): # pylint: disable=protected-access
+            # Let the worker report the import error of the module.
+            units.append([t._testMethodName]) # pylint: disable=protected-access
+        elif getattr(type(t), 'shared_obs', False) and not getattr(
+                getattr(t, t._testMethodName), 'fresh_obs', False): # pylint: disable=protected-access
+            cls_id = f'{type(t).__module__}.{type(t).__qualname__}'
+            if cls_id not in shared:
+                shared[cls_id] = []
+                units.append(shared[cls_id])
+            shared[cls_id].append(t.id())
+        else:
+            units.append([t.id()])
+    return units
+
+
+def load_durations(filename):
+    'Return a dict from a test ID to its duration in seconds'
+    if not filename or not os.path.exists(filename):
+        return {}
+    with open(filename, 'r', encoding='utf-8') as fr:
+        return json.load(fr)
+
+
+def update_durations(durations, records, weight=0.5):
+    'Blend durations of result records into `durations` by exponential moving average'
+    for r in records:
+        if r['duration'] is None:
+            continue
+        old = durations.get(r['id'])
+        durations[r['id']] = r['duration'] if old is None else old + weight * (r['duration'] - old)
+    return durations
+
+
+def save_durations(filename, durations):
+    'Write `durations` to `filename`'
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fw:
+        json.dump(durations, fw, indent=1, sort_keys=True)
+    os.replace(tmp, filename)
+
+
+def unit_duration(unit, durations):
+    'Expected seconds to run a unit, using the median of known tests for unknown ones'
+    known = sorted(durations.values())
+    default = known[len(known) // 2] if known else DEFAULT_DURATION
+    return sum(durations.get(i, default) for i in unit)
+
+
+def sort_units(units, durations):
+    'Return units ordered longest first, ties broken by the first test ID'
+    return sorted(units, key=lambda u: (-unit_duration(u, durations), u[0]))
+
+
+def plan_shards(units, count, durations):
+    '''
+    Pack units into `count` shards by longest-processing-time-first
+
+    :return:  List of (expected seconds, list of units) for each shard
+    '''
+    shards = [(0.0, []) for _ in range(count)]
+    heap = [(0.0, k) for k in range(count)]
+    for unit in sort_units(units, durations):
+        load, k = heapq.heappop(heap)
+        load += unit_duration(unit, durations)
+        shards[k] = (load, shards[k][1] + [unit])
+        heapq.heappush(heap, (load, k))
+    return shards
+
+
+def _parse_shard(text):
+    index, count = (int(x) for x in text.split('/'))
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'shard index has to be 0 to {count - 1}')
+    return index, count
+
+
+class _JSONResult(unittest.TextTestResult):
+    'Test result recording outcomes to be sent to the parent process'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records = []
+        self._start = {}
+
+    def startTest(self, test):
+        self._start[test.id()] = time.monotonic()
+        super().startTest(test)
+
+    def _record(self, test, outcome, message=None):
+        start = self._start.get(test.id())
+        self.records.append({
+            'id': test.id(),
+            'outcome': outcome,
+            'duration': time.monotonic() - start if start else None,
+            'message': message,
+        })
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, 'success')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, 'failure', self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, 'error', self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, 'skip', reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, 'expected-failure')
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, 'unexpected-success')
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            outcome = 'failure' if issubclass(err[0], test.failureException) else 'error'
+            self._record(subtest, outcome, self._exc_info_to_string(err, test))
+
+
+def _run_ids(ids):
+    suite = unittest.defaultTestLoader.loadTestsFromNames(ids)
+    runner = unittest.TextTestRunner(resultclass=_JSONResult, verbosity=2)
+    return runner.run(suite)
+
+
+class IsolationError(RuntimeError):
+    'Raised in a worker when OBS or its client does not use the port or config of the slot'
+
+
+def _install_isolation_check(port, config_home):
+    '''
+    Check that onsdriver honors the environment of the slot
+
+    Each obs-websocket client has to connect to `port` and the config of each
+    test has to be under `config_home`, otherwise two slots could drive the
+    same OBS or edit the same config.
+    '''
+    # pylint: disable=import-outside-toplevel
+    import obsws_python
+    from onsdriver import obstest
+
+    config_home = os.path.realpath(config_home)
+    init_orig = obsws_python.ReqClient.__init__
+    setup_orig = obstest.OBSTest.setUp
+
+    def __init__(self, *args, **kwargs):
+        init_orig(self, *args, **kwargs)
+        if int(self.base_client.port) != port:
+            raise IsolationError(f'obs-websocket client uses port {self.base_client.port}, '
+                                 f'the slot has {port}')
+
+    def setUp(self, *args, **kwargs): # pylint: disable=invalid-name
+        setup_orig(self, *args, **kwargs)
+        sc_file = os.path.realpath(self.obs.config.get_scenecollection_file())
+        if os.path.commonpath([sc_file, config_home]) != config_home:
+            raise IsolationError(f'Config {sc_file} is outside {config_home} of the slot')
+
+    obsws_python.ReqClient.__init__ = __init__
+    obstest.OBSTest.setUp = setUp
+
+
+def _worker_main(ids, result_file):
+    sys.path.insert(0, TEST_DIR)
+    _install_isolation_check(int(os.environ['OBS_WEBSOCKET_PORT']), os.environ['XDG_CONFIG_HOME'])
+    result = _run_ids(ids)
+    with open(result_file, 'w', encoding='utf-8') as fw:
+        json.dump(result.records, fw)
+    return 0 if result.wasSuccessful() else 1
+
+
+def run_in_process(units):
+    '''
+    Run units of tests in this process without isolation
+
+    :return:  List of result records
+    '''
+    return _run_ids([i for unit in units for i in unit]).records
+
+
+def _update_durations_main(filename, result_files):
+    durations = load_durations(filename)
+    for result_file in result_files:
+        with open(result_file, 'r', encoding='utf-8') as fr:
+            update_durations(durations, json.load(fr))
+    save_durations(filename, durations)
+    return 0
+
+
+def _default_obs_config_home():
+    return os.environ.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config'))
+
+
+def _set_websocket_port(config_home, port):
+    'Write the obs-websocket port to every OBS config found in `config_home`'
+    for root, _, files in os.walk(config_home):
+        for f in files:
+            path = os.path.join(root, f)
+            if f in ('global.ini', 'user.ini'):
+                cp = configparser.ConfigParser(interpolation=None, strict=False)
+                cp.optionxform = str
+                cp.read(path, encoding='utf-8-sig')
+                if not cp.has_section('OBSWebSocket'):
+                    continue
+                cp['OBSWebSocket']['ServerPort'] = str(port)
+                with open(path, 'w', encoding='utf-8') as fw:
+                    cp.write(fw, space_around_delimiters=False)
+            elif f == 'config.json' and os.path.basename(root) == 'obs-websocket':
+                with open(path, 'r', encoding='utf-8') as fr:
+                    data = json.load(fr)
+                data['server_port'] = port
+                with open(path, 'w', encoding='utf-8') as fw:
+                    json.dump(data, fw)
+
+
+class Slot:
+    '''
+    Resources owned by one worker
+
+    :param index:     Index of the slot
+    :param work_dir:  Directory to hold the files of all slots
+    :param args:      Parsed command line arguments
+    '''
+
+    def __init__(self, index, work_dir, args):
+        self.index = index
+        self.dir = os.path.join(work_dir, f'slot-{index}')
+        self.config_home = os.path.join(self.dir, 'config')
+        self.port = args.base_port + index
+        self.display = f':{args.base_display + index}' if args.xvfb else None
+        self.xvfb = None
+        self.xvfb_args = ['-screen', '0', f'{args.graphics_size}x24', '-nolisten', 'tcp']
+        self.obs_config_home = args.obs_config_home
+
+    def prepare(self):
+        'Create the config directory and start the display'
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.config_home)
+        for name in os.listdir(self.obs_config_home):
+            if not name.startswith('obs'):
+                continue
+            src = os.path.join(self.obs_config_home, name)
+            dst = os.path.join(self.config_home, name)
+            if os.path.isdir(src):
+                # Plugins are large and read-only, link them instead of copying.
+                shutil.copytree(src, dst, symlinks=True,
+                                ignore=lambda d, names, src=src: ['plugins'] if d == src else [])
+                if os.path.isdir(os.path.join(src, 'plugins')):
+                    os.symlink(os.path.join(src, 'plugins'), os.path.join(dst, 'plugins'))
+            else:
+                shutil.copy2(src, dst)
+        _set_websocket_port(self.config_home, self.port)
+
+        if self.display:
+            self.xvfb = subprocess.Popen(['Xvfb', self.display] + self.xvfb_args,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            socket = f'/tmp/.X11-unix/X{self.display[1:]}'
+            helpers.wait_until(lambda: os.path.exists(socket) or self.xvfb.poll() is not None,
+                               timeout=10.0, description=f'Xvfb {self.display}')
+            if self.xvfb.poll() is not None:
+                raise RuntimeError(f'Xvfb {self.display} exited with {self.xvfb.returncode}')
+
+    def env(self):
+        'Environment variables for the worker process'
+        env = dict(os.environ)
+        env['XDG_CONFIG_HOME'] = self.config_home
+        env['OBS_WEBSOCKET_PORT'] = str(self.port)
+        env.setdefault('CAPABILITIES_FILE', os.path.join(self.dir, 'capabilities.json'))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, (TEST_DIR, env.get('PYTHONPATH'))))
+        if self.display:
+            env['DISPLAY'] = self.display
+        return env
+
+    def run(self, ids, log):
+        'Run tests in a worker process and return the records'
+        result_file = os.path.join(self.dir, 'result.json')
+        if os.path.exists(result_file):
+            os.unlink(result_file)
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker', result_file] + ids
+        proc = subprocess.run(cmd, cwd=self.dir, env=self.env(), check=False,
+                              stdout=log, stderr=subprocess.STDOUT)
+        if not os.path.exists(result_file):
+            return [{'id': i, 'outcome': 'error', 'duration': None,
+                     'message': f'worker exited with {proc.returncode}'} for i in ids]
+        with open(result_file, 'r', encoding='utf-8') as fr:
+            return json.load(fr)
+
+    def close(self):
+        'Stop the display'
+        if self.xvfb:
+            self.xvfb.terminate()
+            self.xvfb.wait()
+
+
+def _merge_tree(src, dst):
+    if not os.path.isdir(src):
+        return
+    for root, _, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        os.makedirs(os.path.join(dst, rel), exist_ok=True)
+        for f in files:
+            target = os.path.join(dst, rel, f)
+            if f.startswith('benchmark-') and f.endswith('.json') and os.path.exists(target):
+                # Another slot wrote a report of the same name, keep the points of both.
+                with open(os.path.join(root, f), 'r', encoding='utf-8') as fr:
+                    benchmark.merge_into(target, json.load(fr))
+                continue
+            shutil.copy2(os.path.join(root, f), target)
+
+
+def run_parallel(units, args):
+    '''
+    Run units of tests over `args.jobs` slots
+
+    :return:  List of result records
+    '''
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs('logs/parallel', exist_ok=True)
+    pending = queue.Queue()
+    for unit in units:
+        pending.put(unit)
+    records = []
+    lock = threading.Lock()
+    merge_lock = threading.Lock()
+
+    def _worker(slot):
+        slot.prepare()
+        try:
+            log_name = f'logs/parallel/slot-{slot.index}.txt'
+            with open(log_name, 'a', encoding='utf-8') as log:
+                while True:
+                    try:
+                        unit = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    res = slot.run(unit, log)
+                    with lock:
+                        records.extend(res)
+                        for r in res:
+                            print(f'[{slot.index}] {r["id"]} ... {r["outcome"]}', flush=True)
+        finally:
+            slot.close()
+            with merge_lock:
+                _merge_tree(os.path.join(slot.dir, 'logs'), 'logs')
+                _merge_tree(os.path.join(slot.dir, 'screenshots'), 'screenshots')
+
+    slots = [Slot(i, work_dir, args) for i in range(args.jobs)]
+    threads = [threading.Thread(target=_worker, args=(s,)) for s in slots]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return records
+
+
+def main():
+    'Entry point'
+    if len(sys.argv) > 2 and sys.argv[1] == '--worker':
+        return _worker_main(sys.argv[3:], sys.argv[2])
+    if len(sys.argv) > 2 and sys.argv[1] == '--update-durations':
+        return _update_durations_main(sys.argv[2], sys.argv[3:])
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--base-port', type=int, default=4460)
+    parser.add_argument('--base-display', type=int, default=100)
+    parser.add_argument('--xvfb', action=argparse.BooleanOptionalAction,
+                        default=shutil.which('Xvfb') is not None)
+    parser.add_argument('--graphics-size', default='640x360')
+    parser.add_argument('--obs-config-home', default=_default_obs_config_home())
+    parser.add_argument('--work-dir', default='parallel-work')
+    parser.add_argument('--isolate', action=argparse.BooleanOptionalAction, default=None,
+                        help='Run in worker slots, default if more than one job')
+    parser.add_argument('--shard', type=_parse_shard, default=None, metavar='INDEX/COUNT')
+    parser.add_argument('--durations', default='test-durations.json')
+    parser.add_argument('names', nargs='*')
+    args = parser.parse_args()
+    if args.isolate is None:
+        args.isolate = args.jobs > 1
+
+    if not sys.platform.startswith('linux') and args.isolate:
+        parser.error('isolated workers are only supported on Linux, use -j 1')
+
+    sys.path.insert(0, TEST_DIR)
+    durations = load_durations(args.durations)
+    units = sort_units(discover(args.names), durations)
+    if args.shard:
+        index, count = args.shard
+        for k, (load, shard_units) in enumerate(plan_shards(units, count, durations)):
+            print(f'Shard {k}: {len(shard_units)} units, {load:.0f}s expected')
+            if k == index:
+                units = shard_units
+    start = time.monotonic()
+    if args.isolate:
+        records = run_parallel(units, args)
+    else:
+        records = run_in_process(units)
+    elapsed = time.monotonic() - start
+
+    save_durations(args.durations, update_durations(durations, records))
+
+    os.makedirs('logs', exist_ok=True)
+    with open('logs/parallel-results.json', 'w', encoding='utf-8') as fw:
+        json.dump(records, fw, indent=1)
+
+    counts = {}
+    for r in records:
+        counts[r['outcome']] = counts.get(r['outcome'], 0) + 1
+        if r['outcome'] in ('failure', 'error'):
+            print('=' * 70)
+            print(f'{r["outcome"].upper()}: {r["id"]}')
+            print('-' * 70)
+            print(r['message'])
+    print('-' * 70)
+    print(f'Ran {len(records)} tests in {elapsed:.3f}s with {args.jobs} workers')
+    print(' '.join(f'{k}={v}' for k, v in sorted(counts.items())))
+    failed = counts.get('failure', 0) + counts.get('error', 0) + counts.get('unexpected-success', 0)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
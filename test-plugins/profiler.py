@@ -0,0 +1,197 @@
+'''
+Time-budget profiler for the test harness
+
+Set environment variable `PROFILE=1` to record how each test spends its
+time in OBS startup, obs-websocket round trips, UI queries and idle waits.
+At exit, these files are written to `logs/`, suffixed by the process ID:
+- `profile-<pid>.json`: Chrome trace events, loadable by Perfetto or speedscope
+- `profile-<pid>.folded`: Folded stacks for flamegraph.pl
+- `profile-summary-<pid>.json`: Seconds per category for each test
+'''
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+CATEGORIES = ('startup', 'websocket', 'ui', 'idle', 'other')
+
+# Requests made inside these are accounted to the outer category.
+_INHERITING = ('startup', 'ui')
+
+
+class _Frame:
+    __slots__ = ('name', 'category', 'start', 'children')
+
+    def __init__(self, name, category, start):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.children = 0.0
+
+
+class Profiler:
+    'Collect nested spans of the running tests'
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.events = []
+        self.folded = {}
+        self.summary = {}
+        self.test = None
+        self.test_thread = None
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def begin(self, name, category):
+        'Open a span, to be closed by `end`'
+        stack = self._stack()
+        if stack and stack[-1].category in _INHERITING:
+            category = stack[-1].category
+        stack.append(_Frame(name, category, time.perf_counter()))
+
+    def end(self):
+        'Close the innermost span'
+        stack = self._stack()
+        frame = stack.pop()
+        duration = time.perf_counter() - frame.start
+        exclusive = duration - frame.children
+        if stack:
+            stack[-1].children += duration
+        path = ';'.join([self.test or '(none)'] + [f.name for f in stack] + [frame.name])
+
+        with self.lock:
+            self.events.append({
+                'name': frame.name,
+                'cat': frame.category,
+                'ph': 'X',
+                'ts': (frame.start - self.t0) * 1e6,
+                'dur': duration * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': {'test': self.test},
+            })
+            self.folded[path] = self.folded.get(path, 0.0) + exclusive
+            if self.test and threading.get_ident() == self.test_thread:
+                categories = self.summary[self.test]['categories']
+                categories[frame.category] = categories.get(frame.category, 0.0) + exclusive
+
+    def wrap(self, obj, attr, category, name=None):
+        '''
+        Replace `obj.attr` by a function recording a span for each call
+
+        :param name:  Callable taking the arguments of the call and returning the span name
+        '''
+        orig = getattr(obj, attr)
+        if getattr(orig, '_profiled', False):
+            return
+
+        @functools.wraps(orig)
+        def wrapper(*args, **kwargs):
+            self.begin(name(*args, **kwargs) if name else attr, category)
+            try:
+                return orig(*args, **kwargs)
+            finally:
+                self.end()
+
+        wrapper._profiled = True # pylint: disable=protected-access
+        setattr(obj, attr, wrapper)
+
+    def start_test(self, test_id):
+        'Account following spans of this thread to `test_id`'
+        self.test = test_id
+        self.test_thread = threading.get_ident()
+        self.summary[test_id] = {'start': time.perf_counter(), 'categories': {}}
+
+    def stop_test(self):
+        'Finish the current test and compute the time not covered by any span'
+        entry = self.summary[self.test]
+        total = time.perf_counter() - entry.pop('start')
+        categories = entry['categories']
+        categories['other'] = max(0.0, total - sum(categories.values()))
+        entry['total'] = total
+        self.test = None
+
+    def write(self, log_dir='logs'):
+        'Write the trace, the folded stacks and the summary'
+        os.makedirs(log_dir, exist_ok=True)
+        pid = os.getpid()
+        with open(os.path.join(log_dir, f'profile-{pid}.json'), 'w', encoding='utf-8') as fw:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, fw)
+        with open(os.path.join(log_dir, f'profile-{pid}.folded'), 'w', encoding='utf-8') as fw:
+            for path, seconds in sorted(self.folded.items()):
+                fw.write(f'{path} {int(seconds * 1e6)}\n')
+        with open(os.path.join(log_dir, f'profile-summary-{pid}.json'), 'w', encoding='utf-8') as fw:
+            json.dump(self.summary, fw, indent=1)
+
+
+_profiler = None
+
+
+def get_profiler():
+    'Return the installed profiler or None'
+    return _profiler
+
+
+def install():
+    'Patch the harness to record spans and write the result at exit'
+    # pylint: disable=import-outside-toplevel
+    global _profiler # pylint: disable=global-statement
+    if _profiler:
+        return _profiler
+    from onsdriver import obstest, obsui
+    import obsws_python
+    import helpers
+
+    p = Profiler()
+    _profiler = p
+
+    run_orig = obstest.OBSTest.run
+
+    def run(self, result=None):
+        p.start_test(self.id())
+        try:
+            return run_orig(self, result)
+        finally:
+            p.stop_test()
+
+    obstest.OBSTest.run = run
+
+    setup_orig = obstest.OBSTest.setUp
+
+    def setup(self, *args, **kwargs):
+        p.begin('OBSTest.setUp', 'startup')
+        try:
+            return setup_orig(self, *args, **kwargs)
+        finally:
+            p.end()
+            obs = getattr(self, 'obs', None)
+            if obs is not None:
+                p.wrap(type(obs), 'run', 'startup', lambda *_, **__: 'obs.run')
+
+    obstest.OBSTest.setUp = setup
+
+    def _first_arg(prefix):
+        return lambda _self, *args, **kwargs: f'{prefix} {args[0] if args else ""}'.strip()
+
+    p.wrap(obsws_python.ReqClient, 'send', 'websocket', _first_arg('send'))
+    p.wrap(helpers.RequestBatch, 'send', 'websocket', lambda *_, **__: 'RequestBatch')
+    p.wrap(obsui.OBSUI, 'request', 'ui', _first_arg('ui'))
+    for attr in ('widget_list', 'menu_list'):
+        if hasattr(obsui.OBSUI, attr):
+            p.wrap(obsui.OBSUI, attr, 'ui', lambda *_, attr=attr, **__: attr)
+    p.wrap(time, 'sleep', 'idle', lambda *_, **__: 'sleep')
+    for attr in ('wait_for', 'hold'):
+        p.wrap(helpers, attr, 'idle', lambda *_, attr=attr, **kwargs: kwargs.get('description') or attr)
+    p.wrap(helpers.EventWatcher, 'wait', 'idle', lambda *_, **__: 'EventWatcher.wait')
+
+    atexit.register(p.write)
+    return p
+
@@ -0,0 +1,194 @@
+'''
+Reference model of EBU R 128 loudness
+
+Computes the expected momentary, short-term, integrated loudness and the
+peak of a signal so that the values on the loudness dock can be compared
+at any moment, not only after the level is stable.
+'''
+
+import math
+import types
+import numpy as np
+
+SUBBLOCK = 0.1 # seconds, the update step of the meters
+MOMENTARY_SUBBLOCKS = 4
+SHORT_SUBBLOCKS = 30
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+TRUE_PEAK_OVERSAMPLE = 4
+
+
+def _k_weighting(rate):
+    'Return the two biquads of K-weighting as pairs of (b, a) for `rate`'
+    # Pre-filter, high-shelf
+    f0 = 1681.974450955533
+    gain = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / rate)
+    vh = math.pow(10.0, gain / 20.0)
+    vb = math.pow(vh, 0.4996667741545416)
+    a0 = 1.0 + k / q + k * k
+    shelf = (
+            ((vh + vb * k / q + k * k) / a0, 2.0 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0),
+            (1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0),
+    )
+
+    # RLB filter, high-pass
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / rate)
+    a0 = 1.0 + k / q + k * k
+    highpass = (
+            (1.0, -2.0, 1.0),
+            (1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0),
+    )
+    return shelf, highpass
+
+
+def _k_response(rate, n):
+    'Frequency response of K-weighting at the bins of `np.fft.rfft` of length `n`'
+    z = np.exp(-1j * 2.0 * np.pi * np.fft.rfftfreq(n))
+    h = np.ones_like(z)
+    for b, a in _k_weighting(rate):
+        h *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return h
+
+
+def k_weight(samples, rate):
+    '''
+    Apply K-weighting
+
+    The filter is applied in the frequency domain with enough padding for
+    the impulse response to decay, which keeps the whole signal vectorized.
+
+    :param samples:  Array of shape (channels, frames)
+    :param rate:     Sample rate
+    '''
+    frames = samples.shape[-1]
+    n = 1 << int(frames + rate // 2 - 1).bit_length()
+    spectrum = np.fft.rfft(samples, n) * _k_response(rate, n)
+    return np.fft.irfft(spectrum, n)[..., :frames]
+
+
+def _loudness(energy):
+    with np.errstate(divide='ignore'):
+        return -0.691 + 10.0 * np.log10(energy)
+
+
+def _true_peak(samples, rate, chunk_seconds=1.0):
+    'Running maximum of the 4x oversampled absolute value, per sub-block'
+    sub = int(rate * SUBBLOCK)
+    chunk = max(sub, int(rate * chunk_seconds) // sub * sub)
+    margin = 256
+    frames = samples.shape[-1]
+    peaks = []
+    for start in range(0, frames - frames % sub, chunk):
+        end = min(start + chunk, frames - frames % sub)
+        lo = max(0, start - margin)
+        hi = min(frames, end + margin)
+        n = hi - lo
+        spectrum = np.fft.rfft(samples[:, lo:hi], n)
+        over = np.fft.irfft(spectrum, n * TRUE_PEAK_OVERSAMPLE) * TRUE_PEAK_OVERSAMPLE
+        over = over[:, (start - lo) * TRUE_PEAK_OVERSAMPLE:(end - lo) * TRUE_PEAK_OVERSAMPLE]
+        over = np.abs(over).max(axis=0)
+        peaks.append(over.reshape(-1, sub * TRUE_PEAK_OVERSAMPLE).max(axis=1))
+    if not peaks:
+        return np.zeros(0)
+    return np.maximum.accumulate(np.concatenate(peaks))
+
+
+def _relative_gated_mean(blocks, thresholds, chunk=256):
+    '''
+    Mean of the values in `blocks[:i + 1]` above `thresholds[i]` for each i, 0 if none
+
+    Rows are compared in chunks to bound the memory of the comparison.
+    '''
+    n = len(blocks)
+    total = np.zeros(n)
+    count = np.zeros(n)
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        rows = np.arange(start, end)[:, np.newaxis]
+        with np.errstate(invalid='ignore'):
+            mask = (blocks[np.newaxis, :end] > thresholds[start:end, np.newaxis]) & (np.arange(end) <= rows)
+        total[start:end] = mask @ blocks[:end]
+        count[start:end] = mask.sum(axis=1)
+    return np.divide(total, count, out=np.zeros(n), where=count > 0)
+
+
+class Curves:
+    '''
+    Values of the meters at the end of each sub-block of 100 ms
+
+    Each attribute except `rate` is an array of the same length as `times`.
+    Loudness values are in LUFS and peaks are in dBFS.
+    '''
+
+    def __init__(self, samples, rate):
+        self.rate = rate
+        sub = int(rate * SUBBLOCK)
+        n_sub = samples.shape[-1] // sub
+        weighted = k_weight(samples, rate)[:, :n_sub * sub]
+        energy = np.square(weighted).reshape(weighted.shape[0], n_sub, sub).mean(axis=2).sum(axis=0)
+
+        cumsum = np.concatenate(([0.0], np.cumsum(energy)))
+        idx = np.arange(1, n_sub + 1)
+        momentary = (cumsum[idx] - cumsum[np.maximum(idx - MOMENTARY_SUBBLOCKS, 0)]) / MOMENTARY_SUBBLOCKS
+        short = (cumsum[idx] - cumsum[np.maximum(idx - SHORT_SUBBLOCKS, 0)]) / SHORT_SUBBLOCKS
+
+        # Gating blocks of 400 ms overlapping by 75%, available from the 4th sub-block.
+        block = momentary.copy()
+        block[:MOMENTARY_SUBBLOCKS - 1] = 0.0
+        gated = np.where(block > math.pow(10.0, (ABSOLUTE_GATE + 0.691) / 10.0), block, 0.0)
+        gated_count = np.cumsum(gated > 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            threshold = np.cumsum(gated) / gated_count * math.pow(10.0, RELATIVE_GATE / 10.0)
+        integrated = _loudness(_relative_gated_mean(gated, threshold))
+
+        self.times = idx * SUBBLOCK
+        self.momentary = _loudness(momentary)
+        self.short = _loudness(short)
+        self.integrated = integrated
+        with np.errstate(divide='ignore'):
+            self.sample_peak = 20.0 * np.log10(np.maximum.accumulate(
+                np.abs(samples[:, :n_sub * sub]).max(axis=0).reshape(n_sub, sub).max(axis=1)))
+            self.true_peak = 20.0 * np.log10(_true_peak(samples, rate))
+
+    def at(self, t):
+        '''
+        Values at `t` seconds from the start
+
+        :return:  Namespace with momentary, short, integrated, sample_peak and true_peak
+        '''
+        i = min(max(int(round(t / SUBBLOCK)) - 1, 0), len(self.times) - 1)
+        return types.SimpleNamespace(
+                momentary=float(self.momentary[i]),
+                short=float(self.short[i]),
+                integrated=float(self.integrated[i]),
+                sample_peak=float(self.sample_peak[i]),
+                true_peak=float(self.true_peak[i]),
+        )
+
+    def last(self):
+        'Values at the end of the signal'
+        return self.at(self.times[-1])
+
+
+def tone(schedule, rate=48000, freq=(440, 440)):
+    '''
+    Synthesize the output of the asynchronous-audio-source with a gain filter
+
+    :param schedule:  List of (gain in dB, duration in seconds)
+    :param rate:      Sample rate
+    :param freq:      Frequency of each channel
+    :return:          Array of shape (channels, frames)
+    '''
+    frames = [int(round(d * rate)) for _, d in schedule]
+    gain = np.repeat([math.pow(10.0, db / 20.0) for db, _ in schedule], frames)
+    t = np.arange(gain.shape[0]) / rate
+    return np.stack([np.sin(2.0 * np.pi * f * t) * gain for f in freq])
+
+
+def tone_curves(schedule, rate=48000, freq=(440, 440)):
+    'Return `Curves` of `tone`'
+    return Curves(tone(schedule, rate, freq), rate)
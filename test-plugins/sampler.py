@@ -0,0 +1,203 @@
+'''
+Background samplers keeping timestamped time series
+'''
+
+import abc
+import array
+import bisect
+import threading
+import time
+import asyncws
+import helpers
+
+
+class Series:
+    '''
+    Samples with monotonic timestamps stored in compact arrays
+
+    :param fields:  Names of the numeric fields
+    '''
+
+    def __init__(self, fields):
+        self.t = array.array('d')
+        self.columns = {f: array.array('d') for f in fields}
+
+    def __len__(self):
+        return len(self.t)
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def append(self, t, values):
+        'Add a sample, missing fields are stored as NaN'
+        self.t.append(t)
+        for f, column in self.columns.items():
+            v = values.get(f)
+            column.append(float('nan') if v is None else float(v))
+
+    def _since(self, start):
+        return bisect.bisect_left(self.t, start)
+
+    def settle_time(self, field, target, tolerance, start=None):
+        '''
+        Seconds from `start` until the value enters and stays within `tolerance` of `target`
+
+        :param start:  Monotonic time to measure from, the first sample by default
+        :return:       Seconds, or None if not settled
+        '''
+        if not self.t:
+            return None
+        if start is None:
+            start = self.t[0]
+        column = self.columns[field]
+        settled = None
+        for i in range(self._since(start), len(self.t)):
+            if abs(column[i] - target) <= tolerance:
+                if settled is None:
+                    settled = self.t[i]
+            else:
+                settled = None
+        return None if settled is None else settled - start
+
+    def overshoot(self, field, target, start=None):
+        'Largest excess of the value over `target` after `start`, negative if never reached'
+        column = self.columns[field]
+        i = 0 if start is None else self._since(start)
+        values = [v for v in column[i:] if v == v]
+        return max(values) - target if values else None
+
+    def is_converged(self, field, tolerance, duration):
+        'Whether the values of the last `duration` seconds stay within a span of `tolerance`'
+        if not self.t or self.t[-1] - self.t[0] < duration:
+            return False
+        values = self.columns[field][self._since(self.t[-1] - duration):]
+        if any(v != v for v in values):
+            return False
+        return max(values) - min(values) <= tolerance
+
+    def slice(self, start, end=None):
+        'Return a dict from a field to the list of values sampled from `start` until `end`'
+        i = self._since(start)
+        j = len(self.t) if end is None else self._since(end)
+        return {f: list(c[i:j]) for f, c in self.columns.items()}
+
+    def last(self):
+        'The last sample as a dict, or None'
+        if not self.t:
+            return None
+        return {f: c[-1] for f, c in self.columns.items()}
+
+
+class Sampler(abc.ABC):
+    '''
+    Call `sample` at a fixed rate in a background thread
+
+    Subclasses implement `sample` returning a dict from a key to a dict of
+    field values, which is appended to `self.series[key]`.
+
+    :param fields:  Names of the numeric fields of each series
+    :param rate:    Samples per second
+    '''
+
+    def __init__(self, fields, rate=50.0):
+        self.fields = fields
+        self.interval = 1.0 / rate
+        self.series = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @abc.abstractmethod
+    def sample(self):
+        'Return a dict from the key of a series to a dict of values'
+
+    def __getitem__(self, key):
+        return self.series[key]
+
+    def wait_converged(self, key, field, tolerance, duration, timeout=10.0):
+        'Wait until `field` of the series `key` converges, see `Series.is_converged`'
+        def _converged():
+            with self.lock:
+                series = self.series.get(key)
+                return series is not None and series.is_converged(field, tolerance, duration)
+        helpers.wait_until(_converged, timeout, description=f'{field} of {key} to converge')
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                values = self.sample()
+                t = time.monotonic()
+                with self.lock:
+                    for key, v in values.items():
+                        if key not in self.series:
+                            self.series[key] = Series(self.fields)
+                        self.series[key].append(t, v)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                self.errors.append(e)
+            next_time += self.interval
+            self._stop.wait(max(0.0, next_time - time.monotonic()))
+
+    def start(self):
+        'Start sampling'
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        'Stop sampling and wait for the thread'
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def connect_like(cl):
+    'Open another request client to the same obs-websocket as `cl`'
+    import obsws_python # pylint: disable=import-outside-toplevel
+    base = cl.base_client
+    return obsws_python.ReqClient(host=base.host, port=base.port, password=base.password)
+
+
+class LoudnessSampler(Sampler):
+    '''
+    Sample `get_loudness` of obs-loudness-dock for each tab
+
+    Uses its own pipelining connection so that the test can keep sending
+    requests and all tabs are read in one round trip.
+
+    :param cl:     Client returned by `self.obs.get_obsws()`
+    :param names:  Tab names, None for the current tab
+    :param rate:   Samples per second
+    '''
+
+    FIELDS = ('momentary', 'short', 'integrated', 'peak')
+
+    def __init__(self, cl, names=(None,), rate=50.0, vendor='obs-loudness-dock'):
+        super().__init__(self.FIELDS, rate)
+        self.names = names
+        self.vendor = vendor
+        self.cl = asyncws.BackgroundClient.like(cl)
+
+    def sample(self):
+        responses = self.cl.gather(*(
+            ('CallVendorRequest', {
+                'vendorName': self.vendor,
+                'requestType': 'get_loudness',
+                'requestData': {'name': name} if name else {},
+            })
+            for name in self.names
+        ))
+        return {name: res.response_data for name, res in zip(self.names, responses)}
+
+    def stop(self):
+        super().stop()
+        self.cl.disconnect()
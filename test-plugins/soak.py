@@ -0,0 +1,136 @@
+'''
+Soak runs repeating a cycle while tracking resources of OBS
+
+`Soak.run` calls a cycle function many times, sampling the resident memory,
+handles and threads of the OBS process every few cycles with the duration
+of each cycle. A linear trend is fitted after a warm-up so that slow leaks
+and per-cycle slowdowns show up as slopes. Results are written to
+`logs/soak-<name>.json`.
+'''
+
+import json
+import os
+import time
+
+import numpy as np
+import psutil
+
+# Default number of cycles, overridden by environment variable `SOAK_CYCLES`
+DEFAULT_CYCLES = 2000
+
+
+def cycles(default=DEFAULT_CYCLES):
+    'Number of cycles to run'
+    return int(os.environ.get('SOAK_CYCLES', default))
+
+
+def find_obs_process():
+    'Return the OBS process started by this process'
+    for p in psutil.Process().children(recursive=True):
+        try:
+            if p.name().lower().startswith('obs'):
+                return p
+        except psutil.Error:
+            continue
+    raise RuntimeError('OBS process not found')
+
+
+def _handles(p):
+    if hasattr(p, 'num_handles'):
+        return p.num_handles()
+    return p.num_fds()
+
+
+class Soak:
+    '''
+    Repeat a cycle and record the resources
+
+    :param name:          Name of the result file
+    :param process:       `psutil.Process` of OBS, found by `find_obs_process` by default
+    :param sample_every:  Number of cycles between samples of the resources
+    :param warmup:        Fraction of the cycles excluded from the trend
+    '''
+
+    def __init__(self, name, process=None, sample_every=10, warmup=0.1):
+        self.name = name
+        self.process = process or find_obs_process()
+        self.sample_every = sample_every
+        self.warmup = warmup
+        self.durations = []
+        self.samples = [] # (cycle, rss in MiB, handles, threads)
+
+    def _sample(self, cycle):
+        with self.process.oneshot():
+            self.samples.append((
+                    cycle,
+                    self.process.memory_info().rss / (1 << 20),
+                    _handles(self.process),
+                    self.process.num_threads(),
+            ))
+
+    def run(self, cycle_fn, n=None):
+        '''
+        Call `cycle_fn(i)` for `i` in `range(n)`
+
+        :param n:  Number of cycles, `cycles()` by default
+        '''
+        n = cycles() if n is None else n
+        self._sample(0)
+        for i in range(n):
+            t = time.perf_counter()
+            cycle_fn(i)
+            self.durations.append(time.perf_counter() - t)
+            if (i + 1) % self.sample_every == 0 or i + 1 == n:
+                self._sample(i + 1)
+        return self.trend()
+
+    def trend(self):
+        '''
+        Slopes fitted after the warm-up
+
+        :return:  Dict of growth per 1000 cycles of `rss_mb`, `handles`, `threads`
+                  and `duration_ms`, and the mean `cycle_ms`
+        '''
+        ret = {}
+        samples = np.array(self.samples, dtype=float)
+        start = int(len(samples) * self.warmup)
+        if len(samples) - start >= 2:
+            x = samples[start:, 0]
+            for col, key in ((1, 'rss_mb'), (2, 'handles'), (3, 'threads')):
+                ret[key] = float(np.polyfit(x, samples[start:, col], 1)[0]) * 1000
+        durations = np.array(self.durations) * 1e3
+        start = int(len(durations) * self.warmup)
+        if len(durations) - start >= 2:
+            x = np.arange(start, len(durations))
+            ret['duration_ms'] = float(np.polyfit(x, durations[start:], 1)[0]) * 1000
+            ret['cycle_ms'] = float(durations[start:].mean())
+        return ret
+
+    def write(self, log_dir='logs'):
+        'Write the samples and the trend'
+        os.makedirs(log_dir, exist_ok=True)
+        filename = os.path.join(log_dir, f'soak-{self.name}.json')
+        with open(filename, 'w', encoding='utf-8') as fw:
+            json.dump({
+                'name': self.name,
+                'cycles': len(self.durations),
+                'trend_per_1000_cycles': self.trend(),
+                'samples': [dict(zip(('cycle', 'rss_mb', 'handles', 'threads'), s))
+                            for s in self.samples],
+                'durations_ms': [d * 1e3 for d in self.durations],
+            }, fw)
+        return filename
+
+    def assert_trend(self, test, rss_mb=1.0, handles=1.0, threads=0.5, duration_ms=1.0):
+        '''
+        Fail `test` if a slope per 1000 cycles exceeds its limit
+
+        :param test:  The `unittest.TestCase`
+        '''
+        trend = self.trend()
+        print(f'Soak {self.name}: {trend}')
+        self.write()
+        limits = {'rss_mb': rss_mb, 'handles': handles, 'threads': threads, 'duration_ms': duration_ms}
+        for key, limit in limits.items():
+            if key in trend:
+                test.assertLessEqual(trend[key], limit, f'{key} grows per 1000 cycles')
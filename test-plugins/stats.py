@@ -0,0 +1,219 @@
+'''
+Performance statistics of OBS attached to each test
+
+Set environment variable `STATS=1` to sample `GetStats` in the background
+while OBS is running. For each test, a summary of its time window is written
+to `logs/stats-<pid>.json` at exit.
+
+A test class can declare budgets of the summary in `stats_budget`, which
+fail the test when exceeded, for example::
+
+    stats_budget = {
+        'render_time_added_ms': 0.5,
+        'render_skipped_frames': 0,
+    }
+
+`render_time_added_ms` and `memory_added_mb` are relative to the first
+`STATS_BASELINE` seconds, 1 by default, after OBS started and before the
+test does anything.
+'''
+
+import atexit
+import json
+import os
+import time
+import sampler
+
+
+class StatsSampler(sampler.Sampler):
+    '''
+    Sample `GetStats` of obs-websocket
+
+    Uses its own connection so that the test can keep sending requests.
+
+    :param cl:    Client returned by `self.obs.get_obsws()`
+    :param rate:  Samples per second
+    '''
+
+    FIELDS = (
+            'average_frame_render_time',
+            'render_skipped_frames',
+            'output_skipped_frames',
+            'cpu_usage',
+            'memory_usage',
+    )
+
+    def __init__(self, cl, rate=5.0):
+        super().__init__(self.FIELDS, rate)
+        self.cl = sampler.connect_like(cl)
+
+    def sample(self):
+        res = self.cl.send('GetStats')
+        return {None: {f: getattr(res, f) for f in self.FIELDS}}
+
+    def stop(self):
+        super().stop()
+        self.cl.disconnect()
+
+    def window(self, start, end=None):
+        'Return a dict from a field to the list of values between `start` and `end`'
+        with self.lock:
+            series = self.series.get(None)
+            if series is None:
+                return {f: [] for f in self.FIELDS}
+            return series.slice(start, end)
+
+
+def _mean(values):
+    values = [v for v in values if v == v]
+    return sum(values) / len(values) if values else None
+
+
+def _increase(values):
+    values = [v for v in values if v == v]
+    return values[-1] - values[0] if values else None
+
+
+def summarize(s, start, end, baseline):
+    '''
+    Summary of the samples of `s` between `start` and `end`
+
+    :param baseline:  Pair of monotonic times of the baseline window
+    '''
+    values = s.window(start, end)
+    base = s.window(*baseline)
+    render = values['average_frame_render_time']
+    memory = values['memory_usage']
+    summary = {
+            'samples': len(render),
+            'render_time_ms': _mean(render),
+            'render_time_max_ms': max(render) if render else None,
+            'render_skipped_frames': _increase(values['render_skipped_frames']),
+            'output_skipped_frames': _increase(values['output_skipped_frames']),
+            'cpu_usage': _mean(values['cpu_usage']),
+            'memory_mb': max(memory) if memory else None,
+    }
+    base_render = _mean(base['average_frame_render_time'])
+    base_memory = _mean(base['memory_usage'])
+    if summary['render_time_ms'] is not None and base_render is not None:
+        summary['render_time_added_ms'] = summary['render_time_ms'] - base_render
+    if summary['memory_mb'] is not None and base_memory is not None:
+        summary['memory_added_mb'] = summary['memory_mb'] - base_memory
+    return summary
+
+
+def check_budget(summary, budget):
+    'Return messages for the values of `summary` exceeding `budget`'
+    messages = []
+    for key, limit in sorted(budget.items()):
+        value = summary.get(key)
+        if value is not None and value > limit:
+            messages.append(f'{key} {value:.3f} exceeds the budget {limit}')
+    return messages
+
+
+class _Instance:
+    'Sampler of one running OBS'
+
+    def __init__(self, obs, baseline_seconds):
+        self.sampler = StatsSampler(obs.get_obsws())
+        self.sampler.start()
+        start = time.monotonic()
+        time.sleep(baseline_seconds)
+        self.baseline = (start, time.monotonic())
+        self.stopped = None
+
+    def stop(self):
+        if self.stopped is None:
+            self.sampler.stop()
+            self.stopped = time.monotonic()
+
+
+_summaries = {}
+
+
+def _write(log_dir='logs'):
+    if not _summaries:
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, f'stats-{os.getpid()}.json'), 'w', encoding='utf-8') as fw:
+        json.dump(_summaries, fw, indent=1)
+
+
+_installed = False
+
+
+def install():
+    'Patch the harness to sample the statistics and check budgets of each test'
+    # pylint: disable=import-outside-toplevel
+    global _installed # pylint: disable=global-statement
+    if _installed:
+        return
+    _installed = True
+    from onsdriver import obstest
+
+    baseline_seconds = float(os.environ.get('STATS_BASELINE', '1.0'))
+
+    def _start(obs):
+        if getattr(obs, '_stats', None) is None or obs._stats.stopped is not None:
+            obs._stats = _Instance(obs, baseline_seconds)
+
+    def _wrap_obs_class(cls):
+        if getattr(cls, '_stats_wrapped', False):
+            return
+        cls._stats_wrapped = True
+        run_orig = cls.run
+        shutdown_orig = cls.shutdown
+
+        def run(obs, *args, **kwargs):
+            ret = run_orig(obs, *args, **kwargs)
+            _start(obs)
+            return ret
+
+        def shutdown(obs, *args, **kwargs):
+            instance = getattr(obs, '_stats', None)
+            if instance:
+                instance.stop()
+            return shutdown_orig(obs, *args, **kwargs)
+
+        cls.run = run
+        cls.shutdown = shutdown
+
+    setup_orig = obstest.OBSTest.setUp
+
+    def setup(self, *args, **kwargs):
+        ret = setup_orig(self, *args, **kwargs)
+        obs = getattr(self, 'obs', None)
+        if obs is not None:
+            started = getattr(type(obs), '_stats_wrapped', False)
+            _wrap_obs_class(type(obs))
+            if not started and kwargs.get('run', True):
+                # OBS was started inside `setup_orig` before the class was wrapped.
+                _start(obs)
+        return ret
+
+    obstest.OBSTest.setUp = setup
+
+    test_run_orig = obstest.OBSTest.run
+
+    def test_run(self, result=None):
+        start = time.monotonic()
+
+        def _check():
+            instance = getattr(getattr(self, 'obs', None), '_stats', None)
+            if instance is None:
+                return
+            end = instance.stopped or time.monotonic()
+            summary = summarize(instance.sampler, max(start, instance.baseline[1]), end,
+                                instance.baseline)
+            _summaries[self.id()] = summary
+            messages = check_budget(summary, getattr(self, 'stats_budget', {}))
+            if messages:
+                raise self.failureException('; '.join(messages))
+
+        self.addCleanup(_check)
+        return test_run_orig(self, result)
+
+    obstest.OBSTest.run = test_run
+
+    atexit.register(_write)
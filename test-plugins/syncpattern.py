@@ -0,0 +1,150 @@
+'''
+Offline synthesizer of audio/video sync-pattern media
+
+The clip follows the layout of the published pattern that the sync dock
+measures. The video shows a QR code whose text lists comma-separated
+`key=value` fields, the marker index as `i` and the tone frequency as `f`,
+and the index steps up once per marker period. The audio has a burst of the
+tone at the start of each marker period, shifted by the configured offset.
+Frames are rendered by qrcode/Pillow and piped to ffmpeg, and the output is
+cached by the hash of the parameters.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+# Bump to invalidate cached files when the rendering changes.
+_VERSION = 2
+
+# Text in the QR code, formatted with the fields of `_payload_fields`.
+# `avanalysis.DEFAULT_INDEX_PATTERN` reads the index from it.
+DEFAULT_PAYLOAD = 'f={frequency},i={index}'
+
+DEFAULT_PARAMS = {
+        'width': 640,
+        'height': 360,
+        'fps': 30,
+        'duration': 60.0,
+        'offset_ms': 0,
+        'marker_interval': 30,
+        'burst_ms': 50,
+        'frequency': 3000,
+        'rate': 48000,
+        'payload': DEFAULT_PAYLOAD,
+}
+
+
+def _payload_fields(params, frame):
+    return {
+            'index': frame // params['marker_interval'],
+            'frequency': params['frequency'],
+    }
+
+
+def _render_frame(params, frame):
+    text = params['payload'].format(**_payload_fields(params, frame))
+    qr = qrcode.make(text, border=2).convert('RGB')
+    size = min(params['width'], params['height'])
+    qr = qr.resize((size, size), Image.NEAREST)
+    img = Image.new('RGB', (params['width'], params['height']), (255, 255, 255))
+    img.paste(qr, ((params['width'] - size) // 2, (params['height'] - size) // 2))
+    return img.tobytes()
+
+
+def _render_audio(params, n_frames):
+    rate = params['rate']
+    n_samples = int(n_frames * rate / params['fps'])
+    samples = np.zeros(n_samples)
+    burst = int(rate * params['burst_ms'] / 1000)
+    t = np.arange(burst) / rate
+    tone = np.sin(2.0 * np.pi * params['frequency'] * t) * 0.5
+    offset = int(rate * params['offset_ms'] / 1000)
+    for frame in range(0, n_frames, params['marker_interval']):
+        start = int(frame * rate / params['fps']) + offset
+        lo = max(start, 0)
+        hi = min(start + burst, n_samples)
+        if lo < hi:
+            samples[lo:hi] = tone[lo - start:hi - start]
+    return (samples * 32767).astype('<i2')
+
+
+def _write_wav(filename, samples, rate):
+    with wave.open(filename, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+
+
+def render(filename, params):
+    '''
+    Render a sync-pattern clip
+
+    :param filename:  Output file, the container is chosen by ffmpeg from the extension
+    :param params:    Dict with the keys of `DEFAULT_PARAMS`
+    '''
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise FileNotFoundError('ffmpeg is required to synthesize the sync pattern')
+
+    n_frames = int(params['duration'] * params['fps'])
+    with tempfile.TemporaryDirectory() as tmp:
+        wav = os.path.join(tmp, 'audio.wav')
+        _write_wav(wav, _render_audio(params, n_frames), params['rate'])
+
+        cmd = [
+                ffmpeg, '-y', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                '-s', f'{params["width"]}x{params["height"]}',
+                '-r', str(params['fps']), '-i', '-',
+                '-i', wav,
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-g', str(params['fps']),
+                '-c:a', 'aac',
+                '-shortest', filename,
+        ]
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE) as proc:
+            try:
+                image = None
+                for frame in range(n_frames):
+                    # The QR code changes once per marker period.
+                    if frame % params['marker_interval'] == 0:
+                        image = _render_frame(params, frame)
+                    proc.stdin.write(image)
+            finally:
+                proc.stdin.close()
+            if proc.wait() != 0:
+                raise RuntimeError(f'ffmpeg exited with {proc.returncode}')
+
+
+def synthesize(cache_dir='.', **kwargs):
+    '''
+    Return a sync-pattern clip, rendering it only if not cached
+
+    :param cache_dir:  Directory to keep the rendered files
+    :param kwargs:     Parameters overriding `DEFAULT_PARAMS`
+    :return:           Absolute path of the clip
+    '''
+    unknown = set(kwargs) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise TypeError(f'Unknown parameters {sorted(unknown)}')
+    params = dict(DEFAULT_PARAMS, **kwargs)
+    key = json.dumps({'version': _VERSION, **params}, sort_keys=True)
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    filename = os.path.abspath(os.path.join(cache_dir, f'sync-pattern-synth-{digest}.mp4'))
+    if os.path.exists(filename):
+        return filename
+
+    print(f'Info: Synthesizing {filename}')
+    tmp = f'{filename}.{os.getpid()}.tmp.mp4'
+    render(tmp, params)
+    os.replace(tmp, filename)
+    return filename
@@ -2,98 +2,140 @@
 Test Audio Video Sync Dock
 '''
 
-import json
 import os.path
-import time
+import re
 import unittest
+import urllib.error
 import urllib.request
-from onsdriver import obstest, obsui
+from onsdriver import obstest
+import avanalysis
+import capabilities
 import helpers
+import soak
+import syncpattern
 
 
 def _download_cache_url(url):
     base = os.path.basename(url)
-    cache = os.path.abspath(base)
+    cache = os.path.join(helpers.cache_dir(), base)
     if os.path.exists(cache):
         return cache
 
     print(f'Info: Downloading {url}')
+    # Other slots may download at the same time, only a complete file is put in place.
+    tmp = f'{cache}.{os.getpid()}.tmp'
     req = urllib.request.Request(url)
     with urllib.request.urlopen(req) as res:
-        with open(cache, 'wb') as fw:
+        with open(tmp, 'wb') as fw:
             while True:
                 data = res.read(8192)
                 if not data:
                     break
                 fw.write(data)
+    os.replace(tmp, cache)
 
     return cache
 
 
-class AudioVideoSyncDockTest(obstest.OBSTest):
-    'Major tests'
+_MEASURED_PATTERNS = {
+        'latencyDisplay': r'^-?[0-9.]* ms$',
+        'latencyPolarity': r'^Audio (early|lagged)$',
+        'indexDisplay': r'^[0-9]+$',
+        'frequencyDisplay': r'^[1-9][0-9]* Hz$',
+        'videoIndexDisplay': r'^[0-9]+ \([0-9]+% missed\)',
+        'audioIndexDisplay': r'^[0-9]+ \([0-9]+% missed\)',
+}
+
+# Allowed difference between the dock and the analysis of the recording for each marker
+_CROSS_CHECK_TOLERANCE_MS = 5
+
+# Number of markers measured by the dock while recording
+_CROSS_CHECK_MARKERS = 5
+
+# Allowed difference between the analysis of the recording and the configured offset, about one
+# video frame of the pattern and one audio frame of OBS
+_REFERENCE_TOLERANCE_MS = 25
+
+
+@capabilities.requires(docks=('Audio Video Sync',))
+class AudioVideoSyncDockTestBasic(helpers.SharedOBSMixin, obstest.OBSTest):
+    'Base class to test audio-video-sync-dock'
+
+    shared_obs_docks = ('Audio Video Sync',)
+
+    # Checked when environment variable `STATS=1` is set
+    stats_budget = {
+        'render_time_added_ms': 1.0,
+        'render_skipped_frames': 0,
+        'output_skipped_frames': 0,
+    }
 
     def setUp(self, config_name='saved-config', run=False):
+        if self.attach_shared_obs():
+            return
         super().setUp(run=False, config_name=config_name)
 
-        # Remove AuxAudioDevice1
-        sc_name = self.obs.config.get_scenecollection_file()
-        sc_data_modified = False
-        with open(sc_name, 'r', encoding='utf-8') as fr:
-            sc_data = json.load(fr)
-        if 'AuxAudioDevice1' in sc_data:
-            del sc_data['AuxAudioDevice1']
-            sc_data_modified = True
-        if sc_data_modified:
-            with open(sc_name, 'w', encoding='utf-8') as fw:
-                json.dump(sc_data, fw)
+        helpers.config_templates.apply(self.obs.config, 'base',
+                                       scene_collection=helpers.remove_aux_audio_device)
 
         if run:
-            self.obs.run()
+            self.run_obs()
 
     def _show_dock(self):
-        cl = self.obs.get_obsws()
-        ui = obsui.OBSUI(cl)
-        ui.request('menu-trigger', {
-            'path': [
-                {"text": "&Docks"},
-                {"text": "Audio Video Sync", "checked": False}
-            ]
-        })
+        self.session.menu_trigger('"&Docks" > "Audio Video Sync"[checked=false]')
+
+    def reset_obs_state(self):
+        if self.session.menu_list('"&Docks" > "Audio Video Sync"')['checked']:
+            self._dock_stop() # Clicking Stop of a stopped dock does nothing
+        super().reset_obs_state()
 
     def _dock_start(self):
-        ui = obsui.OBSUI(self.obs.get_obsws())
-        ui.request('widget-invoke', {
-            'path': [
-                {"className": "OBSDock"},
-                {"className": "SyncTestDock"},
-                {"className": "QPushButton", "text": "Start"},
-                ],
-                'method': 'click',
-        })
+        self.session.invoke('OBSDock > SyncTestDock > QPushButton[text=Start]', 'click')
 
     def _dock_stop(self):
-        ui = obsui.OBSUI(self.obs.get_obsws())
-        ui.request('widget-invoke', {
-            'path': [
-                {"className": "OBSDock"},
-                {"className": "SyncTestDock"},
-                {"className": "QPushButton", "text": "Stop"},
-                ],
-                'method': 'click',
-        })
+        self.session.invoke('OBSDock > SyncTestDock > QPushButton[text=Stop]', 'click')
 
     def _get_latency_text(self, object_name='latencyDisplay'):
-        cl = self.obs.get_obsws()
-        ui = obsui.OBSUI(cl)
-
-        w = ui.widget_list(path=[
+        w = self.session.widget_list(path=[
             {"className": "OBSDock"},
             {"className": "SyncTestDock"},
             {"className": "QLabel", "objectName": object_name},
         ])
         return w['text']
 
+    def _wait_dock(self):
+        'Wait until the dock is shown and its labels can be read'
+        return helpers.wait_for(self._get_latency_text, description='SyncTestDock',
+                                ignore=(Exception,))
+
+    def _get_snapshot(self):
+        return helpers.DockSnapshot(self.session.ui, 'SyncTestDock')
+
+    @staticmethod
+    def _is_measured(snapshot):
+        for object_name, pattern in _MEASURED_PATTERNS.items():
+            if not re.search(pattern, snapshot.text(object_name)):
+                return False
+        return True
+
+    def _wait_measurement(self, timeout=10.0):
+        'Wait until all labels on the dock show a measured value and return the snapshot'
+        return helpers.wait_for(self._get_snapshot, self._is_measured, timeout,
+                                description='latency measurement')
+
+    def _wait_next_measurement(self, index, timeout=10.0):
+        'Wait until the dock shows a measurement of a marker other than `index` and return the snapshot'
+        return helpers.wait_for(self._get_snapshot,
+                                lambda s: self._is_measured(s) and s.text('indexDisplay') != index,
+                                timeout, description=f'measurement after index {index}')
+
+    def _is_blank(self):
+        snapshot = self._get_snapshot()
+        for object_name in _MEASURED_PATTERNS:
+            if snapshot.text(object_name) != '-':
+                return False
+        return True
+
     def _create_image_input(self, scene, name, filename):
         cl = self.obs.get_obsws()
         cl.send('CreateInput', {
@@ -117,43 +159,66 @@ class AudioVideoSyncDockTest(obstest.OBSTest):
         })
 
     def _create_sync_pattern_media(self, scene, name):
-        filename = _download_cache_url(
-                'https://norihiro.github.io/obs-audio-video-sync-dock/sync-pattern-3000-small.mp4'
-        )
+        '''
+        Create the sync pattern, which the dock measures
+
+        The published pattern is used if it can be downloaded, otherwise the
+        pattern synthesized by `syncpattern`.
+        '''
+        url = 'https://norihiro.github.io/obs-audio-video-sync-dock/sync-pattern-3000-small.mp4'
+        try:
+            filename = _download_cache_url(url)
+        except urllib.error.URLError as e:
+            print(f'Info: Cannot download {url}, synthesizing the pattern instead: {e}')
+            filename = syncpattern.synthesize(helpers.cache_dir())
+        self._create_media_input(scene=scene, name=name, filename=filename)
+
+    def _create_synth_pattern_media(self, scene, name, **params):
+        'Create the pattern synthesized by `syncpattern` with `params` overriding the defaults'
+        filename = syncpattern.synthesize(helpers.cache_dir(), **params)
         self._create_media_input(scene=scene, name=name, filename=filename)
 
+
+@helpers.expand_matrix
+class AudioVideoSyncDockTest(AudioVideoSyncDockTestBasic):
+    'Major tests'
+
+    shared_obs = True
+
     def test_dock(self):
-        self.obs.run()
+        self.run_obs()
         self._create_sync_pattern_media(scene='Scene', name='media')
 
         self._show_dock()
-        time.sleep(1)
+        self._wait_dock()
 
-        self.assertEqual(self._get_latency_text(), '-')
-        self.assertEqual(self._get_latency_text('latencyPolarity'), '-')
-        self.assertEqual(self._get_latency_text('indexDisplay'), '-')
-        self.assertEqual(self._get_latency_text('frequencyDisplay'), '-')
-        self.assertEqual(self._get_latency_text('videoIndexDisplay'), '-')
-        self.assertEqual(self._get_latency_text('audioIndexDisplay'), '-')
+        values = self._get_snapshot()
+        self.assertEqual(values.text('latencyDisplay'), '-')
+        self.assertEqual(values.text('latencyPolarity'), '-')
+        self.assertEqual(values.text('indexDisplay'), '-')
+        self.assertEqual(values.text('frequencyDisplay'), '-')
+        self.assertEqual(values.text('videoIndexDisplay'), '-')
+        self.assertEqual(values.text('audioIndexDisplay'), '-')
 
         self._dock_start()
-        time.sleep(3)
+        values = self._wait_measurement()
 
-        self.assertRegex(self._get_latency_text(), r'^-?[0-9.]* ms$')
-        self.assertRegex(self._get_latency_text('latencyPolarity'), r'^Audio (early|lagged)$')
-        self.assertRegex(self._get_latency_text('indexDisplay'), r'^[0-9]+$')
-        self.assertRegex(self._get_latency_text('frequencyDisplay'), r'^[1-9][0-9]* Hz$')
-        self.assertRegex(self._get_latency_text('videoIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
-        self.assertRegex(self._get_latency_text('audioIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
+        self.assertRegex(values.text('latencyDisplay'), r'^-?[0-9.]* ms$')
+        self.assertRegex(values.text('latencyPolarity'), r'^Audio (early|lagged)$')
+        self.assertRegex(values.text('indexDisplay'), r'^[0-9]+$')
+        self.assertRegex(values.text('frequencyDisplay'), r'^[1-9][0-9]* Hz$')
+        self.assertRegex(values.text('videoIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
+        self.assertRegex(values.text('audioIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
 
         self._dock_stop()
-        time.sleep(1)
 
     @helpers.severity(helpers.SEVERITY_COVERAGE)
+    @helpers.fresh_obs
+    @capabilities.requires(input_kinds=('net.nagater.obs-audio-video-sync-dock.monitor',))
     def test_monitor(self):
-        cfg = self.obs.config.get_global_cfg('AudioVideoSyncDock')
-        cfg['ListMonitor'] = 'true'
-        self.obs.config.save_global_cfg()
+        helpers.config_templates.apply(self.obs.config, 'list-monitor', global_cfg={
+            'AudioVideoSyncDock': {'ListMonitor': 'true'},
+        })
         self.obs.run()
         cl = self.obs.get_obsws()
         self._create_sync_pattern_media(scene='Scene', name='media')
@@ -167,25 +232,29 @@ class AudioVideoSyncDockTest(obstest.OBSTest):
 
         self._show_dock()
         self._dock_start()
-        time.sleep(3)
+        index = self._wait_measurement().text('indexDisplay')
         self._dock_stop()
-        time.sleep(1)
         self._dock_start()
-        time.sleep(1)
+        self._wait_next_measurement(index)
         self._dock_stop()
 
     @helpers.severity(helpers.SEVERITY_COVERAGE)
+    @helpers.fresh_obs
+    @capabilities.requires(input_kinds=('net.nagater.obs-audio-video-sync-dock.monitor',))
     def test_monitor1(self):
-        cfg = self.obs.config.get_global_cfg('AudioVideoSyncDock')
-        cfg['ListMonitor'] = 'true'
-        self.obs.config.save_global_cfg()
+        helpers.config_templates.apply(self.obs.config, 'list-monitor', global_cfg={
+            'AudioVideoSyncDock': {'ListMonitor': 'true'},
+        })
         self.obs.run()
         cl = self.obs.get_obsws()
+        events = helpers.EventWatcher(cl)
+        self.addCleanup(events.disconnect)
         self._create_sync_pattern_media(scene='Scene', name='media')
 
         self._show_dock()
         self._dock_start()
-        time.sleep(1)
+        index = self._wait_measurement().text('indexDisplay')
+        created = events.expect('InputCreated', lambda d: d['inputName'] == 'monitor')
         cl.send('CreateInput', {
             'inputName': 'monitor',
             'sceneName': 'Scene',
@@ -193,117 +262,184 @@ class AudioVideoSyncDockTest(obstest.OBSTest):
             'inputSettings': {
             },
         })
-        time.sleep(2)
+        events.wait(created)
+        # Keep measuring while the monitor is attached.
+        self._wait_next_measurement(index)
+        removed = events.expect('InputRemoved', lambda d: d['inputName'] == 'monitor')
         cl.send('RemoveInput', {
             'inputName': 'monitor',
         })
-        time.sleep(1)
+        events.wait(removed)
         self._dock_stop()
 
+    @helpers.severity(helpers.SEVERITY_SOAK)
+    @helpers.fresh_obs
+    @capabilities.requires(input_kinds=('net.nagater.obs-audio-video-sync-dock.monitor',))
+    def test_soak_monitor(self):
+        helpers.config_templates.apply(self.obs.config, 'list-monitor', global_cfg={
+            'AudioVideoSyncDock': {'ListMonitor': 'true'},
+        })
+        self.obs.run()
+        cl = self.obs.get_obsws()
+        self._create_sync_pattern_media(scene='Scene', name='media')
+        self._show_dock()
+        self._wait_dock()
+
+        def _cycle(_):
+            self._dock_start()
+            cl.send('CreateInput', {
+                'inputName': 'monitor',
+                'sceneName': 'Scene',
+                'inputKind': 'net.nagater.obs-audio-video-sync-dock.monitor',
+                'inputSettings': {
+                },
+            })
+            cl.send('RemoveInput', {
+                'inputName': 'monitor',
+            })
+            self._dock_stop()
+
+        s = soak.Soak('sync-dock-monitor')
+        s.run(_cycle)
+        s.assert_trend(self)
+
     @helpers.severity(helpers.SEVERITY_COVERAGE)
     def test_lag_and_early(self):
-        self.obs.run()
+        self.run_obs()
         cl = self.obs.get_obsws()
         self._create_sync_pattern_media(scene='Scene', name='media')
 
         self._show_dock()
-        time.sleep(1)
+        self._wait_dock()
 
         self._dock_start()
 
-        first = True
+        index = self._wait_measurement().text('indexDisplay')
         for latency in (-100, -400, +150, +400, -150):
             with self.subTest(latency=latency):
                 cl.send('SetInputAudioSyncOffset', {
                     'inputName': 'media',
                     'inputAudioSyncOffset': latency,
                 })
-                time.sleep(2)
-                text = self._get_latency_text()
-                polarity = self._get_latency_text('latencyPolarity')
+                # The marker being measured may have been played before the offset was set.
+                index = self._wait_next_measurement(index).text('indexDisplay')
+                values = self._wait_next_measurement(index)
+                index = values.text('indexDisplay')
+                text = values.text('latencyDisplay')
+                polarity = values.text('latencyPolarity')
                 print(f'Measured {text} ({polarity}) expected {latency} ms')
-                if not first:
-                    self.assertAlmostEqual(float(text.split()[0]), latency, delta=100)
-                    if latency < -100:
-                        self.assertEqual(polarity, 'Audio early')
-                    elif latency > 100:
-                        self.assertEqual(polarity, 'Audio lagged')
-            first = False
+                self.assertAlmostEqual(float(text.split()[0]), latency, delta=100)
+                if latency < -100:
+                    self.assertEqual(polarity, 'Audio early')
+                elif latency > 100:
+                    self.assertEqual(polarity, 'Audio lagged')
 
     @helpers.severity(helpers.SEVERITY_COVERAGE)
-    def test_p010(self):
-        profile = self.obs.config.get_profile()
-        profile['Video']['ColorFormat'] = 'P010'
-        profile['Video']['ColorSpace'] = '2100PQ'
-        profile.save()
+    def test_synthesized_pattern(self):
+        'The dock measures the offset built into the synthesized pattern'
+        self.run_obs()
+        latency = 200
+        self._create_synth_pattern_media(scene='Scene', name='media', offset_ms=latency)
 
-        self.obs.run()
-        self._create_sync_pattern_media(scene='Scene', name='media')
+        self._show_dock()
+        self._dock_start()
+        index = self._wait_measurement().text('indexDisplay')
+        values = self._wait_next_measurement(index)
+        text = values.text('latencyDisplay')
+        print(f'Measured {text} ({values.text("latencyPolarity")}) expected {latency} ms')
+        self.assertEqual(values.text('frequencyDisplay'), f'{syncpattern.DEFAULT_PARAMS["frequency"]} Hz')
+        self.assertAlmostEqual(float(text.split()[0]), latency, delta=_REFERENCE_TOLERANCE_MS)
+        self.assertEqual(values.text('latencyPolarity'), 'Audio lagged')
 
+    @helpers.severity(helpers.SEVERITY_COVERAGE)
+    def test_recording_cross_check(self):
+        self.run_obs()
+        cl = self.obs.get_obsws()
+        events = helpers.EventWatcher(cl)
+        self.addCleanup(events.disconnect)
+        latency = 100
+        # The dock and `avanalysis` both decode the synthesized pattern.
+        self._create_synth_pattern_media(scene='Scene', name='media', offset_ms=latency)
         self._show_dock()
         self._dock_start()
-        time.sleep(3)
+        self._wait_measurement()
+
+        started = events.expect('RecordStateChanged',
+                                lambda d: d['outputState'] == 'OBS_WEBSOCKET_OUTPUT_STARTED')
+        cl.send('StartRecord')
+        events.wait(started)
+
+        # Latency measured by the dock for each marker index while recording
+        readings = {}
+
+        def _sample():
+            values = self._get_snapshot()
+            if self._is_measured(values):
+                readings[int(values.text('indexDisplay'))] = float(values.text('latencyDisplay').split()[0])
+            return readings
+
+        helpers.wait_for(_sample, lambda r: len(r) >= _CROSS_CHECK_MARKERS, timeout=30.0, max_interval=0.1,
+                         description=f'{_CROSS_CHECK_MARKERS} measurements while recording')
+        stopped = events.expect('RecordStateChanged',
+                                lambda d: d['outputState'] == 'OBS_WEBSOCKET_OUTPUT_STOPPED')
+        filename = cl.send('StopRecord').output_path
+        events.wait(stopped)
+        self.addCleanup(os.unlink, filename)
+        self._dock_stop()
 
-        self.assertRegex(self._get_latency_text(), r'^-?[0-9.]* ms$')
-        self.assertRegex(self._get_latency_text('latencyPolarity'), r'^Audio (early|lagged)$')
-        self.assertRegex(self._get_latency_text('indexDisplay'), r'^[0-9]+$')
-        self.assertRegex(self._get_latency_text('frequencyDisplay'), r'^[1-9][0-9]* Hz$')
-        self.assertRegex(self._get_latency_text('videoIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
-        self.assertRegex(self._get_latency_text('audioIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
+        offsets = avanalysis.analyze(filename, frequency=syncpattern.DEFAULT_PARAMS['frequency'])
+        reference = {index: offset * 1e3 for _, index, offset in offsets.items}
+        common = sorted(set(readings) & set(reference))
+        for index in common:
+            print(f'Marker {index}: {readings[index]:.1f} ms by the dock, {reference[index]:.1f} ms recorded')
+        # The first reading may be of a marker played before the recording started.
+        self.assertGreaterEqual(len(common), _CROSS_CHECK_MARKERS - 1)
+        self.assertAlmostEqual(offsets.median_ms(), latency, delta=_REFERENCE_TOLERANCE_MS)
+        for index in common:
+            with self.subTest(index=index):
+                self.assertAlmostEqual(readings[index], reference[index], delta=_CROSS_CHECK_TOLERANCE_MS)
 
     @helpers.severity(helpers.SEVERITY_COVERAGE)
-    def test_video_formats(self):
-        testcases = (
-                { 'ColorFormat': 'I010', },
-                { 'ColorFormat': 'P216', },
-                { 'ColorFormat': 'P416', },
-                { 'ColorFormat': 'RGB', },
-        )
-        first = True
-        for testcase in testcases:
-            with self.subTest(**testcase):
-                if not first:
-                    self.setUp()
-                first = False
-                profile = self.obs.config.get_profile()
-                for k, v in testcase.items():
-                    profile['Video'][k] = v
-                profile.save()
-                self._test_sync()
-                self.obs.shutdown()
-                self.assertEqual(self.memory_leak(), 0)
+    @helpers.matrix({
+            'P010': {'profile': {'Video': {'ColorFormat': 'P010', 'ColorSpace': '2100PQ'}}},
+            'I010': {'profile': {'Video': {'ColorFormat': 'I010'}}},
+            'P216': {'profile': {'Video': {'ColorFormat': 'P216'}}},
+            'P416': {'profile': {'Video': {'ColorFormat': 'P416'}}},
+            'RGB': {'profile': {'Video': {'ColorFormat': 'RGB'}}},
+    })
+    def test_video_formats(self, _variant):
+        self._test_sync()
 
     def _test_sync(self):
-        self.obs.run()
+        self.run_obs()
         self._create_sync_pattern_media(scene='Scene', name='media')
 
         self._show_dock()
         self._dock_start()
-        for _ in range(6):
-            time.sleep(0.5)
-            if self._get_latency_text() != '-':
-                break
-
-        self.assertRegex(self._get_latency_text(), r'^-?[0-9.]* ms$')
-        self.assertRegex(self._get_latency_text('latencyPolarity'), r'^Audio (early|lagged)$')
-        self.assertRegex(self._get_latency_text('indexDisplay'), r'^[0-9]+$')
-        self.assertRegex(self._get_latency_text('frequencyDisplay'), r'^[1-9][0-9]* Hz$')
-        self.assertRegex(self._get_latency_text('videoIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
-        self.assertRegex(self._get_latency_text('audioIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
+        values = self._wait_measurement()
+
+        self.assertRegex(values.text('latencyDisplay'), r'^-?[0-9.]* ms$')
+        self.assertRegex(values.text('latencyPolarity'), r'^Audio (early|lagged)$')
+        self.assertRegex(values.text('indexDisplay'), r'^[0-9]+$')
+        self.assertRegex(values.text('frequencyDisplay'), r'^[1-9][0-9]* Hz$')
+        self.assertRegex(values.text('videoIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
+        self.assertRegex(values.text('audioIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
 
     def test_blank(self):
-        self.obs.run()
+        self.run_obs()
 
         self._show_dock()
         self._dock_start()
-        time.sleep(3)
+        self._wait_dock()
+        helpers.hold(self._is_blank, 3.0, description='no measurement expected')
 
-        self.assertEqual(self._get_latency_text(), '-')
-        self.assertEqual(self._get_latency_text('latencyPolarity'), '-')
-        self.assertEqual(self._get_latency_text('indexDisplay'), '-')
-        self.assertEqual(self._get_latency_text('frequencyDisplay'), '-')
-        self.assertEqual(self._get_latency_text('videoIndexDisplay'), '-')
-        self.assertEqual(self._get_latency_text('audioIndexDisplay'), '-')
+        values = self._get_snapshot()
+        self.assertEqual(values.text('latencyDisplay'), '-')
+        self.assertEqual(values.text('latencyPolarity'), '-')
+        self.assertEqual(values.text('indexDisplay'), '-')
+        self.assertEqual(values.text('frequencyDisplay'), '-')
+        self.assertEqual(values.text('videoIndexDisplay'), '-')
+        self.assertEqual(values.text('audioIndexDisplay'), '-')
 
     @helpers.severity(helpers.SEVERITY_COVERAGE)
     def test_broken_qr(self):
@@ -311,48 +447,48 @@ class AudioVideoSyncDockTest(obstest.OBSTest):
         img = qrcode.make('A=B,C=')
         img_name = './test_broken_qr.jpeg'
         img.save(img_name)
-        self.obs.run()
+        self.run_obs()
         self._create_image_input(scene='Scene', name='media', filename=os.path.abspath(img_name))
 
         self._show_dock()
         self._dock_start()
-        time.sleep(3)
+        self._wait_dock()
+        helpers.hold(self._is_blank, 3.0, description='no measurement expected')
 
-        self.assertEqual(self._get_latency_text(), '-')
-        self.assertEqual(self._get_latency_text('latencyPolarity'), '-')
-        self.assertEqual(self._get_latency_text('indexDisplay'), '-')
-        self.assertEqual(self._get_latency_text('frequencyDisplay'), '-')
-        self.assertEqual(self._get_latency_text('videoIndexDisplay'), '-')
-        self.assertEqual(self._get_latency_text('audioIndexDisplay'), '-')
+        values = self._get_snapshot()
+        self.assertEqual(values.text('latencyDisplay'), '-')
+        self.assertEqual(values.text('latencyPolarity'), '-')
+        self.assertEqual(values.text('indexDisplay'), '-')
+        self.assertEqual(values.text('frequencyDisplay'), '-')
+        self.assertEqual(values.text('videoIndexDisplay'), '-')
+        self.assertEqual(values.text('audioIndexDisplay'), '-')
 
     @helpers.severity(helpers.SEVERITY_COVERAGE)
     def test_flip(self):
-        self.obs.run()
-        cl = self.obs.get_obsws()
+        self.run_obs()
         self._create_sync_pattern_media(scene='Scene', name='media')
-        item = cl.send('GetSceneItemId', {'sceneName': 'Scene', 'sourceName': 'media'})
-        print(cl.send('SetSceneItemTransform', {
+        batch = helpers.RequestBatch(self.obs.get_obsws())
+        batch.add('GetSceneItemId', {'sceneName': 'Scene', 'sourceName': 'media'},
+                  output_variables={'itemId': 'sceneItemId'})
+        batch.add('SetSceneItemTransform', {
             'sceneName': 'Scene',
-            'sceneItemId': item.scene_item_id,
             'sceneItemTransform': {
                 'scaleX': -1.0,
                 'positionX': 640.0,
             }
-        }))
+        }, input_variables={'sceneItemId': 'itemId'})
+        print(batch.send())
 
         self._show_dock()
         self._dock_start()
-        for _ in range(6):
-            time.sleep(0.5)
-            if self._get_latency_text() != '-':
-                break
-
-        self.assertRegex(self._get_latency_text(), r'^-?[0-9.]* ms$')
-        self.assertRegex(self._get_latency_text('latencyPolarity'), r'^Audio (early|lagged)$')
-        self.assertRegex(self._get_latency_text('indexDisplay'), r'^[0-9]+$')
-        self.assertRegex(self._get_latency_text('frequencyDisplay'), r'^[1-9][0-9]* Hz$')
-        self.assertRegex(self._get_latency_text('videoIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
-        self.assertRegex(self._get_latency_text('audioIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
+        values = self._wait_measurement()
+
+        self.assertRegex(values.text('latencyDisplay'), r'^-?[0-9.]* ms$')
+        self.assertRegex(values.text('latencyPolarity'), r'^Audio (early|lagged)$')
+        self.assertRegex(values.text('indexDisplay'), r'^[0-9]+$')
+        self.assertRegex(values.text('frequencyDisplay'), r'^[1-9][0-9]* Hz$')
+        self.assertRegex(values.text('videoIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
+        self.assertRegex(values.text('audioIndexDisplay'), r'^[0-9]+ \([0-9]+% missed\)')
 
 
 
@@ -0,0 +1,127 @@
+'''
+Time-to-first-measurement benchmark of Audio Video Sync Dock
+
+Run with `BENCHMARK=1`. Set `SYNC_BENCHMARK_SIZES` to a comma-separated list
+of canvas sizes such as `640x360,1920x1080` to change the sizes.
+'''
+
+import os
+import re
+import time
+import benchmark
+import helpers
+import test_audio_video_sync_dock
+
+_DEFAULT_SIZES = '640x360,1280x720,1920x1080'
+
+# Pairs of ColorFormat and ColorSpace
+FORMATS = (
+        ('NV12', '709'),
+        ('I010', '709'),
+        ('P010', '709'),
+        ('P010', '2100PQ'),
+        ('P216', '709'),
+        ('P416', '709'),
+        ('RGB', '709'),
+)
+
+# Seconds to wait for the first measurement before giving up
+TIMEOUT = 30.0
+
+# Seconds to keep measuring after the first measurement
+SETTLE = 5.0
+
+
+def _get_variants():
+    variants = {}
+    for size in os.environ.get('SYNC_BENCHMARK_SIZES', _DEFAULT_SIZES).split(','):
+        cx, cy = (int(x) for x in size.strip().split('x'))
+        for color_format, color_space in FORMATS:
+            variants[f'{color_format}_{color_space}_{cx}x{cy}'] = {
+                'profile': {
+                    'Video': {
+                        'ColorFormat': color_format,
+                        'ColorSpace': color_space,
+                        'BaseCX': str(cx),
+                        'BaseCY': str(cy),
+                        'OutputCX': str(cx),
+                        'OutputCY': str(cy),
+                    },
+                },
+            }
+    return variants
+
+
+_VARIANTS = _get_variants()
+
+
+def _parse_missed(text):
+    m = re.search(r'\(([0-9]+)% missed\)', text)
+    return int(m.group(1)) if m else None
+
+
+@helpers.expand_matrix
+class SyncDockBenchmark(test_audio_video_sync_dock.AudioVideoSyncDockTestBasic):
+    'Measure how long the dock takes to show a latency for each video format'
+
+    report = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Kept over classes set up again in this process, such as variants run as separate units
+        if cls.report is None:
+            cls.report = benchmark.Report('sync-time-to-first-measurement',
+                                          key=('color_format', 'color_space', 'canvas'),
+                                          timeout=TIMEOUT, settle=SETTLE)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.report.write(columns=(
+            'color_format', 'color_space', 'canvas',
+            'first_measurement_s', 'video_missed', 'audio_missed',
+            'video_missed_settled', 'audio_missed_settled',
+        ))
+        super().tearDownClass()
+
+    @benchmark.benchmark_test
+    @helpers.matrix(_VARIANTS)
+    def test_first_measurement(self, variant):
+        video = _VARIANTS[variant]['profile']['Video']
+        self.run_obs()
+        self.report.record_versions(self.obs.get_obsws())
+        self._create_sync_pattern_media(scene='Scene', name='media')
+        self._show_dock()
+        self._wait_dock()
+
+        start = time.monotonic()
+        self._dock_start()
+        try:
+            first = helpers.wait_for(self._get_snapshot, self._is_measured, TIMEOUT,
+                                     description='latency measurement',
+                                     interval=0.02, backoff=1.0)
+            elapsed = time.monotonic() - start
+        except helpers.WaitTimeout:
+            first = None
+            elapsed = None
+
+        settled = None
+        if first:
+            time.sleep(SETTLE)
+            settled = self._get_snapshot()
+        self._dock_stop()
+
+        def _missed(snapshot, object_name):
+            return _parse_missed(snapshot.text(object_name)) if snapshot else None
+
+        self.report.add(
+                color_format=video['ColorFormat'],
+                color_space=video['ColorSpace'],
+                canvas=f'{video["BaseCX"]}x{video["BaseCY"]}',
+                first_measurement_s=elapsed,
+                latency=first.text('latencyDisplay') if first else None,
+                video_missed=_missed(first, 'videoIndexDisplay'),
+                audio_missed=_missed(first, 'audioIndexDisplay'),
+                video_missed_settled=_missed(settled, 'videoIndexDisplay'),
+                audio_missed_settled=_missed(settled, 'audioIndexDisplay'),
+        )
@@ -0,0 +1,433 @@
+'''
+Test the harness against the local stand-in of OBS
+
+These tests do not start OBS and run in milliseconds.
+'''
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from obsws_python.error import OBSSDKRequestError
+import asyncws
+import benchmark
+import capabilities
+import fakeobs
+import helpers
+import history
+import parallel
+import r128
+import sampler
+
+try:
+    from onsdriver import obsui
+except ImportError:
+    obsui = None # onsdriver is not installed
+
+try:
+    import test_loudness
+except ImportError:
+    test_loudness = None
+
+requires_obsui = unittest.skipIf(obsui is None, 'requires onsdriver')
+
+
+class FakeOBSTestBase(unittest.TestCase):
+    'Base class to start `fakeobs.FakeOBS` for each test'
+
+    latency = 0.0
+
+    def setUp(self):
+        self.obs = fakeobs.FakeOBS(latency=self.latency).start()
+        self.addCleanup(self.obs.stop)
+        self.cl = self.obs.get_obsws()
+        self.ui = obsui.OBSUI(self.cl) if obsui else None
+
+    def _create_tone(self, gain):
+        with helpers.RequestBatch(self.cl) as batch:
+            batch.add('CreateInput', {
+                'inputName': 'tone',
+                'sceneName': 'Scene',
+                'inputKind': fakeobs.ASYNC_AUDIO_SOURCE,
+                'inputSettings': {'rate': 48000},
+            })
+            batch.add('CreateSourceFilter', {
+                'sourceName': 'tone',
+                'filterName': 'gain',
+                'filterKind': 'gain_filter',
+                'filterSettings': {'db': gain},
+            })
+
+    def _set_gain(self, gain):
+        self.cl.send('SetSourceFilterSettings', {
+            'sourceName': 'tone',
+            'filterName': 'gain',
+            'filterSettings': {'db': gain},
+        })
+
+    def _show_dock(self, text):
+        self.ui.request('menu-trigger', {'path': [{'text': '&Docks'}, {'text': text, 'checked': False}]})
+
+
+class HarnessTest(FakeOBSTestBase):
+    'Test helpers, samplers and clients'
+
+    def test_request_batch(self):
+        self._create_tone(gain=-20.0)
+        res = self.cl.send('GetSourceFilterList', {'sourceName': 'tone'})
+        self.assertEqual([f['filterName'] for f in res.filters], ['gain'])
+
+        batch = helpers.RequestBatch(self.cl)
+        batch.add('RemoveInput', {'inputName': 'not-exist'})
+        batch.add('RemoveInput', {'inputName': 'tone'})
+        with self.assertRaises(OBSSDKRequestError):
+            batch.send()
+        self.assertIn('tone', [i['inputName'] for i in self.cl.send('GetInputList').inputs])
+
+    def test_request_batch_variables(self):
+        self._create_tone(gain=-20.0)
+        batch = helpers.RequestBatch(self.cl, execution_type=helpers.EXECUTION_SERIAL_FRAME)
+        item = batch.add('GetSceneItemId', {'sceneName': 'Scene', 'sourceName': 'tone'},
+                         output_variables={'itemId': 'sceneItemId'})
+        batch.sleep(frames=1)
+        batch.add('SetSceneItemTransform', {
+            'sceneName': 'Scene',
+            'sceneItemTransform': {'scaleX': -1.0},
+        }, input_variables={'sceneItemId': 'itemId'})
+        batch.send()
+        res = self.cl.send('GetSceneItemTransform', {'sceneName': 'Scene', 'sceneItemId': item.data.scene_item_id})
+        self.assertEqual(res.scene_item_transform, {'scaleX': -1.0})
+
+        batch = helpers.RequestBatch(self.cl)
+        sleep = batch.sleep(frames=1)
+        batch.send(check=False)
+        self.assertFalse(sleep.ok)
+        self.assertEqual(sleep.code, 300)
+
+    def test_pause(self):
+        self._create_tone(gain=-20.0)
+        self.cl.send('CallVendorRequest', {
+            'vendorName': 'obs-loudness-dock',
+            'requestType': 'pause',
+            'requestData': {'pause': True},
+        })
+        self._set_gain(-10.0)
+        res = self.cl.send('CallVendorRequest', {
+            'vendorName': 'obs-loudness-dock',
+            'requestType': 'get_loudness',
+            'requestData': {},
+        })
+        self.assertTrue(res.response_data['paused'])
+        self.assertAlmostEqual(res.response_data['momentary'], -20.691)
+
+    def test_unknown_vendor(self):
+        with self.assertRaises(OBSSDKRequestError) as cm:
+            self.cl.send('CallVendorRequest', {'vendorName': 'none', 'requestType': 'get', 'requestData': {}})
+        self.assertEqual(cm.exception.code, 600)
+        self.assertIn('No vendor was found', str(cm.exception))
+
+    def test_empty_request_type(self):
+        with self.assertRaises(OBSSDKRequestError) as cm:
+            self.cl.send('CallVendorRequest', {'vendorName': 'obs-loudness-dock', 'requestType': '',
+                                               'requestData': {}})
+        self.assertEqual(cm.exception.code, 403)
+
+    def test_has_vendor(self):
+        self.assertTrue(capabilities._has_vendor(self.cl, 'obs-loudness-dock')) # pylint: disable=protected-access
+        self.assertFalse(capabilities._has_vendor(self.cl, 'none')) # pylint: disable=protected-access
+
+    def test_severity(self):
+        with mock.patch.dict(os.environ, {'SEVERITY': ''}):
+            self.assertIsNot(helpers.severity(helpers.SEVERITY_COVERAGE)(len), len)
+        with mock.patch.dict(os.environ, {'SEVERITY': 'full'}):
+            self.assertIs(helpers.severity(helpers.SEVERITY_COVERAGE)(len), len)
+            self.assertIsNot(helpers.severity(helpers.SEVERITY_SOAK)(len), len)
+        with mock.patch.dict(os.environ, {'SEVERITY': 'unknown'}):
+            with self.assertRaises(ValueError):
+                helpers.severity(helpers.SEVERITY_FULL)
+
+    def test_wait_for(self):
+        values = iter(range(100))
+        self.assertEqual(helpers.wait_for(lambda: next(values), lambda v: v >= 3, interval=0.001), 3)
+        with self.assertRaises(helpers.WaitTimeout):
+            helpers.wait_for(lambda: 0, timeout=0.05, description='never')
+
+    def test_loudness_sampler(self):
+        self._create_tone(gain=-20.0)
+        with sampler.LoudnessSampler(self.cl, rate=200.0) as s:
+            s.wait_converged(None, 'momentary', tolerance=0.01, duration=0.05, timeout=2.0)
+        self.assertEqual(s.errors, [])
+        self.assertAlmostEqual(s[None].last()['momentary'], -20.691, places=3)
+
+    @requires_obsui
+    def test_dock_snapshot(self):
+        self._create_tone(gain=-14.0)
+        self._show_dock('Loudness')
+        snapshot = helpers.DockSnapshot(self.ui, 'LoudnessDock')
+        self.assertEqual(snapshot.text('r128_momentary'), '-14.7')
+        self.assertEqual(snapshot['pauseButton']['text'], 'Pause')
+        self.assertEqual([n.text for n in snapshot.find(class_name='QTabBar')], [None])
+
+    @requires_obsui
+    @unittest.skipIf(test_loudness is None, 'requires onsdriver')
+    def test_parse_ui_values(self):
+        self._create_tone(gain=-14.0)
+        self._show_dock('Loudness')
+        snapshot = helpers.DockSnapshot(self.ui, 'LoudnessDock')
+        values = test_loudness.LoudnessTestBasic._parse_ui_values(snapshot) # pylint: disable=protected-access
+        self.assertAlmostEqual(values.momentary, -14.7)
+        self.assertAlmostEqual(values.peak, -14.0)
+
+    @requires_obsui
+    def test_selector_cache(self):
+        self._show_dock('Loudness')
+        ui = helpers.SelectorUI(self.cl)
+        dock = 'OBSDock > LoudnessDock'
+        self.assertEqual(ui.select('#pauseButton', within=dock)['text'], 'Pause')
+        self.assertEqual(ui.select('QTabBar', within=dock)['count'], 1)
+        self.assertEqual(ui.cache.misses, 1)
+
+        ui.invoke(f'{dock} > #pauseButton', 'click')
+        self.assertEqual(ui.select('#pauseButton', within=dock)['text'], 'Resume')
+        self.assertEqual(ui.cache.misses, 2)
+
+        # A request sent directly on the client leaves the cache as it is.
+        self.cl.send('CallVendorRequest', {
+            'vendorName': 'obs-loudness-dock',
+            'requestType': 'pause',
+            'requestData': {'pause': False},
+        })
+        self.assertEqual(ui.select('#pauseButton', within=dock)['text'], 'Resume')
+        with helpers.RequestBatch(self.cl) as batch:
+            batch.add('CallVendorRequest', {
+                'vendorName': 'obs-loudness-dock',
+                'requestType': 'pause',
+                'requestData': {'pause': True},
+            })
+            batch.add('CallVendorRequest', {
+                'vendorName': 'obs-loudness-dock',
+                'requestType': 'pause',
+                'requestData': {'pause': False},
+            })
+        self.assertEqual(ui.select('#pauseButton', within=dock)['text'], 'Pause')
+
+    @requires_obsui
+    def test_config_dialog(self):
+        self._show_dock('Loudness')
+        ui = helpers.SelectorUI(self.cl)
+        dock = 'OBSDock > LoudnessDock'
+        ui.invoke(f'{dock} > QPushButton[accessibleName=Settings]', 'click')
+        ui.invoke(f'{dock} > ConfigDialog > QPushButton#tabTableAdd', 'click')
+        ui.invoke(f'{dock} > ConfigDialog > QDialogButtonBox > QPushButton[text=OK]', 'click')
+        self.assertEqual(ui.select('QTabBar', within=dock)['count'], 2)
+        res = self.cl.send('CallVendorRequest', {
+            'vendorName': 'obs-loudness-dock',
+            'requestType': 'get_loudness',
+            'requestData': {'name': 'B'},
+        })
+        self.assertEqual(res.response_data['name'], 'B')
+
+    @requires_obsui
+    def test_sync_dock(self):
+        self._show_dock('Audio Video Sync')
+        self.obs.dock('SyncTestDock').measure(latency_ms=-12.5, delay=0.05)
+        ui = helpers.SelectorUI(self.cl)
+        ui.invoke('OBSDock > SyncTestDock > QPushButton[text=Start]', 'click')
+        snapshot = helpers.wait_for(lambda: helpers.DockSnapshot(self.ui, 'SyncTestDock'),
+                                    lambda s: s.text('latencyDisplay') != '-', timeout=2.0)
+        self.assertEqual(snapshot.text('latencyDisplay'), '12.5 ms')
+        self.assertEqual(snapshot.text('latencyPolarity'), 'Audio early')
+
+
+    @requires_obsui
+    def test_session_invalidates(self):
+        self._show_dock('Loudness')
+        session = helpers.Session(self)
+        self.addCleanup(session.close)
+        dock = 'OBSDock > LoudnessDock'
+        self.assertEqual(session.select('#pauseButton', within=dock)['text'], 'Pause')
+        session.vendor('obs-loudness-dock', 'get_loudness')
+        session.vendor('obs-loudness-dock', 'pause', {'pause': True})
+        self.assertEqual(session.select('#pauseButton', within=dock)['text'], 'Resume')
+
+
+class SelectorTest(unittest.TestCase):
+    'Test `compile_selector`'
+
+    def test_compile(self):
+        self.assertEqual(helpers.compile_selector('OBSDock > LoudnessDock > QPushButton#tabTableAdd'), [
+            {'className': 'OBSDock'},
+            {'className': 'LoudnessDock'},
+            {'className': 'QPushButton', 'objectName': 'tabTableAdd'},
+        ])
+        self.assertEqual(helpers.compile_selector('"&Docks" > "Loudness"[checked=false]'), [
+            {'text': '&Docks'},
+            {'text': 'Loudness', 'checked': False},
+        ])
+        self.assertEqual(helpers.compile_selector("QTabBar[count=2] > * > QLabel[text='A B']"), [
+            {'className': 'QTabBar', 'count': 2},
+            {},
+            {'className': 'QLabel', 'text': 'A B'},
+        ])
+
+    def test_invalid(self):
+        for selector in ('A >', '> A', 'A > > B', 'A[x=1', 'A @'):
+            with self.subTest(selector=selector):
+                with self.assertRaises(ValueError):
+                    helpers.compile_selector(selector)
+
+
+class WidgetTreeTest(unittest.TestCase):
+    'Test `WidgetTree`'
+
+    def setUp(self):
+        def _w(class_name, object_name='', text=None, children=(), **props):
+            return dict(props, className=class_name, objectName=object_name, text=text, children=list(children))
+
+        self.tree = helpers.WidgetTree(_w('LoudnessDock', children=[
+                _w('QTabBar', count=2),
+                _w('QLabel', text='Momentary'),
+                _w('QLabel', 'r128_momentary', '-14.7'),
+                _w('ConfigDialog', children=[
+                    _w('QPushButton', 'tabTableAdd', '+'),
+                    _w('QDialogButtonBox', children=[_w('QPushButton', text='OK')]),
+                ]),
+                _w('QPushButton', 'pauseButton', 'Pause'),
+        ]))
+
+    def test_order(self):
+        self.assertEqual([n.class_name for n in self.tree], [
+            'LoudnessDock', 'QTabBar', 'QLabel', 'QLabel', 'ConfigDialog', 'QPushButton',
+            'QDialogButtonBox', 'QPushButton', 'QPushButton'])
+        dialog = self.tree.first(class_name='ConfigDialog')
+        self.assertEqual([n.text for n in self.tree.descendants(dialog)], [None, '+', None, 'OK'])
+        self.assertIs(dialog.parent, self.tree.root)
+        self.assertEqual(len(self.tree.root.children), 5)
+
+    def test_find(self):
+        self.assertEqual(self.tree.texts(class_name='QPushButton'), ['+', 'OK', 'Pause'])
+        dialog = self.tree.first(class_name='ConfigDialog')
+        self.assertEqual(self.tree.texts(class_name='QPushButton', under=dialog), ['+', 'OK'])
+        self.assertEqual(self.tree.first(object_name='r128_momentary').text, '-14.7')
+        self.assertIsNone(self.tree.first(class_name='QLabel', text='Short-term'))
+
+    def test_node(self):
+        tab_bar = self.tree.first(class_name='QTabBar')
+        self.assertEqual(tab_bar['count'], 2)
+        self.assertEqual(tab_bar['className'], 'QTabBar')
+        self.assertIsNone(tab_bar.get('objectName'))
+        with self.assertRaises(KeyError):
+            tab_bar['currentIndex'] # pylint: disable=pointless-statement
+
+
+class PlanShardsTest(unittest.TestCase):
+    'Test `parallel.plan_shards`'
+
+    def test_longest_first(self):
+        durations = {'a': 5.0, 'b': 3.0, 'c': 2.0, 'd': 2.0}
+        shards = parallel.plan_shards([['b'], ['a'], ['c', 'd']], 2, durations)
+        self.assertEqual(shards, [(5.0, [['a']]), (7.0, [['c', 'd'], ['b']])])
+
+    def test_unknown_duration(self):
+        durations = {'a': 1.0, 'b': 2.0, 'c': 9.0}
+        shards = parallel.plan_shards([['a'], ['new'], ['c']], 2, durations)
+        self.assertEqual(sorted(load for load, _ in shards), [3.0, 9.0])
+
+
+class HistoryTest(unittest.TestCase):
+    'Test `history.compare`'
+
+    @staticmethod
+    def _record(run, value, fps=60.0, obs_version='30.0'):
+        return {'run': run, 'os': 'Linux', 'test': 'test_a', 'plugins_key': 'p', 'obs_version': obs_version,
+                'metrics': {'roundtrip_ms': value, 'stats.active_fps': fps}}
+
+    def test_regression(self):
+        records = [self._record(f'r{i}', 1.0 + 0.01 * (i % 3)) for i in range(5)]
+        records.append(self._record('r5', 2.0, fps=30.0, obs_version='31.0'))
+        regressions = {r.metric: r for r in history.compare(records)}
+        self.assertEqual(sorted(regressions), ['roundtrip_ms', 'stats.active_fps'])
+        self.assertTrue(regressions['roundtrip_ms'].gated)
+        self.assertFalse(regressions['stats.active_fps'].gated)
+        self.assertEqual(regressions['roundtrip_ms'].changes, ['OBS'])
+
+    def test_no_regression(self):
+        records = [self._record(f'r{i}', 1.0 + 0.01 * (i % 3)) for i in range(5)]
+        records.append(self._record('r5', 0.5, fps=61.0))
+        self.assertEqual(history.compare(records), [])
+        self.assertEqual(history.compare(records[-2:]), [])
+
+
+class R128Test(unittest.TestCase):
+    'Test the reference model `r128`'
+
+    def test_steady_tone(self):
+        values = r128.tone_curves([(-20.0, 4.0)]).last()
+        # A sine on both channels is 0.691 dB below its level, K-weighting changes little at 440 Hz.
+        for v in (values.momentary, values.short, values.integrated):
+            self.assertAlmostEqual(v, -20.691, delta=0.05)
+        self.assertAlmostEqual(values.true_peak, -20.0, delta=0.1)
+
+    def test_gating(self):
+        # Blocks below the relative gate do not count in the integrated loudness.
+        loud = r128.tone_curves([(-20.0, 4.0)]).last().integrated
+        quiet = r128.tone_curves([(-20.0, 4.0), (-40.0, 4.0)]).last().integrated
+        self.assertAlmostEqual(quiet, loud, delta=0.2)
+        mixed = r128.tone_curves([(-20.0, 4.0), (-23.0, 4.0)]).last().integrated
+        self.assertLess(mixed, loud - 1.0)
+
+    def test_short_signal(self):
+        curves = r128.tone_curves([(-20.0, 0.05)])
+        self.assertEqual(len(curves.times), 0)
+        self.assertEqual(len(curves.true_peak), 0)
+        curves = r128.tone_curves([(-20.0, 0.2)])
+        self.assertEqual(list(curves.integrated), [-float('inf')] * 2)
+
+
+class BenchmarkTest(unittest.TestCase):
+    'Test `benchmark.merge_into`'
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'benchmark-a.json')
+            report = benchmark.Report('a', key=('size',))
+            report.context['obs_version'] = '30.0'
+            report.add(size=1, ms=1.0)
+            report.add(size=2, ms=2.0)
+            benchmark.merge_into(filename, report.to_dict())
+
+            report = benchmark.Report('a', key=('size',))
+            report.context['run'] = 2
+            report.add(size=2, ms=2.5)
+            report.add(size=3, ms=3.0)
+            benchmark.merge_into(filename, report.to_dict())
+
+            with open(filename, 'r', encoding='utf-8') as fr:
+                merged = json.load(fr)
+        self.assertEqual(merged['points'], [{'size': 1, 'ms': 1.0}, {'size': 2, 'ms': 2.5}, {'size': 3, 'ms': 3.0}])
+        self.assertEqual(merged['context'], {'obs_version': '30.0', 'run': 2})
+
+
+class PipelineTest(FakeOBSTestBase):
+    'Test that pipelined requests share round trips'
+
+    latency = 0.05
+
+    def test_gather(self):
+        client = asyncws.BackgroundClient.like(self.cl)
+        self.addCleanup(client.disconnect)
+
+        start = time.monotonic()
+        responses = client.gather(*(
+            ('CallVendorRequest', {'vendorName': 'obs-loudness-dock', 'requestType': 'get_loudness',
+                                   'requestData': {}})
+            for _ in range(8)
+        ))
+        elapsed = time.monotonic() - start
+        self.assertEqual(len(responses), 8)
+        self.assertLess(elapsed, 4 * self.latency)
+
+        with self.assertRaises(OBSSDKRequestError):
+            client.gather(('NoSuchRequest', {}))
@@ -0,0 +1,183 @@
+'''
+Scalability benchmark of Loudness Dock
+
+Run with `BENCHMARK=1`. Set `LOUDNESS_BENCHMARK_SIZES` to a comma-separated
+list of `<sources>x<tabs>` to change the sizes.
+'''
+
+import math
+import os
+import time
+import benchmark
+import capabilities
+import helpers
+import r128
+import test_loudness
+
+_DEFAULT_SIZES = '1x1,4x1,8x2,16x4,32x6,64x6'
+
+# A tab measures one of the audio tracks.
+MAX_TABS = 6
+
+GAIN = -23.0
+
+
+def _get_sizes():
+    sizes = {}
+    for s in os.environ.get('LOUDNESS_BENCHMARK_SIZES', _DEFAULT_SIZES).split(','):
+        n_sources, n_tabs = (int(x) for x in s.strip().split('x'))
+        if not 1 <= n_tabs <= MAX_TABS:
+            raise ValueError(f'Number of tabs has to be 1 to {MAX_TABS}: {s}')
+        sizes[f'{n_sources}x{n_tabs}'] = (n_sources, n_tabs)
+    return sizes
+
+
+_SIZES = _get_sizes()
+
+
+def _tabs_variant(n_tabs):
+    section = {'n_tabs': str(n_tabs)}
+    for m in range(n_tabs):
+        section[f'tab.{m}.name'] = f'T{m}'
+        section[f'tab.{m}.track'] = str(m)
+        section[f'tab.{m}.trigger'] = '0'
+    return {'profile': {'LoudnessDock': section}}
+
+
+def _freq(i):
+    'Distinct frequency of each source so that their powers add up'
+    return 440 + 10 * i
+
+
+def _expected_short(freqs):
+    'Short-term loudness of the sum of tones at `GAIN`'
+    energy = 0.0
+    for f in freqs:
+        short = r128.tone_curves([(GAIN, 3.0)], freq=(f, f)).last().short
+        energy += math.pow(10.0, (short + 0.691) / 10.0)
+    return -0.691 + 10.0 * math.log10(energy)
+
+
+@helpers.expand_matrix
+@capabilities.requires(input_kinds=(test_loudness.ASYNC_AUDIO_SOURCE,))
+class LoudnessBenchmark(test_loudness.LoudnessTestBasic):
+    'Measure how the dock keeps up with the number of sources and tabs'
+
+    # Seconds to measure each size
+    duration = 5.0
+
+    report = None
+
+    def setUp(self, config_name='saved-config', run=True):
+        super().setUp(run=False, config_name=config_name)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Kept over classes set up again in this process, such as variants run as separate units
+        if cls.report is None:
+            cls.report = benchmark.Report('loudness-scaling', key=('sources', 'tabs'),
+                                          duration=cls.duration, gain=GAIN)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.report.write(columns=(
+            'sources', 'tabs',
+            'get_loudness_ms.median', 'get_loudness_ms.p95', 'roundtrip_ms',
+            'render_ms', 'render_skipped', 'cpu', 'loudness_error_db', 'keeps_up',
+        ))
+        fit = cls.report.fit('sources', 'get_loudness_ms.median')
+        if fit:
+            print(f'get_loudness: {fit[0]:.4f} ms per source')
+        fit = cls.report.fit('sources', 'render_ms')
+        if fit:
+            print(f'Render time: {fit[0]:.4f} ms per source')
+        super().tearDownClass()
+
+    def _create_sources(self, n_sources, n_tabs):
+        with helpers.RequestBatch(self.obs.get_obsws()) as batch:
+            for i in range(n_sources):
+                name = f'tone{i}'
+                batch.add('CreateInput', {
+                    'inputName': name,
+                    'sceneName': 'Scene',
+                    'inputKind': test_loudness.ASYNC_AUDIO_SOURCE,
+                    'inputSettings': {
+                        'rate': 48000,
+                        'freq-0': _freq(i),
+                        'freq-1': _freq(i),
+                    },
+                })
+                batch.add('CreateSourceFilter', {
+                    'sourceName': name,
+                    'filterName': 'gain',
+                    'filterKind': 'gain_filter',
+                    'filterSettings': {
+                        'db': GAIN,
+                    },
+                })
+                batch.add('SetInputAudioTracks', {
+                    'inputName': name,
+                    'inputAudioTracks': {str(t + 1): t == i % n_tabs for t in range(MAX_TABS)},
+                })
+
+    @benchmark.benchmark_test
+    @helpers.matrix({name: _tabs_variant(n_tabs) for name, (_, n_tabs) in _SIZES.items()})
+    def test_scaling(self, variant):
+        n_sources, n_tabs = _SIZES[variant]
+        self.obs.run()
+        cl = self.obs.get_obsws()
+        self.report.record_versions(cl)
+        self._show_dock()
+        self._create_sources(n_sources, n_tabs)
+
+        video = cl.send('GetVideoSettings')
+        frame_ms = 1e3 * video.fps_denominator / video.fps_numerator
+
+        # Let the short-term meters fill
+        time.sleep(3.5)
+
+        loudness_ms = []
+        roundtrip_ms = []
+        render_ms = []
+        cpu = []
+        short = {}
+        stats0 = cl.send('GetStats')
+        deadline = helpers.Deadline(self.duration)
+        while not deadline.expired():
+            t = time.perf_counter()
+            cl.send('GetVersion')
+            roundtrip_ms.append((time.perf_counter() - t) * 1e3)
+            for m in range(n_tabs):
+                t = time.perf_counter()
+                values = self._get_ws_values(name=f'T{m}')
+                loudness_ms.append((time.perf_counter() - t) * 1e3)
+                short[m] = values.short
+            stats = cl.send('GetStats')
+            render_ms.append(stats.average_frame_render_time)
+            cpu.append(stats.cpu_usage)
+            time.sleep(0.1)
+        stats1 = cl.send('GetStats')
+
+        errors = []
+        for m in range(n_tabs):
+            expected = _expected_short([_freq(i) for i in range(m, n_sources, n_tabs)])
+            errors.append(abs(short[m] - expected))
+
+        render_skipped = stats1.render_skipped_frames - stats0.render_skipped_frames
+        output_skipped = stats1.output_skipped_frames - stats0.output_skipped_frames
+        render_mean = sum(render_ms) / len(render_ms)
+        self.report.add(
+                sources=n_sources,
+                tabs=n_tabs,
+                get_loudness_ms=benchmark.summarize(loudness_ms),
+                roundtrip_ms=benchmark.summarize(roundtrip_ms)['median'],
+                render_ms=render_mean,
+                frame_ms=frame_ms,
+                render_skipped=render_skipped,
+                output_skipped=output_skipped,
+                cpu=sum(cpu) / len(cpu),
+                memory_mb=stats1.memory_usage,
+                loudness_error_db=max(errors),
+                keeps_up=render_skipped == 0 and render_mean < frame_ms and max(errors) < 1.0,
+        )
@@ -5,12 +5,21 @@ Test VNC Source
 import time
 import unittest
 from onsdriver import obstest, obsui
+import capabilities
 import helpers
+import soak
 
 
+@capabilities.requires(input_kinds=('obs_vnc_source',))
 class VNCTest(obstest.OBSTest):
     'Class to test vnc plugin'
 
+    # Checked when environment variable `STATS=1` is set
+    stats_budget = {
+        'render_time_added_ms': 0.5,
+        'render_skipped_frames': 0,
+    }
+
     def setUp(self, config_name='saved-config', run=True):
         super().setUp(run=run, config_name=config_name)
 
@@ -44,21 +53,44 @@ class VNCTest(obstest.OBSTest):
             },
         })
         cl.send('OpenInputPropertiesDialog', { 'inputName': 'vnc' })
-        time.sleep(1)
 
-        w = ui.widget_list(path=[
-            {"className": "OBSBasicProperties"},
-            {},
-            {},
-            {"className": "OBSPropertiesView"},
-        ])
-        labels = [c['text'] for c in helpers.flatten_widgets(w) if c['className']=='QLabel']
+        def _get_labels():
+            w = ui.widget_list(path=[
+                {"className": "OBSBasicProperties"},
+                {},
+                {},
+                {"className": "OBSPropertiesView"},
+            ])
+            return helpers.WidgetTree(w).texts(class_name='QLabel')
+
+        labels = helpers.wait_for(_get_labels, lambda labels: 'Host name' in labels,
+                                  description='properties dialog', ignore=(Exception,))
         print(labels)
         self.assertIn('Host name', labels)
         self.assertIn('Host port', labels)
         self.assertIn('Password', labels)
         self.assertIn('Preferred encodings', labels)
 
+    @helpers.severity(helpers.SEVERITY_SOAK)
+    def test_soak_create_remove(self):
+        cl = self.obs.get_obsws()
+        self.obs.waive_error(waiver_re=r'.*ConnectClientToTcpAddr6: connect')
+
+        def _cycle(_):
+            cl.send('CreateInput', {
+                'inputName': 'vnc',
+                'sceneName': 'Scene',
+                'inputKind': 'obs_vnc_source',
+                'inputSettings': {
+                    'host_name': 'localhost',
+                },
+            })
+            cl.send('RemoveInput', {'inputName': 'vnc'})
+
+        s = soak.Soak('vnc-create-remove')
+        s.run(_cycle)
+        s.assert_trend(self)
+
 
 if __name__ == '__main__':
     unittest.main()